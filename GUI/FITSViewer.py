@@ -1,58 +1,252 @@
+import math
 import os
+import threading
+from collections import OrderedDict
 
-from PyQt5.QtGui import QImage, QPixmap
-from PyQt5.QtWidgets import QLabel, QDialog, QVBoxLayout
-from astropy.io import fits
-import numpy as np
-from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QPixmap, QPainter, QColor
+from PyQt5.QtWidgets import QWidget, QDialog, QVBoxLayout, QToolTip
+from PyQt5.QtCore import Qt, QObject, QRunnable, QThreadPool, QRectF, QPointF, pyqtSignal
 
-class FITSViewer(QLabel):
-    """DS9-like interactive viewer showing pixel counts on mouse move."""
+from GUI.QtImage import array_to_qimage
+from astroreduct.frames import read_plane
+from astroreduct.profiling import span
+from astroreduct.pyramid import ImagePyramid
+from astroreduct.thumbnails import file_stretch_limits
+
+MAX_CACHED_TILES = 256  # 256 x 256 px tiles, about 16 MB of pixmaps
+MAX_ZOOM = 32.0
+
+_tile_pool = None
+
+
+def tile_pool():
+    """Thread pool shared by every viewer for pyramid and tile jobs."""
+    global _tile_pool
+    if _tile_pool is None:
+        _tile_pool = QThreadPool()
+    return _tile_pool
+
+
+class TileSignals(QObject):
+    tile_ready = pyqtSignal(object, object)  # (level, tx, ty), QImage or None if skipped
+    pyramid_ready = pyqtSignal()
+
+
+class TileTask(QRunnable):
+    """Renders one pyramid tile into a QImage, unless it left the view while queued."""
+
+    def __init__(self, pyramid, key, signals, view_state):
+        super().__init__()
+        self.pyramid = pyramid
+        self.key = key
+        self.signals = signals
+        self.view_state = view_state
+
+    def run(self):
+        if self.view_state["closed"] or self.key not in self.view_state["wanted"]:
+            self.signals.tile_ready.emit(self.key, None)
+            return
+        image = array_to_qimage(self.pyramid.tile(*self.key))
+        self.signals.tile_ready.emit(self.key, image)
+
+
+class PyramidTask(QRunnable):
+    def __init__(self, pyramid, signals, cancel):
+        super().__init__()
+        self.pyramid = pyramid
+        self.signals = signals
+        self.cancel = cancel
+
+    def run(self):
+        with span("Build pyramid"):
+            self.pyramid.build(self.cancel)
+        if self.pyramid.ready:
+            self.signals.pyramid_ready.emit()
+
+
+class FITSViewer(QWidget):
+    """DS9-like interactive viewer showing pixel counts on mouse move.
+
+    The frame is drawn from a tile pyramid: wheel to zoom about the cursor,
+    drag to pan, double-click to switch between fit and 1:1. Tiles are
+    rendered off the GUI thread and kept in a bounded LRU cache. Raises
+    ValueError for a file with no image.
+    """
     def __init__(self, fits_file):
         super().__init__()
         self.fits_file = fits_file
 
-        hdul = fits.open(fits_file)
-        self.data = hdul[0].data
-        hdul.close()
+        # Memory-mapped where possible; only the first plane of a cube is read
+        with span("Open viewer", file=os.path.basename(fits_file)):
+            self.data = read_plane(fits_file)
+            if self.data is None:
+                raise ValueError(f"{os.path.basename(fits_file)} contains no image data.")
+            self.img_height, self.img_width = self.data.shape
 
-        self.data = np.nan_to_num(self.data)
-        if self.data.ndim > 2:
-            self.data = self.data[0]
+            vmin, vmax = file_stretch_limits(fits_file, self.data)
+            self.pyramid = ImagePyramid(self.data, vmin, vmax)
 
-        vmin, vmax = np.percentile(self.data, (1, 99))
-        norm_data = np.clip(self.data, vmin, vmax)
-        norm_data = ((norm_data - vmin) / (vmax - vmin) * 255).astype(np.uint8)
+        self.zoom = 1.0  # Screen pixels per frame pixel
+        self.offset = QPointF(0, 0)  # Frame coordinates of the widget's top-left corner
+        self.fitted = True
+        self.drag_start = None
 
-        self.img_height, self.img_width = norm_data.shape
-        image = QImage(norm_data, self.img_width, self.img_height, QImage.Format_Grayscale8)
-        self.pixmap = QPixmap.fromImage(image)
-        self.setPixmap(self.pixmap)
+        self.tiles = OrderedDict()
+        self.pending = set()
+        # Read by queued TileTasks to skip tiles that are no longer needed
+        self.view_state = {"wanted": frozenset(), "closed": False}
+        self.cancel_event = threading.Event()
+        self.signals = TileSignals()
+        self.signals.tile_ready.connect(self.tile_ready)
+        self.signals.pyramid_ready.connect(self.update)
+        if not self.pyramid.ready:
+            tile_pool().start(PyramidTask(self.pyramid, self.signals, self.cancel_event))
 
         self.setMouseTracking(True)
-        self.setAlignment(Qt.AlignCenter)
+        self.setMinimumSize(200, 200)
 
-    def mouseMoveEvent(self, event):
-        x = event.x()
-        y = event.y()
+    # ---- View geometry ----
+    def fit_to_window(self):
+        self.zoom = min(self.width() / self.img_width, self.height() / self.img_height)
+        self.offset = QPointF((self.img_width - self.width() / self.zoom) / 2,
+                              (self.img_height - self.height() / self.zoom) / 2)
+        self.fitted = True
+
+    def zoom_at(self, pos, zoom):
+        """Set the zoom, keeping the frame pixel under ``pos`` in place."""
+        fit = min(self.width() / self.img_width, self.height() / self.img_height)
+        zoom = max(min(fit, 1.0) / 2, min(zoom, MAX_ZOOM))
+        anchor = self.to_image(pos)
+        self.zoom = zoom
+        self.offset = QPointF(anchor.x() - pos.x() / zoom, anchor.y() - pos.y() / zoom)
+        self.fitted = False
+        self.update()
+
+    def to_image(self, pos):
+        return QPointF(self.offset.x() + pos.x() / self.zoom, self.offset.y() + pos.y() / self.zoom)
+
+    # ---- Tiles ----
+    def visible_tiles(self, level):
+        t = self.pyramid.tile_size * self.pyramid.scale(level)
+        cols, rows = self.pyramid.grid(level)
+        x0 = max(0, int(self.offset.x() // t))
+        y0 = max(0, int(self.offset.y() // t))
+        x1 = min(cols - 1, int((self.offset.x() + self.width() / self.zoom) // t))
+        y1 = min(rows - 1, int((self.offset.y() + self.height() / self.zoom) // t))
+        return [(level, tx, ty) for ty in range(y0, y1 + 1) for tx in range(x0, x1 + 1)]
+
+    def request_tile(self, key):
+        if key not in self.pending:
+            self.pending.add(key)
+            tile_pool().start(TileTask(self.pyramid, key, self.signals, self.view_state))
 
-        if self.pixmap.isNull():
+    def stop(self):
+        """Abandon queued tiles and the pyramid build."""
+        self.view_state["closed"] = True
+        self.cancel_event.set()
+
+    def tile_ready(self, key, image):
+        self.pending.discard(key)
+        if image is None:
             return
+        with span("Tile pixmap"):
+            self.tiles[key] = QPixmap.fromImage(image)
+        while len(self.tiles) > MAX_CACHED_TILES:
+            self.tiles.popitem(last=False)
+        self.update()
+
+    def tile_rect(self, level, tx, ty, width, height):
+        """Widget rectangle covered by a ``width`` x ``height`` tile of ``level``."""
+        scale = self.pyramid.scale(level)
+        t = self.pyramid.tile_size * scale
+        return QRectF((tx * t - self.offset.x()) * self.zoom, (ty * t - self.offset.y()) * self.zoom,
+                      width * scale * self.zoom, height * scale * self.zoom)
 
-        label_width = self.width()
-        label_height = self.height()
-        pixmap_width = self.pixmap.width()
-        pixmap_height = self.pixmap.height()
+    def draw_fallback(self, painter, key):
+        """Draw the part of a coarser cached tile that covers ``key``."""
+        level, tx, ty = key
+        t = self.pyramid.tile_size
+        for coarse in range(level + 1, self.pyramid.n_levels):
+            ratio = 2 ** (coarse - level)
+            pixmap = self.tiles.get((coarse, tx // ratio, ty // ratio))
+            if pixmap is None:
+                continue
+            source = QRectF((tx % ratio) * t / ratio, (ty % ratio) * t / ratio, t / ratio, t / ratio)
+            source = source.intersected(QRectF(pixmap.rect()))
+            if source.isEmpty():
+                return
+            target = self.tile_rect(coarse, tx // ratio, ty // ratio, 0, 0).topLeft()
+            scale = self.pyramid.scale(coarse) * self.zoom
+            painter.drawPixmap(QRectF(target.x() + source.x() * scale, target.y() + source.y() * scale,
+                                      source.width() * scale, source.height() * scale), pixmap, source)
+            return
 
-        scale_x = pixmap_width / label_width
-        scale_y = pixmap_height / label_height
+    # ---- Qt events ----
+    def paintEvent(self, event):
+        with span("Paint viewer"):
+            self.paint()
 
-        img_x = int(x * scale_x)
-        img_y = int(y * scale_y)
+    def paint(self):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), QColor(0, 0, 0))
+        if self.fitted:
+            self.fit_to_window()
+
+        level = self.pyramid.level_for_zoom(self.zoom)
+        if level > 0 and not self.pyramid.ready:
+            painter.setPen(QColor(160, 160, 160))
+            painter.drawText(self.rect(), Qt.AlignCenter, "Building preview...")
+            return
 
+        # Below one level pixel per screen pixel draw smoothly, above it show raw pixels
+        painter.setRenderHint(QPainter.SmoothPixmapTransform,
+                              self.zoom * self.pyramid.scale(level) < 1)
+        wanted = self.visible_tiles(level)
+        self.view_state["wanted"] = frozenset(wanted)
+        for key in wanted:
+            pixmap = self.tiles.get(key)
+            if pixmap is None:
+                self.request_tile(key)
+                self.draw_fallback(painter, key)
+                continue
+            self.tiles.move_to_end(key)
+            painter.drawPixmap(self.tile_rect(*key, pixmap.width(), pixmap.height()),
+                               pixmap, QRectF(pixmap.rect()))
+
+    def wheelEvent(self, event):
+        steps = event.angleDelta().y() / 120
+        self.zoom_at(event.pos(), self.zoom * 1.25 ** steps)
+
+    def mouseDoubleClickEvent(self, event):
+        if self.fitted:
+            self.zoom_at(event.pos(), 1.0)
+        else:
+            self.fitted = True
+            self.update()
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.LeftButton:
+            self.drag_start = event.pos()
+
+    def mouseReleaseEvent(self, event):
+        self.drag_start = None
+
+    def mouseMoveEvent(self, event):
+        if self.drag_start is not None:
+            delta = event.pos() - self.drag_start
+            self.drag_start = event.pos()
+            self.offset -= QPointF(delta.x() / self.zoom, delta.y() / self.zoom)
+            self.fitted = False
+            self.update()
+            return
+
+        point = self.to_image(event.pos())
+        img_x, img_y = math.floor(point.x()), math.floor(point.y())
         if 0 <= img_x < self.img_width and 0 <= img_y < self.img_height:
             count = self.data[img_y, img_x]
-            self.setToolTip(f"X: {img_x}, Y: {img_y}, Count: {count:.2f}")
+            text = f"X: {img_x}, Y: {img_y}, Count: {count:.2f}"
+            self.setToolTip(text)
+            QToolTip.showText(event.globalPos(), text, self)
 
 
 class ImageDialog(QDialog):
@@ -63,12 +257,13 @@ class ImageDialog(QDialog):
         self.setWindowTitle(os.path.basename(fits_file))
 
         layout = QVBoxLayout()
-        viewer = FITSViewer(fits_file)
-        viewer.setScaledContents(True)  # Image scales to fit QLabel
-        layout.addWidget(viewer)
+        self.viewer = FITSViewer(fits_file)
+        layout.addWidget(self.viewer)
         self.setLayout(layout)
 
-        # Set a reasonable fixed size (you can adjust as needed)
         self.setMinimumSize(400, 400)
-        self.setMaximumSize(800, 600)  # Won’t grow beyond this size
-        self.resize(600, 500)  # Default initial size
\ No newline at end of file
+        self.resize(600, 500)  # Default initial size
+
+    def done(self, result):
+        self.viewer.stop()
+        super().done(result)
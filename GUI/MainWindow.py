@@ -1,11 +1,27 @@
+import importlib
+import threading
+from functools import partial
+
 from PyQt5.QtWidgets import (QMainWindow, QWidget,
                              QVBoxLayout,
                              QStackedWidget)
+from PyQt5.QtCore import QTimer
 
-from GUI.ProcessingScreen import ProcessingScreen
 from GUI.StarryBackground import StarryBackground
 from GUI.WelcomeScreen import WelcomeScreen
 
+# Imported in the background once the welcome screen is up, so opening the
+# processing screen does not wait for astropy and numpy
+PRELOAD_MODULES = ("numpy", "astropy.io.fits", "GUI.ProcessingScreen")
+
+
+def preload_modules():
+    for name in PRELOAD_MODULES:
+        try:
+            importlib.import_module(name)
+        except Exception:
+            return  # Imported again, with the real error, when the screen is opened
+
 
 class MainWindow(QMainWindow):
     def __init__(self):
@@ -31,13 +47,12 @@ class MainWindow(QMainWindow):
         self.stacked_widget = QStackedWidget()
         self.stacked_widget.setStyleSheet("background: transparent;")
 
-        # Create screens
+        # Create screens; the processing screen is built the first time it is opened
         self.welcome_screen = WelcomeScreen()
-        self.processing_screen = ProcessingScreen()
+        self.processing_screen = None
 
         # Add screens to stacked widget
         self.stacked_widget.addWidget(self.welcome_screen)
-        self.stacked_widget.addWidget(self.processing_screen)
         self.welcome_screen.start_processing_signal.connect(self.show_processing_screen)
         # Add stacked widget to background
         self.background_layout = QVBoxLayout(self.background)
@@ -46,5 +61,15 @@ class MainWindow(QMainWindow):
         # Connect the welcome screen button
         self.welcome_screen.start_processing = self.show_processing_screen
 
+        # Load the engine in the background once the event loop is running
+        QTimer.singleShot(0, lambda: threading.Thread(target=preload_modules, daemon=True).start())
+
     def show_processing_screen(self):
-        self.stacked_widget.setCurrentIndex(1)
\ No newline at end of file
+        if self.processing_screen is None:
+            from GUI.ProcessingScreen import ProcessingScreen
+            self.processing_screen = ProcessingScreen()
+            self.stacked_widget.addWidget(self.processing_screen)
+            # No twinkling while a reduction runs, so it gets the CPU
+            self.processing_screen.job_running.connect(partial(self.background.set_paused, "job"))
+            self.processing_screen.queue_running.connect(partial(self.background.set_paused, "queue"))
+        self.stacked_widget.setCurrentWidget(self.processing_screen)
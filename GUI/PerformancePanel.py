@@ -0,0 +1,122 @@
+from PyQt5.QtCore import Qt, QTimer
+from PyQt5.QtWidgets import (QCheckBox, QDialog, QFileDialog, QHBoxLayout, QHeaderView, QLabel,
+                             QMessageBox, QPushButton, QTreeWidget, QTreeWidgetItem, QVBoxLayout)
+
+from astroreduct import profiling
+
+REFRESH_MS = 1000  # Table refresh interval while the panel is open
+COLUMNS = ("Span", "Count", "Total (s)", "Mean (ms)", "Max (ms)", "Read (MB)", "Written (MB)", "Peak RSS (MB)")
+
+
+def megabytes(n):
+    return "" if n is None else f"{n / 1024 ** 2:.1f}"
+
+
+class SpanItem(QTreeWidgetItem):
+    """Table row that sorts numeric columns by value rather than text."""
+
+    def __lt__(self, other):
+        column = self.treeWidget().sortColumn()
+        mine, theirs = self.data(column, Qt.UserRole), other.data(column, Qt.UserRole)
+        if mine is None or theirs is None:
+            return super().__lt__(other)
+        return mine < theirs
+
+
+class PerformancePanel(QDialog):
+    """Where reductions spend their time: profiling spans summed per name.
+
+    Recording is switched on with the checkbox and stays off otherwise, so
+    the instrumented code costs next to nothing. "Export Trace" saves every
+    span for chrome://tracing or Perfetto.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Performance")
+        self.resize(820, 420)
+
+        self.record_box = QCheckBox("Record timings")
+        self.record_box.setChecked(profiling.is_enabled())
+        self.record_box.toggled.connect(self.set_recording)
+
+        self.table = QTreeWidget()
+        self.table.setRootIsDecorated(False)
+        self.table.setSortingEnabled(True)
+        self.table.setHeaderLabels(COLUMNS)
+        self.table.header().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.table.sortByColumn(2, Qt.DescendingOrder)
+
+        self.status = QLabel()
+
+        clear_btn = QPushButton("Clear")
+        clear_btn.clicked.connect(self.clear)
+        export_btn = QPushButton("Export Trace...")
+        export_btn.clicked.connect(self.export_trace)
+
+        top = QHBoxLayout()
+        top.addWidget(self.record_box)
+        top.addStretch()
+        top.addWidget(clear_btn)
+        top.addWidget(export_btn)
+
+        layout = QVBoxLayout()
+        layout.addLayout(top)
+        layout.addWidget(self.table)
+        layout.addWidget(self.status)
+        self.setLayout(layout)
+
+        self.timer = QTimer(self)
+        self.timer.setInterval(REFRESH_MS)
+        self.timer.timeout.connect(self.refresh)
+        self.refresh()
+
+    def set_recording(self, on):
+        if on:
+            profiling.enable()
+        else:
+            profiling.disable()
+        self.refresh()
+
+    def refresh(self):
+        recorded = profiling.records()
+        self.table.setSortingEnabled(False)
+        self.table.clear()
+        for row in profiling.summary(recorded):
+            item = SpanItem([
+                row["name"], str(row["count"]), f"{row['total']:.3f}", f"{row['mean'] * 1000:.2f}",
+                f"{row['max'] * 1000:.2f}", megabytes(row["bytes_read"]),
+                megabytes(row["bytes_written"]), megabytes(row["peak_rss"]),
+            ])
+            for column, value in enumerate((row["count"], row["total"], row["mean"], row["max"],
+                                            row["bytes_read"], row["bytes_written"],
+                                            row["peak_rss"] or 0), start=1):
+                item.setData(column, Qt.UserRole, value)
+                item.setTextAlignment(column, Qt.AlignRight | Qt.AlignVCenter)
+            self.table.addTopLevelItem(item)
+        self.table.setSortingEnabled(True)
+        state = "recording" if profiling.is_enabled() else "not recording"
+        self.status.setText(f"{len(recorded)} spans, {state}")
+
+    def clear(self):
+        profiling.clear()
+        self.refresh()
+
+    def export_trace(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Export Chrome Trace", "astroreduct-trace.json",
+                                              "Trace files (*.json)")
+        if not path:
+            return
+        try:
+            profiling.write_chrome_trace(path)
+        except OSError as e:
+            QMessageBox.critical(self, "Export failed", str(e))
+
+    def showEvent(self, event):
+        self.refresh()
+        self.timer.start()
+        super().showEvent(event)
+
+    def hideEvent(self, event):
+        self.timer.stop()
+        super().hideEvent(event)
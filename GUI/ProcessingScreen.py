@@ -1,41 +1,139 @@
 import os
-import shutil
-
-import numpy as np
-from PyQt5.QtWidgets import (QWidget, QLabel, QPushButton, QVBoxLayout, QHBoxLayout,
-                             QFileDialog, QMessageBox, QProgressBar, QTabWidget, QScrollArea, QGridLayout)
-from PyQt5.QtCore import Qt
-from PyQt5.QtGui import QFont, QPixmap, QImage
-from astropy.io import fits
+
+from PyQt5.QtWidgets import (QWidget, QLabel, QPushButton, QVBoxLayout, QHBoxLayout, QFileDialog,
+                             QInputDialog, QMessageBox, QProgressBar, QTabWidget)
+from PyQt5.QtCore import Qt, QThreadPool, pyqtSignal
+from PyQt5.QtGui import QFont
 from functools import partial
 from GUI.FITSViewer import ImageDialog
-
-
-def open_image_dialog(file_path, _):
+from GUI.PerformancePanel import PerformancePanel
+from GUI.QueuePanel import QueuePanel
+from GUI.ThumbnailGrid import ThumbnailGrid
+from GUI.Worker import Worker
+from astroreduct.calibrate import calibrate_lights, make_master_dark, make_master_flat
+from astroreduct.catalogue import group_label, scan_groups
+from astroreduct.combine import DEFAULT_MEMORY_LIMIT, combine_to_file
+from astroreduct.frames import fits_files_in
+from astroreduct.library import add_master, find_master
+from astroreduct.normalize import stretch_limits
+from astroreduct.output import DEFAULT_BITPIX, wait_for_write
+from astroreduct.profiling import span
+from astroreduct.results import ResultCache
+from astroreduct.session import manifest_frames, write_manifest
+from astroreduct.stacking import stack_lights
+from astroreduct.thumbnails import thumbnail_from_array
+
+# Share of the progress bar given to each stage of a combine job
+STAGE_PROGRESS = {
+    "Loading frames": (0, 10),
+    "Combining": (10, 90),
+    "Writing": (90, 100),
+    "Calibrating": (0, 100),
+    "Registering": (0, 100),
+    "Scanning headers": (0, 100),
+    "Reading headers": (0, 100),
+}
+
+# Master frame written into each stage folder
+MASTER_FILES = {
+    "BIAS": "MasterBias.fits",
+    "DARK": "MasterDark.fits",
+    "FLAT": "MasterFlat.fits",
+}
+
+# Aligned and combined lights, written into the LIGHTS folder
+STACKED_FILE = "Stacked.fits"
+
+# Catalogue group kind offered to each stage by "Scan Folder"
+STAGE_KINDS = {
+    "BIAS": "bias",
+    "DARK": "dark",
+    "FLAT": "flat",
+    "LIGHTS": "light",
+}
+
+# Copy uploaded frames into the stage folder instead of reading them where they are
+COPY_INPUTS = False
+
+# Keep every master in the master library, and use the nearest one from it when a stage has none
+USE_LIBRARY = True
+
+
+def masters_note(*masters):
+    """Message lines naming the masters a job used, so library matches are visible."""
+    lines = [os.path.relpath(m) if m.startswith(os.getcwd()) else m for m in masters if m is not None]
+    return "".join(f"\nUsing {line}" for line in lines)
+
+
+def finish_master(output_file, kind, progress=None, cancel=None):
+    """Wait for a master's background write, then add it to the master library."""
+    wait_for_write(output_file)
+    if USE_LIBRARY:
+        add_master(output_file, kind)
+
+
+def select_inputs(stage_dir, files, master_file, progress=None, cancel=None):
+    """Record ``files`` as a stage's inputs, removing its master if that was made from other frames.
+
+    The combine state is kept, so the new master can still be updated
+    incrementally from the old one's frames.
+    """
+    old = manifest_frames(stage_dir, check=False) if os.path.isdir(stage_dir) else None
+    if COPY_INPUTS and os.path.isdir(stage_dir):
+        for f in os.listdir(stage_dir):
+            file_path = os.path.join(stage_dir, f)
+            if os.path.isfile(file_path):
+                os.remove(file_path)
+
+    # Frames are read from where they are; the manifest records which ones
+    manifest = write_manifest(stage_dir, files, copy=COPY_INPUTS, progress=progress, cancel=cancel)
+    new = [entry["path"] for entry in manifest["frames"]]
+    if master_file is not None and sorted(old or []) != sorted(new):
+        master = os.path.join(stage_dir, master_file)
+        wait_for_write(master)
+        if os.path.exists(master):
+            os.remove(master)  # Stale: later stages must not pick it up instead of the library
+
+
+def open_image_dialog(file_path):
     """Open FITS image in DS9-like dialog."""
-    dialog = ImageDialog(file_path)
+    try:
+        dialog = ImageDialog(file_path)
+    except (OSError, ValueError) as e:
+        QMessageBox.warning(None, "Cannot open image", str(e))
+        return
     dialog.setAttribute(Qt.WA_DeleteOnClose)  # Ensure proper deletion
     dialog.exec_()
 
 
 class ProcessingScreen(QWidget):
+    job_running = pyqtSignal(bool)  # A reduction job started (True) or ended (False)
+    queue_running = pyqtSignal(bool)  # The batch queue runner started (True) or stopped (False)
+
     def __init__(self):
         super().__init__()
         self.current_files = None
-        self.flat_images_layout = None
-        self.lights_images_layout = None
-        self.bias_images_layout = None
+        self.flat_grid = None
+        self.lights_grid = None
+        self.bias_grid = None
+        self.dark_grid = None
         self.lights_tab = None
         self.bias_tab = None
+        self.dark_tab = None
         self.flat_tab = None
         self.tabs = None
+        self.worker = None
+        self.job_tab = None
+        self.performance_panel = None
+        self.queue_panel = None
+        self.thread_pool = QThreadPool.globalInstance()
         self.initUI()
 
     def initUI(self):
         main_layout = QVBoxLayout()
         main_layout.setContentsMargins(0, 0, 0, 0)
 
-        # Create tab widget for Bias, Flat, Lights
+        # Create tab widget for Bias, Dark, Flat, Lights
         self.tabs = QTabWidget()
         self.tabs.setStyleSheet("""
                     QTabWidget::pane { border: 0; background: transparent; }
@@ -44,13 +142,27 @@ class ProcessingScreen(QWidget):
                 """)
         main_layout.addWidget(self.tabs)
 
+        # Nights queued for unattended reduction, and timings of every read, combine and write
+        corner = QWidget()
+        corner_layout = QHBoxLayout(corner)
+        corner_layout.setContentsMargins(0, 0, 0, 0)
+        corner_layout.setSpacing(2)
+        for label, slot in (("Queue", self.show_queue), ("Performance", self.show_performance)):
+            btn = QPushButton(label)
+            btn.setStyleSheet("background: #222222; color: white; padding: 6px 12px; border: none;")
+            btn.clicked.connect(slot)
+            corner_layout.addWidget(btn)
+        self.tabs.setCornerWidget(corner, Qt.TopRightCorner)
+
         # Create individual tabs
         self.bias_tab = self.create_stage_tab("Bias frames processing")
+        self.dark_tab = self.create_stage_tab("Dark frames processing")
         self.flat_tab = self.create_stage_tab("Flat frames processing")
         self.lights_tab = self.create_stage_tab("Light frames processing")
 
         # Add tabs
         self.tabs.addTab(self.bias_tab, "Bias")
+        self.tabs.addTab(self.dark_tab, "Dark")
         self.tabs.addTab(self.flat_tab, "Flat")
         self.tabs.addTab(self.lights_tab, "Lights")
 
@@ -92,6 +204,23 @@ class ProcessingScreen(QWidget):
         """)
         upload_btn.clicked.connect(self.upload_images)
 
+        # Scan button: pick this stage's frames out of a whole night's folder by header
+        scan_btn = QPushButton("Scan Folder")
+        scan_btn.setMinimumHeight(40)
+        scan_btn.setStyleSheet("""
+            QPushButton {
+                background-color: #3a7ebc;
+                color: white;
+                border: none;
+                border-radius: 5px;
+                font-weight: bold;
+            }
+            QPushButton:hover {
+                background-color: #4a8ecc;
+            }
+        """)
+        scan_btn.clicked.connect(self.scan_folder)
+
         # Process button
         process_btn = QPushButton("Process Images")
         process_btn.setMinimumHeight(40)
@@ -112,14 +241,36 @@ class ProcessingScreen(QWidget):
         """)
         process_btn.setEnabled(False)
         process_btn.clicked.connect(self.process_images)
+
+        # Cancel button, shown while a job runs
+        cancel_btn = QPushButton("Cancel")
+        cancel_btn.setMinimumHeight(40)
+        cancel_btn.setStyleSheet("""
+            QPushButton {
+                background-color: #a83a3a;
+                color: white;
+                border: none;
+                border-radius: 5px;
+                font-weight: bold;
+            }
+            QPushButton:hover {
+                background-color: #b84a4a;
+            }
+        """)
+        cancel_btn.setVisible(False)
+        cancel_btn.clicked.connect(self.cancel_processing)
+
         # Progress bar
         progress = QProgressBar()
+        progress.setRange(0, 100)
         progress.setVisible(False)
 
         # Buttons layout
         btn_layout = QHBoxLayout()
         btn_layout.addWidget(upload_btn)
+        btn_layout.addWidget(scan_btn)
         btn_layout.addWidget(process_btn)
+        btn_layout.addWidget(cancel_btn)
 
         # Add widgets to layout
         layout.addWidget(stage_label)
@@ -129,29 +280,128 @@ class ProcessingScreen(QWidget):
         layout.setSpacing(10)  # vertical spacing between widgets
         layout.setContentsMargins(10, 10, 10, 10)  # reduce outer margins
 
-        scroll_area = QScrollArea()
-        scroll_area.setWidgetResizable(True)
-        images_container = QWidget()
-        images_layout = QGridLayout()
-        images_container.setLayout(images_layout)
-        # Also adjust the images grid layout:
-        images_layout.setSpacing(5)  # minimal space between images
-        images_layout.setContentsMargins(0, 0, 0, 0)
-        scroll_area.setWidget(images_container)
-        layout.addWidget(scroll_area)
+        # Only the thumbnails in view are decoded, however many frames there are
+        grid = ThumbnailGrid(on_open=open_image_dialog)
+        layout.addWidget(grid)
 
         # Keep references depending on the stage
         if "Bias" in stage_name:
-            self.bias_images_layout = images_layout
+            self.bias_grid = grid
+        elif "Dark" in stage_name:
+            self.dark_grid = grid
         elif "Flat" in stage_name:
-            self.flat_images_layout = images_layout
+            self.flat_grid = grid
         elif "Light" in stage_name:
-            self.lights_images_layout = images_layout
+            self.lights_grid = grid
+
+        tab.upload_btn = upload_btn
+        tab.scan_btn = scan_btn
+        tab.process_btn = process_btn
+        tab.cancel_btn = cancel_btn
+        tab.progress = progress
 
         tab.setLayout(layout)
         return tab
 
+    def job_busy(self):
+        """True, after telling the user, while a job runs; jobs run one at a time."""
+        if self.worker is None:
+            return False
+        stage = self.tabs.tabText(self.tabs.indexOf(self.job_tab))
+        QMessageBox.information(self.window(), "Busy",
+                                f"Please wait for the {stage} job to finish, or cancel it.")
+        return True
+
+    def start_job(self, fn, *args, on_finished, job_tab=None, **kwargs):
+        """Run ``fn`` on the thread pool, reporting into ``job_tab`` (default: the current tab)."""
+        if self.job_busy():
+            return
+        self.job_tab = job_tab or self.tabs.currentWidget()
+        self.worker = Worker(fn, *args, **kwargs)
+        self.worker.signals.progress.connect(self.update_progress)
+        self.worker.signals.finished.connect(on_finished)
+        self.worker.signals.error.connect(self.job_failed)
+        self.worker.signals.cancelled.connect(self.job_cancelled)
+        self.set_job_running(True)
+        self.thread_pool.start(self.worker)
+
+    def set_job_running(self, running):
+        tab = self.job_tab
+        tab.upload_btn.setEnabled(not running)
+        tab.scan_btn.setEnabled(not running)
+        tab.process_btn.setEnabled(not running)
+        tab.cancel_btn.setVisible(running)
+        tab.cancel_btn.setEnabled(True)
+        tab.progress.setVisible(running)
+        tab.progress.setValue(0)
+        if not running:
+            self.worker = None
+        self.job_running.emit(running)
+
+    def update_progress(self, stage, done, total):
+        start, end = STAGE_PROGRESS.get(stage, (0, 100))
+        fraction = done / total if total else 1.0
+        self.job_tab.progress.setValue(int(start + (end - start) * fraction))
+        self.job_tab.progress.setFormat(f"{stage} ({done}/{total}) %p%")
+
+    def cancel_processing(self):
+        if self.worker is not None:
+            self.worker.cancel()
+            self.job_tab.cancel_btn.setEnabled(False)
+            self.job_tab.progress.setFormat("Cancelling...")
+
+    def job_cancelled(self):
+        self.set_job_running(False)
+        QMessageBox.information(self.window(), "Cancelled", "Processing was cancelled.")
+
+    def job_failed(self, message):
+        self.set_job_running(False)
+        QMessageBox.critical(self.window(), "Processing failed", message)
+
+    def grid_for(self, stage_name):
+        if stage_name == "BIAS":
+            return self.bias_grid
+        elif stage_name == "DARK":
+            return self.dark_grid
+        elif stage_name == "FLAT":
+            return self.flat_grid
+        return self.lights_grid
+
+    def tab_for(self, stage_name):
+        return {"BIAS": self.bias_tab, "DARK": self.dark_tab, "FLAT": self.flat_tab}.get(stage_name,
+                                                                                          self.lights_tab)
+
+    def stage_frames(self, stage_name):
+        """Input frames of a stage: those in its manifest, else the FITS files in its folder."""
+        folder = os.path.join(os.getcwd(), stage_name)
+        if not os.path.isdir(folder):
+            return []
+        frames = manifest_frames(folder)
+        if frames is not None:
+            return frames
+        return [f for f in fits_files_in(folder) if os.path.basename(f) != MASTER_FILES.get(stage_name)]
+
+    def master_path(self, stage_name):
+        return os.path.join(os.getcwd(), stage_name, MASTER_FILES[stage_name])
+
+    def state_path(self, stage_name):
+        return os.path.join(os.getcwd(), stage_name, ".combine_state")
+
+    def find_master(self, stage_name, frames):
+        """This session's master for a stage, else the library's nearest match for ``frames``, else None."""
+        path = self.master_path(stage_name)
+        if os.path.exists(path):
+            return path
+        if USE_LIBRARY:
+            try:
+                return find_master(STAGE_KINDS[stage_name], frames[0])
+            except (OSError, ValueError):
+                return None
+        return None
+
     def process_images(self):
+        if self.job_busy():
+            return
         main_window = self.window()
         current_tab_index = self.tabs.currentIndex()
         stage_name = self.tabs.tabText(current_tab_index).upper()
@@ -160,117 +410,238 @@ class ProcessingScreen(QWidget):
             QMessageBox.warning(main_window, "No files", "Please upload images first.")
             return
 
-        dest_folder = os.path.join(os.getcwd(), stage_name)
+        try:
+            frames = self.stage_frames(stage_name)
+        except ValueError as e:
+            QMessageBox.warning(main_window, "Frames changed", f"{e}\nPlease upload them again.")
+            return
+        if len(frames) == 0:
+            QMessageBox.warning(main_window, "No files", f"No {stage_name.lower()} frames found.")
+            return
 
         # --- BIAS PROCESSING ---
         if stage_name == "BIAS":
+            # =================== CONFIGURATION ===================
+            output_file = self.master_path("BIAS")
+            combine_method = "median"  # 'median' or 'average'
+            reject_method = "minmax"  # 'minmax', 'sigclip', 'pclip', or None
+            nlow = 0  # Minmax low pixels to reject
+            nhigh = 1  # Minmax high pixels to reject
+            lsigma = 3.0  # Sigclip/pclip low rejection threshold
+            hsigma = 3.0  # Sigclip/pclip high rejection threshold
+            pclip = -0.5  # Pclip: fraction of the way from median to lowest value
+            scale = "none"  # 'none', 'median', 'mean', 'mode'
+            statsec = None  # Optional section: [x1, x2, y1, y2]
+            blank = 0.0  # Value for empty pixels
+            clobber = True
+            memory_limit = DEFAULT_MEMORY_LIMIT  # Bytes of stack held in memory at once
+            workers = os.cpu_count()  # Processes combining row bands in parallel
+            incremental = True  # Keep a combine state so added/removed frames update the master
+            use_cache = True  # Reuse the stored master when frames and settings are unchanged
+            bitpix = DEFAULT_BITPIX  # 'float64'; 'float32' halves the file, 'int16' uses BZERO/BSCALE
+            compression = None  # Tile compression: None, 'rice' (lossy for float pixels) or 'gzip'
+            background_write = True  # Show the master while it is still being written
+            # =====================================================
 
-            bias_files = [os.path.join(dest_folder, f) for f in os.listdir(dest_folder)
-                          if f.lower().endswith((".fits", ".fit", ".fts"))]
+            state_dir = self.state_path("BIAS") if incremental else None
+            cache = ResultCache() if use_cache else None
+            # --- Reject, combine and save Master Bias in the background ---
+            self.start_job(combine_to_file, frames, output_file, overwrite=clobber,
+                           combine_method=combine_method, reject_method=reject_method,
+                           nlow=nlow, nhigh=nhigh, scale=scale, statsec=statsec,
+                           blank=blank, memory_limit=memory_limit, workers=workers,
+                           state_dir=state_dir, cache=cache, lsigma=lsigma, hsigma=hsigma,
+                           pclip=pclip, bitpix=bitpix, compression=compression, background=background_write,
+                           on_finished=partial(self.master_finished, "BIAS", output_file, "Master Bias", ""))
+
+        # --- DARK PROCESSING ---
+        elif stage_name == "DARK":
+            master_bias = self.find_master("BIAS", frames)
+            if master_bias is None:
+                QMessageBox.warning(main_window, "No master bias", "Please create the master bias first.")
+                return
 
-            if len(bias_files) == 0:
-                QMessageBox.warning(main_window, "No files", "No bias frames found.")
+            # =================== CONFIGURATION ===================
+            output_file = self.master_path("DARK")
+            combine_method = "median"  # 'median' or 'average'
+            reject_method = "minmax"  # 'minmax', 'sigclip', 'pclip', or None
+            nlow = 0  # Minmax low pixels to reject
+            nhigh = 1  # Minmax high pixels to reject
+            lsigma = 3.0  # Sigclip/pclip low rejection threshold
+            hsigma = 3.0  # Sigclip/pclip high rejection threshold
+            scale = "none"  # Darks keep their counts, so they can be scaled by exposure time later
+            blank = 0.0  # Value for empty pixels
+            clobber = True
+            memory_limit = DEFAULT_MEMORY_LIMIT  # Bytes of stack held in memory at once
+            workers = os.cpu_count()  # Processes combining row bands in parallel
+            incremental = True  # Keep a combine state so added/removed frames update the master
+            use_cache = True  # Reuse the stored master when frames and settings are unchanged
+            bitpix = DEFAULT_BITPIX  # 'float64'; 'float32' halves the file, 'int16' uses BZERO/BSCALE
+            compression = None  # Tile compression: None, 'rice' (lossy for float pixels) or 'gzip'
+            background_write = True  # Show the master while it is still being written
+            # =====================================================
+
+            state_dir = self.state_path("DARK") if incremental else None
+            cache = ResultCache() if use_cache else None
+            # --- Subtract bias, combine and save Master Dark in the background ---
+            self.start_job(make_master_dark, frames, output_file, master_bias, overwrite=clobber,
+                           combine_method=combine_method, reject_method=reject_method,
+                           nlow=nlow, nhigh=nhigh, scale=scale, blank=blank,
+                           memory_limit=memory_limit, workers=workers, state_dir=state_dir,
+                           cache=cache, lsigma=lsigma, hsigma=hsigma, bitpix=bitpix,
+                           compression=compression, background=background_write,
+                           on_finished=partial(self.master_finished, "DARK", output_file, "Master Dark",
+                                               masters_note(master_bias)))
+
+        # --- FLAT PROCESSING ---
+        elif stage_name == "FLAT":
+            master_bias = self.find_master("BIAS", frames)
+            if master_bias is None:
+                QMessageBox.warning(main_window, "No master bias", "Please create the master bias first.")
                 return
 
             # =================== CONFIGURATION ===================
-            output_file = os.path.join(dest_folder, "MasterBias.fits")
+            output_file = self.master_path("FLAT")
             combine_method = "median"  # 'median' or 'average'
             reject_method = "minmax"  # 'minmax', 'sigclip', 'pclip', or None
             nlow = 0  # Minmax low pixels to reject
             nhigh = 1  # Minmax high pixels to reject
-            scale = "none"  # 'none', 'median', 'mean', 'mode'
-            statsec = None  # Optional section: [x1, x2, y1, y2]
+            lsigma = 3.0  # Sigclip/pclip low rejection threshold
+            hsigma = 3.0  # Sigclip/pclip high rejection threshold
+            scale = "median"  # Each flat is normalised by its median before combining
             blank = 0.0  # Value for empty pixels
             clobber = True
+            memory_limit = DEFAULT_MEMORY_LIMIT  # Bytes of stack held in memory at once
+            workers = os.cpu_count()  # Processes combining row bands in parallel
+            incremental = True  # Keep a combine state so added/removed frames update the master
+            use_cache = True  # Reuse the stored master when frames and settings are unchanged
+            bitpix = DEFAULT_BITPIX  # 'float64'; 'float32' halves the file, 'int16' uses BZERO/BSCALE
+            compression = None  # Tile compression: None, 'rice' (lossy for float pixels) or 'gzip'
+            background_write = True  # Show the master while it is still being written
+            use_dark = True  # Subtract a master dark scaled to the flats' exposure, if there is one
             # =====================================================
 
-            # --- Load all images into stack ---
-            frames = []
-            for bf in bias_files:
-                data = fits.getdata(bf).astype(np.float64)
-                if statsec:
-                    x1, x2, y1, y2 = map(int, statsec)
-                    data = data[y1:y2, x1:x2]
-                frames.append(data)
-            stack = np.array(frames)  # shape: (N_images, height, width)
-
-            # --- Apply minmax rejection ---
-            if reject_method.lower() == "minmax":
-                if len(stack) > nlow + nhigh:
-                    stack_sorted = np.sort(stack, axis=0)
-                    stack_rejected = stack_sorted[nlow: len(stack_sorted) - nhigh, :, :]
-                else:
-                    stack_rejected = stack
-            else:
-                stack_rejected = stack
-
-            # Replace NaNs with blank
-            stack_rejected = np.nan_to_num(stack_rejected, nan=blank)
-
-            # --- Apply scaling ---
-            scaled_stack = stack_rejected.copy()
-            if scale.lower() not in ("none", ""):
-                for i in range(scaled_stack.shape[0]):
-                    img = scaled_stack[i]
-                    factor = 1.0
-                    if scale.lower() == "median":
-                        factor = np.median(img)
-                    elif scale.lower() == "mean":
-                        factor = np.mean(img)
-                    elif scale.lower() == "mode":
-                        factor = np.median(img) - 1.4826 * np.median(np.abs(img - np.median(img)))
-                    if factor != 0:
-                        scaled_stack[i] = img / factor
-
-            # --- Combine images ---
-            if combine_method.lower() == "median":
-                master = np.median(scaled_stack, axis=0)
-            elif combine_method.lower() == "average":
-                master = np.mean(scaled_stack, axis=0)
-            else:
-                raise ValueError(f"Unknown combine method: {combine_method}")
-
-            # --- Save Master Bias ---
-            fits.writeto(output_file, master, overwrite=clobber)
-            # ---- Display MASTER BIAS in UI ----
-            master_bias_path = os.path.join(dest_folder, 'MasterBias.fits')
-
-            # Clear grid
-            for i in reversed(range(self.bias_images_layout.count())):
-                widget = self.bias_images_layout.itemAt(i).widget()
-                if widget:
-                    widget.setParent(None)
-
-            # Create thumbnail
-            with fits.open(master_bias_path) as hdul:
-                data = np.nan_to_num(hdul[0].data)
-
-            vmin, vmax = np.percentile(data, (1, 99))
-            data = np.clip(data, vmin, vmax)
-            data = ((data - vmin) / (vmax - vmin) * 255).astype(np.uint8)
-            if data.ndim > 2:
-                data = data[0]
-
-            data_copy = data.copy()
-            h, w = data_copy.shape
-            image = QImage(data_copy.data, w, h, w, QImage.Format_Grayscale8)
-            image = image.copy()  # VERY IMPORTANT
-            pixmap = QPixmap.fromImage(image).scaled(200, 200, Qt.KeepAspectRatio, Qt.SmoothTransformation)
-
-            label = QLabel()
-            label.setPixmap(pixmap)
-            label.setToolTip("Master Bias")
-            label.setAlignment(Qt.AlignCenter)
-
-            label.mousePressEvent = lambda event, fp=master_bias_path: open_image_dialog(fp, event)
-
-            self.bias_images_layout.addWidget(label, 0, 0)
-            # Enable Process button ONLY for BIAS tab
-            process_btn = self.tabs.currentWidget().findChildren(QPushButton)[1]
-            process_btn.setEnabled(False)
-            QMessageBox.information(main_window, "Master Bias Created", "MasterBias.fits has been successfully generated!")
+            master_dark = self.find_master("DARK", frames) if use_dark else None
+            state_dir = self.state_path("FLAT") if incremental else None
+            cache = ResultCache() if use_cache else None
+            # --- Subtract bias (and dark), combine, normalise and save Master Flat in the background ---
+            self.start_job(make_master_flat, frames, output_file, master_bias, master_dark=master_dark,
+                           overwrite=clobber, combine_method=combine_method, reject_method=reject_method,
+                           nlow=nlow, nhigh=nhigh, scale=scale, blank=blank,
+                           memory_limit=memory_limit, workers=workers, state_dir=state_dir,
+                           cache=cache, lsigma=lsigma, hsigma=hsigma, bitpix=bitpix,
+                           compression=compression, background=background_write,
+                           on_finished=partial(self.master_finished, "FLAT", output_file, "Master Flat",
+                                               masters_note(master_bias, master_dark)))
+
+        # --- LIGHTS CALIBRATION ---
+        else:
+            master_bias = self.find_master("BIAS", frames)
+            master_flat = self.find_master("FLAT", frames)
+            if master_bias is None or master_flat is None:
+                QMessageBox.warning(main_window, "No masters",
+                                    "Please create the master bias and master flat first.")
+                return
+
+            # =================== CONFIGURATION ===================
+            output_dir = os.path.join(os.getcwd(), stage_name, "calibrated")
+            blank = 0.0  # Value where the flat is zero
+            clobber = True
+            memory_limit = DEFAULT_MEMORY_LIMIT  # Bytes of lights held in memory at once
+            workers = os.cpu_count()  # Threads writing calibrated frames, processes stacking them
+            stack = True  # Align the calibrated lights and combine them into one image
+            stacked_file = os.path.join(os.getcwd(), stage_name, STACKED_FILE)
+            reference = 0  # Index of the frame the others are aligned to
+            combine_method = "average"  # 'median' or 'average'
+            reject_method = "sigclip"  # 'minmax', 'sigclip', 'pclip', or None
+            nlow = 0  # Minmax low pixels to reject
+            nhigh = 1  # Minmax high pixels to reject
+            lsigma = 3.0  # Sigclip/pclip low rejection threshold
+            hsigma = 3.0  # Sigclip/pclip high rejection threshold
+            min_peak = 0.05  # Frames that correlate worse than this with the reference are left out
+            use_dark = True  # Subtract a master dark scaled to each light's exposure, if there is one
+            # =====================================================
+
+            master_dark = self.find_master("DARK", frames) if use_dark else None
+            note = masters_note(master_bias, master_dark, master_flat)
+
+            stack_options = None
+            if stack:
+                stack_options = dict(output_file=stacked_file, reference=reference, min_peak=min_peak,
+                                     combine_method=combine_method, reject_method=reject_method,
+                                     nlow=nlow, nhigh=nhigh, lsigma=lsigma, hsigma=hsigma,
+                                     blank=blank, memory_limit=memory_limit, workers=workers,
+                                     overwrite=clobber)
+            # --- (light - MasterBias - MasterDark) / MasterFlat, in batches, in the background ---
+            self.start_job(calibrate_lights, frames, output_dir, master_bias, master_flat,
+                           master_dark=master_dark, blank=blank, memory_limit=memory_limit,
+                           workers=workers, overwrite=clobber,
+                           on_finished=partial(self.lights_finished, stack_options, note))
+
+    def master_finished(self, stage_name, output_file, title, note, master):
+        self.set_job_running(False)
+        main_window = self.window()
+        # --- Let the write finish and keep a copy for later nights; nobody waits for it ---
+        writer = Worker(finish_master, output_file, STAGE_KINDS[stage_name])
+        writer.signals.error.connect(self.write_failed)
+        self.thread_pool.start(writer)
+
+        # ---- Display the master frame in UI, from memory rather than the file ----
+        with span("Master preview"):
+            thumb = thumbnail_from_array(master, *stretch_limits(master))
+        grid = self.grid_for(stage_name)
+        grid.set_files([output_file])
+        grid.set_thumbnail(0, thumb)
+
+        # Nothing left to process until new frames are uploaded
+        self.tab_for(stage_name).process_btn.setEnabled(False)
+        QMessageBox.information(main_window, f"{title} Created",
+                                f"{os.path.basename(output_file)} has been successfully generated!{note}")
+
+    def write_failed(self, message):
+        QMessageBox.critical(self.window(), "Writing failed", message)
+
+    def lights_finished(self, stack_options, note, outputs):
+        self.set_job_running(False)
+        self.show_frames("LIGHTS", outputs)
+        self.lights_tab.process_btn.setEnabled(False)
+        if stack_options is not None and len(outputs) > 1:
+            # --- Register, resample and combine the calibrated lights ---
+            self.start_job(stack_lights, outputs, **stack_options, job_tab=self.lights_tab,
+                           on_finished=partial(self.stack_finished, stack_options["output_file"], note))
+            return
+        QMessageBox.information(self.window(), "Lights Calibrated",
+                                f"{len(outputs)} calibrated frames written to "
+                                f"{os.path.dirname(outputs[0])}{note}")
+
+    def stack_finished(self, output_file, note, image):
+        self.set_job_running(False)
+        grid = self.lights_grid
+        grid.set_files([output_file] + grid.frame_model.files)
+        grid.set_thumbnail(0, thumbnail_from_array(image, *stretch_limits(image)))
+        QMessageBox.information(self.window(), "Lights Stacked",
+                                f"Calibrated frames aligned and stacked into {os.path.basename(output_file)}{note}")
+
+    def show_performance(self):
+        if self.performance_panel is None:
+            self.performance_panel = PerformancePanel(self.window())
+        self.performance_panel.show()
+        self.performance_panel.raise_()
+
+    def show_queue(self):
+        if self.queue_panel is None:
+            self.queue_panel = QueuePanel(self.window())
+            self.queue_panel.running.connect(self.queue_running)
+        self.queue_panel.show()
+        self.queue_panel.raise_()
+
+    def show_frames(self, stage_name, files):
+        """Fill a stage's grid with ``files``; thumbnails load as they come into view."""
+        self.grid_for(stage_name).set_files(files)
 
     def upload_images(self):
+        if self.job_busy():
+            return
         main_window = self.window()
         dialog = QFileDialog(main_window, "Select Astronomical Images")
         dialog.setFileMode(QFileDialog.ExistingFiles)
@@ -283,73 +654,48 @@ class ProcessingScreen(QWidget):
 
             current_tab_index = self.tabs.currentIndex()
             stage_name = self.tabs.tabText(current_tab_index).upper()
-            folder_name = stage_name
-            dest_folder = os.path.join(os.getcwd(), folder_name)
-            os.makedirs(dest_folder, exist_ok=True)
-            for f in os.listdir(dest_folder):
-                file_path = os.path.join(dest_folder, f)
-                if os.path.isfile(file_path):
-                    os.remove(file_path)
-
-            if stage_name == "BIAS":
-                images_layout = self.bias_images_layout
-            elif stage_name == "FLAT":
-                images_layout = self.flat_images_layout
-            else:
-                images_layout = self.lights_images_layout
-
-            for i in reversed(range(images_layout.count())):
-                widget = images_layout.itemAt(i).widget()
-                if widget:
-                    widget.setParent(None)
-
-            row, col = 0, 0
-            max_cols = 4
-
-            for file_path in files:
-                filename = os.path.basename(file_path)
-                dest_path = os.path.join(dest_folder, filename)
-                shutil.copy(file_path, dest_path)
-
-                ext = os.path.splitext(file_path)[1].lower()
-
-                pixmap = None
-                if ext in [".fits", ".fit", ".fts"]:
-                    hdul = fits.open(file_path)
-                    data = hdul[0].data
-                    hdul.close()
-
-                    if data is not None:
-                        data = np.nan_to_num(data)
-                        vmin, vmax = np.percentile(data, (1, 99))
-                        data = np.clip(data, vmin, vmax)
-                        data = ((data - vmin) / (vmax - vmin) * 255).astype(np.uint8)
-                        if data.ndim > 2:
-                            data = data[0]
-                        h, w = data.shape
-                        image = QImage(data, w, h, QImage.Format_Grayscale8)
-                        pixmap = QPixmap.fromImage(image)
-                else:
-                    pixmap = QPixmap(file_path)
-
-                if pixmap is not None and not pixmap.isNull():
-                    pixmap = pixmap.scaled(200, 200, Qt.KeepAspectRatio, Qt.SmoothTransformation)
-                    label = QLabel()
-                    label.setPixmap(pixmap)
-                    label.setToolTip(filename)
-                    label.setAlignment(Qt.AlignCenter)
-
-                    label.mousePressEvent = partial(open_image_dialog, file_path)
-
-                    images_layout.addWidget(label, row, col)
-                    col += 1
-                    if col >= max_cols:
-                        col = 0
-                        row += 1
-
-            self.current_files = files
-            # Enable Process button ONLY for BIAS tab
-            process_btn = self.tabs.currentWidget().findChildren(QPushButton)[1]
-            process_btn.setEnabled(stage_name == "BIAS")
-            QMessageBox.information(main_window, "Files Selected",
-                                    f"{len(files)} images selected for processing")
\ No newline at end of file
+            self.use_files(stage_name, files)
+
+    def use_files(self, stage_name, files):
+        """Make ``files`` the input frames of a stage and show them."""
+        dest_folder = os.path.join(os.getcwd(), stage_name)
+        # Headers are read in the background; on a network share that can take a while
+        self.start_job(select_inputs, dest_folder, files, MASTER_FILES.get(stage_name),
+                       job_tab=self.tab_for(stage_name), on_finished=partial(self.inputs_selected, stage_name, files))
+
+    def inputs_selected(self, stage_name, files, _result=None):
+        self.set_job_running(False)
+        self.show_frames(stage_name, files)
+        self.current_files = files
+        self.tab_for(stage_name).process_btn.setEnabled(True)
+        QMessageBox.information(self.window(), "Files Selected",
+                                f"{len(files)} images selected for processing")
+
+    def scan_folder(self):
+        if self.job_busy():
+            return
+        folder = QFileDialog.getExistingDirectory(self.window(), "Select a folder of frames")
+        if not folder:
+            return
+        stage_name = self.tabs.tabText(self.tabs.currentIndex()).upper()
+        self.start_job(scan_groups, folder, on_finished=partial(self.groups_found, stage_name))
+
+    def groups_found(self, stage_name, groups):
+        """Offer the scanned groups matching a stage, then use the chosen one."""
+        self.set_job_running(False)
+        matching = [g for g in groups if g.kind == STAGE_KINDS[stage_name]]
+        if not matching:
+            QMessageBox.warning(self.window(), "No frames",
+                                f"No {STAGE_KINDS[stage_name]} frames found (checked IMAGETYP).")
+            return
+
+        group = matching[0]
+        if len(matching) > 1:
+            labels = [group_label(g) for g in matching]
+            label, ok = QInputDialog.getItem(self.window(), "Choose frames",
+                                             f"Several {STAGE_KINDS[stage_name]} sets were found:",
+                                             labels, 0, False)
+            if not ok:
+                return
+            group = matching[labels.index(label)]
+        self.use_files(stage_name, group.paths)
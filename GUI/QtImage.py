@@ -0,0 +1,62 @@
+"""NumPy to QImage conversion shared by the thumbnail grid and the viewer.
+
+QImage does not own memory it is constructed on, so every image made here
+keeps a reference to its backing array for as long as the wrapper lives.
+Arrays are wrapped in place when their rows are evenly strided and their
+bytes are in native order; otherwise exactly one compacting copy is made.
+"""
+import numpy as np
+from PyQt5 import sip
+from PyQt5.QtGui import QImage, QPixmap, qRgb
+
+
+def make_lut(name="gray"):
+    """(256, 3) uint8 colour table for Indexed8 images: 'gray' or 'heat'."""
+    x = np.linspace(0.0, 1.0, 256)
+    if name == "gray":
+        rgb = np.stack([x, x, x], axis=1)
+    elif name == "heat":
+        rgb = np.stack([np.clip(3 * x, 0, 1), np.clip(3 * x - 1, 0, 1), np.clip(3 * x - 2, 0, 1)], axis=1)
+    else:
+        raise ValueError(f"Unknown colour table: {name}")
+    return (rgb * 255).round().astype(np.uint8)
+
+
+def _wrappable(array):
+    """``array`` itself if QImage can read it in place, else a compact native copy."""
+    if array.dtype.isnative and array.strides[1] == array.itemsize and array.strides[0] > 0:
+        return array
+    return np.ascontiguousarray(array, dtype=array.dtype.newbyteorder("="))
+
+
+def array_to_qimage(array, lut=None):
+    """Wrap a 2D uint8 or uint16 array in a QImage without copying when possible.
+
+    uint8 becomes Grayscale8, or Indexed8 through ``lut`` (see make_lut);
+    uint16 becomes Grayscale16. The array is attached to the image as
+    ``image.ndarray`` so the pixels stay alive as long as the image does.
+    """
+    if array.ndim != 2:
+        raise ValueError(f"Expected a 2D array, got shape {array.shape}")
+    dtype = array.dtype.newbyteorder("=")
+    if dtype == np.uint8:
+        fmt = QImage.Format_Grayscale8 if lut is None else QImage.Format_Indexed8
+    elif dtype == np.uint16:
+        if lut is not None:
+            raise ValueError("Colour tables need 8-bit data")
+        fmt = QImage.Format_Grayscale16
+    else:
+        raise ValueError(f"Unsupported dtype {array.dtype}")
+
+    array = _wrappable(array)
+    h, w = array.shape
+    image = QImage(sip.voidptr(array.__array_interface__["data"][0]), w, h, array.strides[0], fmt)
+    if lut is not None:
+        image.setColorTable([qRgb(*map(int, rgb)) for rgb in lut])
+    image.ndarray = array
+    return image
+
+
+def array_to_pixmap(array, lut=None):
+    """QPixmap of a 2D array; the pixmap owns its pixels, so the array can go."""
+    return QPixmap.fromImage(array_to_qimage(array, lut))
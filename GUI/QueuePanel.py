@@ -0,0 +1,166 @@
+import os
+
+from PyQt5.QtCore import Qt, QThreadPool, QTimer, pyqtSignal
+from PyQt5.QtWidgets import (QDialog, QFileDialog, QHBoxLayout, QHeaderView, QLabel, QMessageBox,
+                             QPushButton, QTreeWidget, QTreeWidgetItem, QVBoxLayout)
+
+from GUI.Worker import Worker
+from astroreduct.batch import JobQueue, run_queue
+from astroreduct.combine import DEFAULT_MEMORY_LIMIT
+
+REFRESH_MS = 1000  # Table refresh interval while the panel is open
+COLUMNS = ("Job", "Night", "State", "Steps", "Status")
+
+# =================== CONFIGURATION ===================
+QUEUE_JOBS = 1  # Nights reduced at once
+QUEUE_MEMORY_LIMIT = DEFAULT_MEMORY_LIMIT  # Bytes shared by the running nights
+QUEUE_WORKERS = os.cpu_count()  # Processes shared by the running nights
+# =====================================================
+
+
+def steps_done(job):
+    steps = job["steps"]
+    if steps is None:
+        return ""
+    return f"{sum(step['state'] == 'done' for step in steps)}/{len(steps)}"
+
+
+class QueuePanel(QDialog):
+    """Nights queued for unattended reduction, and the runner working through them.
+
+    The queue is kept on disk, so jobs survive closing the program; "Start"
+    resumes anything left unfinished. The runner keeps going while the
+    panel is closed.
+    """
+    running = pyqtSignal(bool)  # The runner started (True) or stopped (False)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Batch Queue")
+        self.resize(860, 380)
+        self.queue = JobQueue()
+        self.worker = None
+
+        self.table = QTreeWidget()
+        self.table.setRootIsDecorated(False)
+        self.table.setHeaderLabels(COLUMNS)
+        self.table.setSelectionMode(QTreeWidget.ExtendedSelection)
+        self.table.header().setSectionResizeMode(1, QHeaderView.Stretch)
+
+        self.status = QLabel()
+
+        add_btn = QPushButton("Add Nights...")
+        add_btn.clicked.connect(self.add_nights)
+        retry_btn = QPushButton("Retry")
+        retry_btn.clicked.connect(self.retry_selected)
+        remove_btn = QPushButton("Remove")
+        remove_btn.clicked.connect(self.remove_selected)
+        self.start_btn = QPushButton("Start")
+        self.start_btn.clicked.connect(self.start_or_stop)
+
+        top = QHBoxLayout()
+        top.addWidget(add_btn)
+        top.addWidget(retry_btn)
+        top.addWidget(remove_btn)
+        top.addStretch()
+        top.addWidget(self.start_btn)
+
+        layout = QVBoxLayout()
+        layout.addLayout(top)
+        layout.addWidget(self.table)
+        layout.addWidget(self.status)
+        self.setLayout(layout)
+
+        self.timer = QTimer(self)
+        self.timer.setInterval(REFRESH_MS)
+        self.timer.timeout.connect(self.refresh)
+        self.refresh()
+
+    def refresh(self):
+        selected = set(self.selected_ids())
+        self.table.clear()
+        jobs = self.queue.jobs()
+        for job in jobs:
+            item = QTreeWidgetItem([str(job["id"]), job["night"], job["state"], steps_done(job),
+                                    job["message"] or ""])
+            item.setData(0, Qt.UserRole, job["id"])
+            item.setToolTip(1, f"Output: {job['output_dir']}")
+            self.table.addTopLevelItem(item)
+            item.setSelected(job["id"] in selected)
+        counts = {}
+        for job in jobs:
+            counts[job["state"]] = counts.get(job["state"], 0) + 1
+        summary = ", ".join(f"{n} {state}" for state, n in counts.items()) or "No jobs"
+        self.status.setText(f"{summary}; runner {'running' if self.worker else 'stopped'}")
+
+    def selected_ids(self):
+        return [item.data(0, Qt.UserRole) for item in self.table.selectedItems()]
+
+    def add_nights(self):
+        folder = QFileDialog.getExistingDirectory(self, "Select a night's folder")
+        if not folder:
+            return
+        # A folder of night folders queues each of them; otherwise the folder is one night
+        nights = sorted(os.path.join(folder, d) for d in os.listdir(folder)
+                        if os.path.isdir(os.path.join(folder, d)) and d != "reduced")
+        if nights:
+            answer = QMessageBox.question(self, "Add nights",
+                                          f"Queue each of the {len(nights)} folders inside as a night?\n"
+                                          f"Choose No to queue {os.path.basename(folder)} as one night.")
+            if answer != QMessageBox.Yes:
+                nights = [folder]
+        else:
+            nights = [folder]
+        for night in nights:
+            self.queue.add(night)
+        self.refresh()
+
+    def retry_selected(self):
+        for job_id in self.selected_ids():
+            self.queue.retry(job_id)
+        self.refresh()
+
+    def remove_selected(self):
+        for job_id in self.selected_ids():
+            try:
+                self.queue.remove(job_id)
+            except ValueError as e:
+                QMessageBox.warning(self, "Cannot remove", str(e))
+        self.refresh()
+
+    def start_or_stop(self):
+        if self.worker is not None:
+            self.worker.cancel()
+            self.start_btn.setEnabled(False)
+            self.start_btn.setText("Stopping...")
+            return
+        # --- Work through the queue in the background, resuming unfinished jobs ---
+        self.worker = Worker(run_queue, self.queue.path, max_jobs=QUEUE_JOBS,
+                             memory_limit=QUEUE_MEMORY_LIMIT, workers=QUEUE_WORKERS)
+        self.worker.signals.finished.connect(self.runner_stopped)
+        self.worker.signals.error.connect(self.runner_failed)
+        self.worker.signals.cancelled.connect(self.runner_stopped)
+        self.start_btn.setText("Stop")
+        self.running.emit(True)
+        QThreadPool.globalInstance().start(self.worker)
+        self.refresh()
+
+    def runner_stopped(self, _results=None):
+        self.worker = None
+        self.start_btn.setEnabled(True)
+        self.start_btn.setText("Start")
+        self.running.emit(False)
+        self.refresh()
+
+    def runner_failed(self, message):
+        self.runner_stopped()
+        QMessageBox.critical(self, "Queue runner failed", message)
+
+    def showEvent(self, event):
+        self.refresh()
+        self.timer.start()
+        super().showEvent(event)
+
+    def hideEvent(self, event):
+        self.timer.stop()
+        super().hideEvent(event)
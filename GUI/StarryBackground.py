@@ -1,18 +1,42 @@
-from PyQt5.QtWidgets import (QWidget)
-from PyQt5.QtCore import Qt, QTimer
-from PyQt5.QtGui import QColor, QPainter, QLinearGradient, QBrush
+import os
 import random
 
+from PyQt5.QtWidgets import (QWidget)
+from PyQt5.QtCore import Qt, QTimer, QRect, QRectF
+from PyQt5.QtGui import QColor, QPainter, QLinearGradient, QBrush, QPixmap
+
+STAR_COUNT = 100
+TWINKLE_MS = 100  # Interval between twinkles
+TWINKLE_CHANCE = 0.05  # Share of stars that change brightness each twinkle
+
+# No animation at all, e.g. on battery or over remote X/VNC; also set by ASTROREDUCT_LOW_POWER=1
+LOW_POWER = os.environ.get("ASTROREDUCT_LOW_POWER", "") not in ("", "0")
+
+
 class StarryBackground(QWidget):
+    """Night-sky backdrop with twinkling stars.
+
+    The gradient and stars are drawn once into a pixmap; painting copies
+    the damaged part of it, and a twinkle redraws and repaints only the
+    few pixels around the stars that changed. The animation stops while
+    the widget is hidden, while a job runs (see :meth:`set_paused`) and in
+    low-power mode.
+    """
+
     def __init__(self, parent=None):
         super().__init__(parent)
         self.stars = []
+        self.sky = None  # Pre-rendered gradient and stars, rebuilt on resize
+        self.pause_reasons = set()
+        if LOW_POWER:
+            self.pause_reasons.add("low power")
         self.twinkle_timer = QTimer(self)
+        self.twinkle_timer.setInterval(TWINKLE_MS)
         self.twinkle_timer.timeout.connect(self.update_stars)
-        self.twinkle_timer.start(100)  # Update every 100ms
 
-        # Create stars
-        for _ in range(100):
+    def make_stars(self):
+        self.stars = []
+        for _ in range(STAR_COUNT):
             x = random.randint(0, self.width())
             y = random.randint(0, self.height())
             size = random.randint(1, 3)
@@ -21,34 +45,81 @@ class StarryBackground(QWidget):
 
     def resizeEvent(self, event):
         # Regenerate stars when window is resized
-        self.stars = []
-        for _ in range(100):
-            x = random.randint(0, self.width())
-            y = random.randint(0, self.height())
-            size = random.randint(1, 3)
-            brightness = random.randint(100, 255)
-            self.stars.append([x, y, size, brightness])
+        self.make_stars()
+        self.sky = None
         super().resizeEvent(event)
 
-    def update_stars(self):
-        # Randomly change brightness of some stars
-        for star in self.stars:
-            if random.random() < 0.05:  # 5% chance to twinkle
-                star[3] = random.randint(100, 255)
-        self.update()
+    def set_paused(self, reason, paused):
+        """Stop twinkling for ``reason`` (e.g. "job"); it resumes once no reason is left."""
+        if paused:
+            self.pause_reasons.add(reason)
+        else:
+            self.pause_reasons.discard(reason)
+        if self.pause_reasons or not self.isVisible():
+            self.twinkle_timer.stop()
+        elif not self.twinkle_timer.isActive():
+            self.twinkle_timer.start()
 
-    def paintEvent(self, event):
-        painter = QPainter(self)
-        painter.setRenderHint(QPainter.Antialiasing)
+    def set_low_power(self, on):
+        self.set_paused("low power", on)
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.set_paused("hidden", False)
 
-        # Draw dark blue background
+    def hideEvent(self, event):
+        self.set_paused("hidden", True)
+        super().hideEvent(event)
+
+    @staticmethod
+    def star_rect(star):
+        x, y, size, _ = star
+        return QRect(x - 1, y - 1, size + 2, size + 2)  # Margin for antialiasing
+
+    def draw_sky(self, painter, rect):
+        """Gradient and the stars touching ``rect``, in widget coordinates."""
         gradient = QLinearGradient(0, 0, 0, self.height())
         gradient.setColorAt(0, QColor(10, 15, 30))
         gradient.setColorAt(1, QColor(5, 10, 20))
-        painter.fillRect(self.rect(), QBrush(gradient))
+        painter.fillRect(rect, QBrush(gradient))
+
+        painter.setPen(Qt.NoPen)
+        for star in self.stars:
+            if self.star_rect(star).intersects(rect):
+                x, y, size, brightness = star
+                painter.setBrush(QColor(brightness, brightness, brightness))
+                painter.drawEllipse(x, y, size, size)
 
-        # Draw stars
-        for x, y, size, brightness in self.stars:
-            painter.setPen(Qt.NoPen)
-            painter.setBrush(QColor(brightness, brightness, brightness))
-            painter.drawEllipse(x, y, size, size)
\ No newline at end of file
+    def render_sky(self, rect=None):
+        """Draw ``rect`` (default: everything) of the cached sky pixmap."""
+        if self.sky is None:
+            ratio = self.devicePixelRatioF()
+            self.sky = QPixmap(int(self.width() * ratio), int(self.height() * ratio))
+            self.sky.setDevicePixelRatio(ratio)
+            rect = None
+        painter = QPainter(self.sky)
+        painter.setRenderHint(QPainter.Antialiasing)
+        rect = rect or self.rect()
+        painter.setClipRect(rect)
+        self.draw_sky(painter, rect)
+        painter.end()
+
+    def update_stars(self):
+        # Randomly change brightness of some stars and repaint just those
+        if self.sky is None:
+            return
+        for star in self.stars:
+            if random.random() < TWINKLE_CHANCE:
+                star[3] = random.randint(100, 255)
+                rect = self.star_rect(star)
+                self.render_sky(rect)
+                self.update(rect)
+
+    def paintEvent(self, event):
+        if self.sky is None:
+            self.render_sky()
+        ratio = self.sky.devicePixelRatio()
+        painter = QPainter(self)
+        for rect in event.region().rects():  # Twinkles damage a few small rects, not their bounding box
+            source = QRectF(rect.x() * ratio, rect.y() * ratio, rect.width() * ratio, rect.height() * ratio)
+            painter.drawPixmap(QRectF(rect), self.sky, source)
@@ -0,0 +1,181 @@
+import os
+from collections import OrderedDict
+from functools import partial
+
+from PyQt5.QtCore import Qt, QAbstractListModel, QModelIndex, QSize, QThreadPool, QTimer
+from PyQt5.QtGui import QColor, QPixmap
+from PyQt5.QtWidgets import QListView
+
+from GUI.QtImage import array_to_pixmap
+from GUI.ThumbnailLoader import ThumbnailLoader
+from astroreduct.profiling import span
+from astroreduct.thumbnails import THUMBNAIL_SIZE
+
+PREFETCH_ROWS = 2  # Grid rows above and below the viewport that are also loaded
+MAX_PIXMAPS = 512  # Upper bound on decoded thumbnails, whatever the viewport size
+CELL_MARGIN = 10
+LABEL_HEIGHT = 20
+
+
+def thumbnail_pixmap(thumb):
+    """Grid-sized QPixmap from an 8-bit thumbnail array."""
+    with span("Thumbnail pixmap"):
+        return array_to_pixmap(thumb).scaled(THUMBNAIL_SIZE, THUMBNAIL_SIZE,
+                                             Qt.KeepAspectRatio, Qt.SmoothTransformation)
+
+
+def placeholder_pixmap(color):
+    pixmap = QPixmap(THUMBNAIL_SIZE, THUMBNAIL_SIZE)
+    pixmap.fill(QColor(color))
+    return pixmap
+
+
+class FrameListModel(QAbstractListModel):
+    """File list whose thumbnails are only held for the rows the view asks for."""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.files = []
+        self.pixmaps = OrderedDict()  # row -> QPixmap, oldest first
+        self.failed = set()
+        self.loading = placeholder_pixmap("#2a2a2a")
+        self.broken = placeholder_pixmap("#4a2a2a")
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.files)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row = index.row()
+        if role in (Qt.DisplayRole, Qt.ToolTipRole):
+            return os.path.basename(self.files[row])
+        if role == Qt.DecorationRole:
+            pixmap = self.pixmaps.get(row)
+            if pixmap is not None:
+                return pixmap
+            return self.broken if row in self.failed else self.loading
+        if role == Qt.UserRole:
+            return self.files[row]
+        return None
+
+    def set_files(self, files):
+        self.beginResetModel()
+        self.files = list(files)
+        self.pixmaps.clear()
+        self.failed.clear()
+        self.endResetModel()
+
+    def set_thumbnail(self, row, thumb):
+        """Show ``thumb`` (uint8 array, or None for unreadable) for ``row``."""
+        if thumb is None:
+            self.failed.add(row)
+        else:
+            self.pixmaps[row] = thumbnail_pixmap(thumb)
+            self.pixmaps.move_to_end(row)
+            while len(self.pixmaps) > MAX_PIXMAPS:
+                self.pixmaps.popitem(last=False)
+        index = self.index(row)
+        self.dataChanged.emit(index, index, [Qt.DecorationRole])
+
+    def has_thumbnail(self, row):
+        return row in self.pixmaps or row in self.failed
+
+    def keep_only(self, rows):
+        """Drop decoded thumbnails for rows outside the ``rows`` range."""
+        for row in [r for r in self.pixmaps if r not in rows]:
+            del self.pixmaps[row]
+
+
+class ThumbnailGrid(QListView):
+    """Icon grid of FITS frames that decodes only what is on screen.
+
+    Thumbnails are requested for the visible rows plus PREFETCH_ROWS grid
+    rows on each side whenever the view scrolls or resizes; everything
+    further away is evicted, so memory and layout cost do not grow with
+    the number of frames. Clicking a frame calls ``on_open(path)``.
+    """
+    def __init__(self, on_open=None):
+        super().__init__()
+        self.frame_model = FrameListModel(self)
+        self.setModel(self.frame_model)
+        self.setViewMode(QListView.IconMode)
+        self.setIconSize(QSize(THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+        self.setGridSize(QSize(THUMBNAIL_SIZE + CELL_MARGIN, THUMBNAIL_SIZE + CELL_MARGIN + LABEL_HEIGHT))
+        self.setUniformItemSizes(True)
+        self.setResizeMode(QListView.Adjust)
+        self.setMovement(QListView.Static)
+        self.setVerticalScrollMode(QListView.ScrollPerPixel)
+        self.setSelectionMode(QListView.NoSelection)
+        self.setStyleSheet("QListView { background: transparent; border: 0; color: white; }")
+        if on_open is not None:
+            self.clicked.connect(lambda index: on_open(index.data(Qt.UserRole)))
+
+        self.loader = None
+        self.pending = set()
+        self.thread_pool = QThreadPool.globalInstance()
+        # Coalesce scroll and resize bursts into one request
+        self.update_timer = QTimer(self)
+        self.update_timer.setSingleShot(True)
+        self.update_timer.setInterval(30)
+        self.update_timer.timeout.connect(self.load_visible)
+        self.verticalScrollBar().valueChanged.connect(lambda _: self.update_timer.start())
+
+    def set_files(self, files):
+        self.stop()
+        self.frame_model.set_files(files)
+        self.update_timer.start()
+
+    def set_thumbnail(self, row, thumb):
+        self.frame_model.set_thumbnail(row, thumb)
+
+    def stop(self):
+        if self.loader is not None:
+            self.loader.cancel()
+            self.loader = None
+        self.pending.clear()
+
+    def visible_rows(self):
+        """Range of rows in or within PREFETCH_ROWS grid rows of the viewport."""
+        count = self.frame_model.rowCount()
+        if count == 0:
+            return range(0)
+        cell = self.gridSize()
+        columns = max(1, (self.viewport().width() - self.spacing()) // cell.width())
+        top = self.verticalScrollBar().value()
+        first_row = max(0, top // cell.height() - PREFETCH_ROWS)
+        last_row = (top + self.viewport().height()) // cell.height() + PREFETCH_ROWS
+        return range(first_row * columns, min(count, (last_row + 1) * columns))
+
+    def load_visible(self):
+        rows = self.visible_rows()
+        self.frame_model.keep_only(rows)
+        missing = [row for row in rows if not self.frame_model.has_thumbnail(row)]
+        if all(row in self.pending for row in missing):
+            return
+
+        # Replace the previous request; rows it already finished are kept
+        self.stop()
+        if not missing:
+            return
+        self.pending = set(missing)
+        files = self.frame_model.files
+        loader = ThumbnailLoader([files[row] for row in missing])
+        loader.signals.ready.connect(partial(self.thumbnail_ready, loader, missing))
+        self.loader = loader
+        self.thread_pool.start(loader)
+
+    def thumbnail_ready(self, loader, rows, index, thumb):
+        if loader is not self.loader:
+            return  # Superseded by a newer request
+        row = rows[index]
+        self.pending.discard(row)
+        self.frame_model.set_thumbnail(row, thumb)
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.update_timer.start()
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.update_timer.start()
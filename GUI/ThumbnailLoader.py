@@ -0,0 +1,78 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from PyQt5.QtCore import QObject, QRunnable, pyqtSignal
+
+from astroreduct.thumbnails import THUMBNAIL_SIZE, ThumbnailCache, cached_thumbnail
+
+_executor = None
+
+
+def thumbnail_executor():
+    """Process pool shared by every ThumbnailLoader, created on first use."""
+    global _executor
+    if _executor is None:
+        # spawn rather than fork: the parent process runs Qt threads
+        _executor = ProcessPoolExecutor(max_workers=os.cpu_count(),
+                                        mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+class ThumbnailSignals(QObject):
+    ready = pyqtSignal(int, object)  # file index, uint8 array or None
+    done = pyqtSignal()
+
+
+class ThumbnailLoader(QRunnable):
+    """Builds thumbnails for ``files`` across processes, emitting each as it finishes.
+
+    Cached thumbnails are emitted first; the rest are rendered in the
+    shared process pool and written to the cache by the workers.
+    """
+
+    def __init__(self, files, size=THUMBNAIL_SIZE, cache=None):
+        super().__init__()
+        self.files = list(files)
+        self.size = size
+        self.cache = cache or ThumbnailCache()
+        self.signals = ThumbnailSignals()
+        self.cancel_event = threading.Event()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def run(self):
+        misses = []
+        for i, path in enumerate(self.files):
+            if self.cancel_event.is_set():
+                return
+            try:
+                thumb = self.cache.get(path, self.size)
+            except OSError:
+                # An exception escaping a QRunnable aborts the process; show it as unreadable
+                self.signals.ready.emit(i, None)
+                continue
+            if thumb is None:
+                misses.append((i, path))
+            else:
+                self.signals.ready.emit(i, thumb)
+
+        if misses:
+            executor = thumbnail_executor()
+            futures = {executor.submit(cached_thumbnail, path, self.size,
+                                       self.cache.directory, self.cache.max_bytes): i
+                       for i, path in misses}
+            for future in as_completed(futures):
+                if self.cancel_event.is_set():
+                    for pending in futures:
+                        pending.cancel()
+                    return
+                try:
+                    thumb = future.result()
+                except Exception:
+                    thumb = None
+                self.signals.ready.emit(futures[future], thumb)
+            self.cache.evict()
+        self.signals.done.emit()
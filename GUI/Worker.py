@@ -0,0 +1,42 @@
+import threading
+import traceback
+
+from PyQt5.QtCore import QObject, QRunnable, pyqtSignal
+
+from astroreduct.jobs import CombineCancelled
+from astroreduct.profiling import span
+
+
+class WorkerSignals(QObject):
+    """Signals emitted by a Worker; delivered on the GUI thread."""
+    progress = pyqtSignal(str, int, int)  # stage, done, total
+    finished = pyqtSignal(object)  # return value of the job
+    error = pyqtSignal(str)
+    cancelled = pyqtSignal()
+
+
+class Worker(QRunnable):
+    """Runs ``fn(*args, progress=..., cancel=..., **kwargs)`` on a QThreadPool thread."""
+
+    def __init__(self, fn, *args, **kwargs):
+        super().__init__()
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = WorkerSignals()
+        self.cancel_event = threading.Event()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def run(self):
+        try:
+            with span(getattr(self.fn, "__name__", "Job")):
+                result = self.fn(*self.args, progress=self.signals.progress.emit,
+                                 cancel=self.cancel_event, **self.kwargs)
+        except CombineCancelled:
+            self.signals.cancelled.emit()
+        except Exception:
+            self.signals.error.emit(traceback.format_exc())
+        else:
+            self.signals.finished.emit(result)
@@ -0,0 +1 @@
+"""Reduction engine for AstroReduct, usable without the GUI."""
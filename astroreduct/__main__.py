@@ -0,0 +1,5 @@
+import sys
+
+from astroreduct.cli import main
+
+sys.exit(main())
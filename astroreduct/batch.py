@@ -0,0 +1,385 @@
+"""Persistent queue of whole-night reductions, for unattended batches.
+
+A job is one night's folder. When it first runs, the folder is scanned
+into the frame catalogue and planned as steps: master bias, a master dark
+per exposure time, a master flat per filter, then calibration and
+stacking of the lights per filter and target. Calibration frames the night
+lacks are taken from the master library. Jobs and the state of every step
+are kept in SQLite, so after a crash or a stop the runner carries on where
+it was: finished steps whose outputs still exist are not run again.
+
+Several nights can run at once; the runner's memory limit and worker
+count are shared out between them.
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from astroreduct.calibrate import calibrate_lights, calibrated_names, make_master_dark, make_master_flat
+from astroreduct.catalogue import scan_groups
+from astroreduct.combine import DEFAULT_MEMORY_LIMIT, combine_to_file
+from astroreduct.jobs import CombineCancelled
+from astroreduct.library import MasterLibrary, frame_settings
+from astroreduct.output import DEFAULT_BITPIX
+from astroreduct.results import ResultCache
+
+JOB_STATES = ("queued", "running", "done", "failed")
+PROGRESS_INTERVAL = 1.0  # Seconds between progress updates written to the database
+
+# Per-job options and their defaults; anything else passed to add() is rejected
+DEFAULT_OPTIONS = {
+    "stack": True,  # Align and combine each set of calibrated lights
+    "use_library": True,  # Take missing masters from the master library and add new ones to it
+    "use_cache": True,  # Reuse identical masters from the result cache
+    "bitpix": DEFAULT_BITPIX,  # Stored BITPIX of masters
+    "compression": None,  # Tile compression of masters: None, 'rice' or 'gzip'
+}
+
+# Combine settings of each step, as in the processing screen
+STEP_SETTINGS = {
+    "bias": dict(combine_method="median", reject_method="minmax", nlow=0, nhigh=1, scale="none"),
+    "dark": dict(combine_method="median", reject_method="minmax", nlow=0, nhigh=1, scale="none"),
+    "flat": dict(combine_method="median", reject_method="minmax", nlow=0, nhigh=1, scale="median"),
+    "stack": dict(combine_method="average", reject_method="sigclip", lsigma=3.0, hsigma=3.0, min_peak=0.05),
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    night TEXT NOT NULL,
+    output_dir TEXT NOT NULL,
+    options TEXT NOT NULL,
+    state TEXT NOT NULL,
+    steps TEXT,
+    message TEXT,
+    pid INTEGER,
+    added REAL NOT NULL,
+    started REAL,
+    finished REAL
+);
+"""
+
+
+def default_output_dir(night):
+    """Outputs of ``night``: a folder of that name in a "reduced" folder next to it."""
+    night = os.path.abspath(night)
+    return os.path.join(os.path.dirname(night), "reduced", os.path.basename(night))
+
+
+def default_queue_path():
+    base = os.environ.get("XDG_DATA_HOME") or os.path.join(os.path.expanduser("~"), ".local", "share")
+    return os.path.join(base, "astroreduct", "queue.sqlite")
+
+
+def _pid_alive(pid):
+    if pid is None:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobQueue:
+    """SQLite table of night jobs; safe to share between runner threads."""
+
+    def __init__(self, path=None):
+        self.path = path or default_queue_path()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, night, output_dir=None, **options):
+        """Queue the reduction of the frames in ``night``; returns the job id.
+
+        Outputs go to ``output_dir`` (default: :func:`default_output_dir`).
+        ``options`` override :data:`DEFAULT_OPTIONS`.
+        """
+        unknown = set(options) - set(DEFAULT_OPTIONS)
+        if unknown:
+            raise ValueError(f"Unknown job options: {', '.join(sorted(unknown))}")
+        night = os.path.abspath(night)
+        if not os.path.isdir(night):
+            raise ValueError(f"{night} is not a directory.")
+        output_dir = os.path.abspath(output_dir or default_output_dir(night))
+        with self.lock, self.db:
+            cursor = self.db.execute(
+                "INSERT INTO jobs (night, output_dir, options, state, added) VALUES (?, ?, ?, 'queued', ?)",
+                (night, output_dir, json.dumps(dict(DEFAULT_OPTIONS, **options)), time.time()))
+        return cursor.lastrowid
+
+    def jobs(self, state=None):
+        """Jobs as dicts in queue order, with options and steps decoded."""
+        query, params = "SELECT * FROM jobs", ()
+        if state is not None:
+            query, params = query + " WHERE state = ?", (state,)
+        with self.lock:
+            cursor = self.db.execute(query + " ORDER BY id", params)
+            names = [d[0] for d in cursor.description]
+            rows = [dict(zip(names, row)) for row in cursor]
+        for row in rows:
+            row["options"] = json.loads(row["options"])
+            row["steps"] = json.loads(row["steps"]) if row["steps"] else None
+        return rows
+
+    def job(self, job_id):
+        return next((job for job in self.jobs() if job["id"] == job_id), None)
+
+    def update(self, job_id, **fields):
+        if "steps" in fields:
+            fields["steps"] = json.dumps(fields["steps"])
+        with self.lock, self.db:
+            self.db.execute(f"UPDATE jobs SET {', '.join(f'{name} = ?' for name in fields)} WHERE id = ?",
+                            tuple(fields.values()) + (job_id,))
+
+    def remove(self, job_id):
+        """Drop a job that is not running; its outputs are kept."""
+        with self.lock, self.db:
+            cursor = self.db.execute("DELETE FROM jobs WHERE id = ? AND state != 'running'", (job_id,))
+        if cursor.rowcount == 0:
+            raise ValueError(f"Job {job_id} does not exist or is running.")
+
+    def retry(self, job_id):
+        """Queue a failed or finished job again; finished steps are still skipped."""
+        with self.lock, self.db:
+            self.db.execute("UPDATE jobs SET state = 'queued', message = NULL, finished = NULL "
+                            "WHERE id = ? AND state != 'running'", (job_id,))
+
+    def recover(self):
+        """Queue again the jobs left 'running' by a runner that no longer exists; returns how many."""
+        stale = [job["id"] for job in self.jobs("running") if not _pid_alive(job["pid"])]
+        for job_id in stale:
+            self.update(job_id, state="queued", pid=None, message="Resumed after an interrupted run")
+        return len(stale)
+
+    def claim(self):
+        """Mark the oldest queued job as running in this process and return it, or None."""
+        while True:
+            with self.lock, self.db:
+                row = self.db.execute("SELECT id FROM jobs WHERE state = 'queued' ORDER BY id LIMIT 1").fetchone()
+                if row is None:
+                    return None
+                # Another runner process may have taken it in between
+                cursor = self.db.execute("UPDATE jobs SET state = 'running', pid = ?, started = ? "
+                                         "WHERE id = ? AND state = 'queued'", (os.getpid(), time.time(), row[0]))
+            if cursor.rowcount:
+                return self.job(row[0])
+
+
+def _file_part(value):
+    return re.sub(r"[^A-Za-z0-9.+-]+", "_", str(value)).strip("_") or "none"
+
+
+def _nearest_dark(darks, group):
+    """Output of the night's dark step nearest in exposure time to ``group``, or None."""
+    usable = [step for step in darks if step["shape"] == list(group.shape)]
+    if not usable:
+        return None
+    exptime = group.exptime or 0.0
+    return min(usable, key=lambda step: abs(step["exptime"] - exptime))["output"]
+
+
+def plan_night(night, output_dir, options, progress=None, cancel=None):
+    """The steps reducing ``night``, as JSON-ready dicts in the order they must run.
+
+    Masters missing from the night are looked up in the master library
+    (if ``options['use_library']``); a ValueError names any that cannot be
+    found. A dark is used when one exists, but is not required.
+    """
+    # Results of an earlier run must not be taken for frames, should they be inside the night
+    groups = scan_groups(night, exclude=[output_dir], progress=progress, cancel=cancel)
+    library = MasterLibrary() if options["use_library"] else None
+    try:
+        def from_library(kind, group):
+            if library is None:
+                return None
+            return library.find(kind, frame_settings(group.paths[0]))
+
+        steps = []
+        biases = {}
+        bias_groups = [g for g in groups if g.kind == "bias"]
+        for group in bias_groups:
+            suffix = f"_{group.shape[1]}x{group.shape[0]}" if len(bias_groups) > 1 else ""
+            output = os.path.join(output_dir, f"MasterBias{suffix}.fits")
+            biases[group.shape] = output
+            steps.append({"name": f"bias {group.shape[1]}x{group.shape[0]}", "kind": "bias",
+                          "inputs": group.paths, "outputs": [output], "output": output})
+
+        def bias_for(group):
+            bias = biases.get(group.shape) or from_library("bias", group)
+            if bias is None:
+                raise ValueError(f"No master bias for {group.kind} frames of {group.shape[1]}x{group.shape[0]}.")
+            return bias
+
+        darks = []
+        for group in (g for g in groups if g.kind == "dark"):
+            output = os.path.join(output_dir, f"MasterDark_{_file_part(f'{group.exptime or 0:g}s')}.fits")
+            darks.append({"name": f"dark {group.exptime or 0:g}s", "kind": "dark", "inputs": group.paths,
+                          "outputs": [output], "output": output, "bias": bias_for(group),
+                          "exptime": group.exptime or 0.0, "shape": list(group.shape)})
+        steps += darks
+
+        flats = {}
+        for group in (g for g in groups if g.kind == "flat"):
+            output = os.path.join(output_dir, f"MasterFlat_{_file_part(group.filter)}.fits")
+            flats[(group.filter, group.shape)] = output
+            steps.append({"name": f"flat {group.filter}", "kind": "flat", "inputs": group.paths,
+                          "outputs": [output], "output": output, "bias": bias_for(group),
+                          "dark": _nearest_dark(darks, group) or from_library("dark", group)})
+
+        for group in (g for g in groups if g.kind == "light"):
+            label = f"{_file_part(group.target)}_{_file_part(group.filter)}"
+            flat = flats.get((group.filter, group.shape)) or from_library("flat", group)
+            if flat is None:
+                raise ValueError(f"No master flat for filter {group.filter} "
+                                 f"({group.shape[1]}x{group.shape[0]}).")
+            out_dir = os.path.join(output_dir, "calibrated", label)
+            calibrated = [os.path.join(out_dir, name) for name in calibrated_names(group.paths)]
+            steps.append({"name": f"lights {group.target} {group.filter}", "kind": "lights",
+                          "inputs": group.paths, "outputs": calibrated, "output_dir": out_dir,
+                          "bias": bias_for(group), "flat": flat,
+                          "dark": _nearest_dark(darks, group) or from_library("dark", group)})
+            if options["stack"] and len(calibrated) > 1:
+                output = os.path.join(output_dir, f"Stacked_{label}.fits")
+                steps.append({"name": f"stack {group.target} {group.filter}", "kind": "stack",
+                              "inputs": calibrated, "outputs": [output], "output": output})
+    finally:
+        if library is not None:
+            library.close()
+    if not steps:
+        raise ValueError(f"No calibration or light frames found in {night} (checked IMAGETYP).")
+    for step in steps:
+        step["state"] = "queued"
+    return steps
+
+
+def run_step(step, options, memory_limit, workers, cache=None, progress=None, cancel=None):
+    """Run one planned step with its share of memory and workers."""
+    kind = step["kind"]
+    common = dict(memory_limit=memory_limit, workers=workers, progress=progress, cancel=cancel)
+    master = dict(cache=cache, bitpix=options["bitpix"], compression=options["compression"], **common)
+    if kind == "bias":
+        combine_to_file(step["inputs"], step["output"], **STEP_SETTINGS["bias"], **master)
+    elif kind == "dark":
+        make_master_dark(step["inputs"], step["output"], step["bias"], **STEP_SETTINGS["dark"], **master)
+    elif kind == "flat":
+        make_master_flat(step["inputs"], step["output"], step["bias"], master_dark=step["dark"],
+                         **STEP_SETTINGS["flat"], **master)
+    elif kind == "lights":
+        calibrate_lights(step["inputs"], step["output_dir"], step["bias"], step["flat"],
+                         master_dark=step["dark"], **common)
+    elif kind == "stack":
+        from astroreduct.stacking import stack_lights  # Pulls in the FFT code only when stacking
+        stack_lights(step["inputs"], step["output"], **STEP_SETTINGS["stack"], **common)
+    else:
+        raise ValueError(f"Unknown step kind: {kind}")
+
+
+def _step_done(step):
+    return step["state"] == "done" and all(os.path.exists(p) for p in step["outputs"])
+
+
+def run_job(queue, job, memory_limit=DEFAULT_MEMORY_LIMIT, workers=1, cancel=None):
+    """Plan (once) and run the steps of a claimed job, recording each step as it finishes.
+
+    A job that is cancelled goes back to 'queued'; one whose step fails
+    is marked 'failed' with the error.
+    """
+    job_id, options = job["id"], job["options"]
+    last_update = [0.0]
+
+    def record(message):
+        queue.update(job_id, message=message)
+
+    def step_progress(name):
+        def progress(stage, done, total):
+            now = time.monotonic()
+            if now - last_update[0] >= PROGRESS_INTERVAL or done == total:
+                last_update[0] = now
+                record(f"{name}: {stage} {done}/{total}")
+        return progress
+
+    steps = job["steps"]
+    try:
+        if steps is None:
+            record("Scanning and planning")
+            os.makedirs(job["output_dir"], exist_ok=True)
+            steps = plan_night(job["night"], job["output_dir"], options, cancel=cancel)
+            queue.update(job_id, steps=steps)
+        cache = ResultCache() if options["use_cache"] else None
+        for step in steps:
+            if _step_done(step):
+                continue
+            step["state"] = "running"
+            queue.update(job_id, steps=steps)
+            run_step(step, options, memory_limit, workers, cache, step_progress(step["name"]), cancel)
+            step["state"] = "done"
+            if options["use_library"] and step["kind"] in ("bias", "dark", "flat"):
+                with MasterLibrary() as library:
+                    library.add(step["output"], step["kind"])
+            queue.update(job_id, steps=steps, message=f"{step['name']}: done")
+    except CombineCancelled:
+        for step in steps or []:
+            if step["state"] == "running":
+                step["state"] = "queued"
+        queue.update(job_id, steps=steps, state="queued", pid=None, message="Stopped; will resume")
+        return "queued"
+    except Exception as e:
+        queue.update(job_id, state="failed", pid=None, finished=time.time(), message=f"{type(e).__name__}: {e}")
+        return "failed"
+    queue.update(job_id, state="done", pid=None, finished=time.time(),
+                 message=f"{len(steps)} steps done")
+    return "done"
+
+
+def run_queue(path=None, max_jobs=1, memory_limit=DEFAULT_MEMORY_LIMIT, workers=None, progress=None,
+              cancel=None):
+    """Run queued jobs until none are left, ``max_jobs`` nights at a time.
+
+    Each running night gets ``memory_limit / max_jobs`` bytes and
+    ``workers / max_jobs`` worker processes (at least one). Jobs left
+    running by a crashed runner are resumed. When ``cancel`` is set, no
+    more jobs start and running ones stop at their next progress report,
+    staying queued. Reports the "Batch" stage; returns {state: count}.
+    """
+    workers = workers or os.cpu_count() or 1
+    job_memory = memory_limit // max_jobs
+    job_workers = max(1, workers // max_jobs)
+    results = {}
+    with JobQueue(path) as queue, ThreadPoolExecutor(max_workers=max_jobs) as pool:
+        queue.recover()
+        total = len(queue.jobs("queued"))
+        running = set()
+        while True:
+            stopping = cancel is not None and cancel.is_set()
+            while not stopping and len(running) < max_jobs:
+                job = queue.claim()
+                if job is None:
+                    break
+                running.add(pool.submit(run_job, queue, job, job_memory, job_workers, cancel))
+            if not running:
+                break
+            finished, running = wait(running, timeout=1.0, return_when=FIRST_COMPLETED)
+            for future in finished:
+                state = future.result()
+                results[state] = results.get(state, 0) + 1
+            if progress is not None:
+                progress("Batch", sum(results.values()), max(total, sum(results.values())))
+    return results
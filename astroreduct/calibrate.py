@@ -0,0 +1,238 @@
+"""Master dark and flat creation and batch calibration of light frames."""
+import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import numpy as np
+from astropy.io import fits
+
+from astroreduct.combine import DEFAULT_MEMORY_LIMIT, combine_files, full_options, write_master
+from astroreduct.frames import read_header_values, read_plane
+from astroreduct.incremental import update_master
+from astroreduct.jobs import report
+from astroreduct.output import DEFAULT_BITPIX, output_options
+from astroreduct.profiling import add_bytes, span
+from astroreduct.results import input_settings, provenance_header, result_key
+
+
+def load_master(path, dtype=np.float32):
+    """Read a master frame fully into memory as ``dtype``."""
+    data = read_plane(path)
+    if data is None:
+        raise ValueError(f"{path} does not contain an image.")
+    return np.asarray(data, dtype=dtype)
+
+
+def dark_exptime(master_dark):
+    """Exposure time a master dark was made with, from its EXPTIME keyword."""
+    value = read_header_values(master_dark, ("EXPTIME",)).get("EXPTIME")
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0:
+        raise ValueError(f"{master_dark} has no EXPTIME, so it cannot be scaled to other exposures.")
+    return float(value)
+
+
+def dark_offset(master_bias, master_dark, exptime):
+    """Master bias plus the master dark scaled to ``exptime``, as one float64 image."""
+    offset = load_master(master_dark, np.float64)
+    offset *= exptime / dark_exptime(master_dark)
+    bias = load_master(master_bias, np.float64) if isinstance(master_bias, str) else master_bias
+    if bias.shape != offset.shape:
+        raise ValueError(f"Master bias {bias.shape} and dark {offset.shape} differ in shape.")
+    offset += bias
+    return offset
+
+
+def _make_master(kind, paths, output_file, master_bias, master_dark, overwrite, state_dir, cache,
+                 bitpix, compression, background, progress, cancel, **kwargs):
+    """Combine frames with the bias (and scaled dark) taken off; see make_master_flat."""
+    options = full_options(kwargs)
+    key = result_key(kind, paths, dict(options, **output_options(bitpix, compression)), master_bias, master_dark)
+    if cache is not None and cache.fetch(key, output_file, overwrite):
+        if progress is not None:
+            progress("Writing", 1, 1)
+        return read_plane(output_file)
+
+    if master_dark is not None:
+        exptime = input_settings(paths).get("EXPTIME")
+        if exptime is None:
+            raise ValueError(f"The {kind} frames have no EXPTIME to scale the dark to.")
+        master_bias = dark_offset(master_bias, master_dark, exptime)
+    elif isinstance(master_bias, str):
+        master_bias = load_master(master_bias, np.float64)
+    combine = combine_files if state_dir is None else partial(update_master, state_dir=state_dir)
+    master = combine(paths, bias=master_bias, progress=progress, cancel=cancel, **kwargs)
+
+    header = fits.Header()
+    subtracted = "bias- and dark-subtracted" if master_dark is not None else "bias-subtracted"
+    if kind == "flat":
+        level = np.median(master)
+        if level == 0 or not np.isfinite(level):
+            raise ValueError("Master flat has a zero or undefined median; check the flat frames.")
+        master /= level
+        header["HISTORY"] = f"Master flat from {len(paths)} {subtracted} frames"
+        header["FLATNORM"] = (float(level), "Median divided out of the master flat")
+    else:
+        header["HISTORY"] = f"Master {kind} from {len(paths)} {subtracted} frames"
+
+    report(progress, cancel, "Writing", 0, 1)
+    provenance_header(kind, paths, options, key, header)
+    write_master(output_file, master, header, overwrite, bitpix, compression, background, cache, key)
+    if progress is not None:
+        progress("Writing", 1, 1)
+    return master
+
+
+def make_master_dark(paths, output_file, master_bias, overwrite=True, state_dir=None, cache=None,
+                     bitpix=DEFAULT_BITPIX, compression=None, background=False, progress=None, cancel=None,
+                     **kwargs):
+    """Combine bias-subtracted darks into a master dark of thermal signal only.
+
+    The master keeps the median EXPTIME and CCD-TEMP of its frames, so it
+    can be scaled to other exposures and matched by temperature. Keyword
+    arguments work as in :func:`make_master_flat`, with no scaling by
+    default.
+    """
+    return _make_master("dark", paths, output_file, master_bias, None, overwrite, state_dir, cache,
+                        bitpix, compression, background, progress, cancel, **kwargs)
+
+
+def make_master_flat(paths, output_file, master_bias, master_dark=None, overwrite=True, state_dir=None,
+                     cache=None, bitpix=DEFAULT_BITPIX, compression=None, background=False,
+                     progress=None, cancel=None, **kwargs):
+    """Combine bias-subtracted flats and normalise the result to a median of 1.
+
+    ``master_bias`` is a path or an array; ``master_dark`` (a path) is
+    scaled to the flats' median EXPTIME and taken off as well. Remaining
+    keyword arguments go to :func:`combine_files` (``scale='median'`` by
+    default, so each flat is normalised before rejection). ``state_dir``,
+    ``cache``, ``bitpix``, ``compression`` and ``background`` work as in
+    :func:`combine_to_file`.
+    """
+    kwargs.setdefault("scale", "median")
+    return _make_master("flat", paths, output_file, master_bias, master_dark, overwrite, state_dir, cache,
+                        bitpix, compression, background, progress, cancel, **kwargs)
+
+
+def calibrated_name(path, suffix="_cal"):
+    stem, _ = os.path.splitext(os.path.basename(path))
+    return f"{stem}{suffix}.fits"
+
+
+def calibrated_names(paths, suffix="_cal"):
+    """Output names for ``paths``, in order, none of them the same.
+
+    Lights sharing a file name (e.g. R/light0001.fits and V/light0001.fits)
+    get their folder's name as a prefix, and an index if that still clashes.
+    """
+    names = [calibrated_name(path, suffix) for path in paths]
+    counts = Counter(names)
+    names = [name if counts[name] == 1
+             else f"{os.path.basename(os.path.dirname(os.path.abspath(path)))}_{name}"
+             for name, path in zip(names, paths)]
+    counts = Counter(names)
+    return [name if counts[name] == 1 else f"{i:04d}_{name}" for i, name in enumerate(names)]
+
+
+def _write_calibrated(path, data, header, overwrite):
+    with span("Write calibrated", file=os.path.basename(path)):
+        fits.writeto(path, data, header, overwrite=overwrite)
+        add_bytes(written=os.path.getsize(path))
+    return path
+
+
+def calibrate_lights(paths, output_dir, master_bias, master_flat, master_dark=None, blank=0.0,
+                     memory_limit=DEFAULT_MEMORY_LIMIT, workers=None, overwrite=True,
+                     progress=None, cancel=None):
+    """Write (light - bias - dark) / flat for every light frame into ``output_dir``.
+
+    Lights are processed in float32 batches sized to ``memory_limit``;
+    each batch is calibrated with one broadcast subtract and divide, and
+    its frames are written by ``workers`` threads while the next batch is
+    read. ``master_dark`` (a path, optional) is scaled to each light's
+    EXPTIME. Pixels where the flat is zero are set to ``blank``. Output
+    names follow :func:`calibrated_names`; returns the paths in input order.
+    """
+    if not paths:
+        raise ValueError("No light frames to calibrate.")
+    if isinstance(master_bias, str):
+        master_bias = load_master(master_bias)
+    if isinstance(master_flat, str):
+        master_flat = load_master(master_flat)
+    if master_bias.shape != master_flat.shape:
+        raise ValueError(f"Master bias {master_bias.shape} and flat {master_flat.shape} differ in shape.")
+    shape = master_bias.shape
+    dark = None
+    if master_dark is not None:
+        dark, dark_time = load_master(master_dark), dark_exptime(master_dark)
+        if dark.shape != shape:
+            raise ValueError(f"Master dark {dark.shape} and bias {shape} differ in shape.")
+        scaled_dark = np.empty(shape, dtype=np.float32)
+
+    # Multiply by the reciprocal rather than dividing every frame; zero flat pixels give blank
+    bad = master_flat == 0
+    inverse_flat = np.divide(1.0, master_flat, out=np.zeros(shape, dtype=np.float32), where=~bad)
+
+    if dark is None:
+        history = "Calibrated: (light - MasterBias) / MasterFlat"
+    else:
+        history = "Calibrated: (light - MasterBias - scaled MasterDark) / MasterFlat"
+
+    names = calibrated_names(paths)
+    os.makedirs(output_dir, exist_ok=True)
+    frame_bytes = shape[0] * shape[1] * 4
+    # Two batches may be alive at once: one being written, one being filled
+    batch_size = max(1, int(memory_limit // (2 * frame_bytes)))
+    outputs = []
+    pending = []
+    done = 0
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as writer:
+        for start in range(0, len(paths), batch_size):
+            batch_paths = paths[start:start + batch_size]
+            batch = np.empty((len(batch_paths),) + shape, dtype=np.float32)
+            headers = []
+            for i, path in enumerate(batch_paths):
+                report(progress, cancel, "Calibrating", done, len(paths))
+                data = read_plane(path)
+                if data is None or data.shape != shape:
+                    raise ValueError(f"{path} has shape {None if data is None else data.shape}, "
+                                     f"masters have {shape}.")
+                batch[i] = data
+                header = fits.getheader(path)
+                for key in ("BZERO", "BSCALE", "BLANK"):  # Output is unscaled float32
+                    header.remove(key, ignore_missing=True)
+                headers.append(header)
+
+            with span("Calibrate batch", frames=len(batch_paths)):
+                batch -= master_bias
+                if dark is not None:
+                    for frame, header, path in zip(batch, headers, batch_paths):
+                        exptime = header.get("EXPTIME")
+                        if not isinstance(exptime, (int, float)) or isinstance(exptime, bool):
+                            raise ValueError(f"{path} has no EXPTIME to scale the master dark to.")
+                        if exptime == dark_time:
+                            frame -= dark
+                        else:
+                            np.multiply(dark, exptime / dark_time, out=scaled_dark)
+                            frame -= scaled_dark
+                batch *= inverse_flat
+                if bad.any():
+                    batch[:, bad] = blank
+
+            # Let the previous batch finish writing before this one is queued
+            for future in pending:
+                outputs.append(future.result())
+                done += 1
+                report(progress, cancel, "Calibrating", done, len(paths))
+            pending = []
+            for name, data, header in zip(names[start:start + batch_size], batch, headers):
+                header["ARKIND"] = ("calibrated", "AstroReduct product")
+                header["HISTORY"] = history
+                out = os.path.join(output_dir, name)
+                pending.append(writer.submit(_write_calibrated, out, data, header, overwrite))
+
+        for future in pending:
+            outputs.append(future.result())
+            done += 1
+            report(progress, cancel, "Calibrating", done, len(paths))
+    return outputs
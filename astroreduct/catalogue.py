@@ -0,0 +1,247 @@
+"""Header-only frame catalogue kept in a local SQLite database.
+
+Scanning a directory reads just the primary header of each new or changed
+FITS file (a few 2880-byte blocks, parsed only for the keywords we keep),
+in parallel threads. Files whose size and mtime match the database are not
+opened again, so rescanning a night that is already catalogued costs one
+``stat`` per file. Frames can then be grouped into bias, dark, flat-per-
+filter and light-per-target sets. AstroReduct's own products (masters,
+calibrated and stacked frames, marked by ARKIND) are catalogued but never
+grouped, so a folder holding earlier results can be scanned again.
+"""
+import os
+import sqlite3
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from astroreduct.frames import FITS_EXTENSIONS, read_header_values
+from astroreduct.jobs import report
+
+# Database column and type for each header keyword that is kept
+COLUMNS = {
+    "IMAGETYP": ("imagetyp", "TEXT"),
+    "OBJECT": ("object", "TEXT"),
+    "FILTER": ("filter", "TEXT"),
+    "EXPTIME": ("exptime", "REAL"),
+    "NAXIS": ("naxis", "INTEGER"),
+    "NAXIS1": ("naxis1", "INTEGER"),
+    "NAXIS2": ("naxis2", "INTEGER"),
+    "BITPIX": ("bitpix", "INTEGER"),
+    "CCD-TEMP": ("ccd_temp", "REAL"),
+    "GAIN": ("gain", "REAL"),
+    "DATE-OBS": ("date_obs", "TEXT"),
+    "ARKIND": ("arkind", "TEXT"),
+}
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS frames (
+    path TEXT PRIMARY KEY,
+    directory TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    kind TEXT,
+    {", ".join(f"{column} {kind}" for column, kind in COLUMNS.values())}
+);
+CREATE INDEX IF NOT EXISTS frames_directory ON frames (directory);
+CREATE INDEX IF NOT EXISTS frames_group ON frames (kind, filter, object, naxis1, naxis2);
+"""
+
+FrameGroup = namedtuple("FrameGroup", "kind filter target exptime shape paths")
+
+
+def default_catalogue_path():
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "astroreduct", "catalogue.sqlite")
+
+
+def frame_kind(imagetyp):
+    """'bias', 'dark', 'flat' or 'light' from an IMAGETYP value, or None."""
+    value = str(imagetyp or "").lower()
+    if "bias" in value or "zero" in value:
+        return "bias"
+    if "dark" in value:
+        return "dark"
+    if "flat" in value:
+        return "flat"
+    if "light" in value or "object" in value or "science" in value:
+        return "light"
+    return None
+
+
+class FrameCatalogue:
+    """SQLite index of frame headers, updated incrementally by :meth:`scan`."""
+
+    def __init__(self, path=None):
+        self.path = path or default_catalogue_path()
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.db = sqlite3.connect(self.path)
+        # The table is only a cache of headers; one with other columns is rebuilt
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(frames)")]
+        if columns and columns != ["path", "directory", "size", "mtime_ns", "kind"] + [
+                column for column, _ in COLUMNS.values()]:
+            with self.db:
+                self.db.execute("DROP TABLE frames")
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def scan(self, directory, recursive=True, workers=None, exclude=(), progress=None, cancel=None):
+        """Bring the catalogue up to date with ``directory``; returns the number of files read.
+
+        Folders in ``exclude`` are not entered. Files that disappeared are
+        dropped and files that fail to parse are skipped. Reports the
+        "Scanning headers" stage.
+        """
+        directory = os.path.abspath(directory)
+        exclude = {os.path.abspath(path) for path in exclude}
+        found = {}
+        for root, dirs, files in os.walk(directory):
+            dirs[:] = [d for d in dirs if os.path.join(root, d) not in exclude]
+            for name in files:
+                if name.lower().endswith(FITS_EXTENSIONS):
+                    path = os.path.join(root, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    found[path] = (st.st_size, st.st_mtime_ns)
+            if not recursive:
+                break
+
+        known = {row["path"]: (row["size"], row["mtime_ns"])
+                 for row in self.frames(directory, exclude, recursive)}
+        gone = [(path,) for path in known if path not in found]
+        todo = [path for path, stamp in found.items() if known.get(path) != stamp]
+
+        rows = []
+        report(progress, cancel, "Scanning headers", 0, len(todo))
+        workers = workers or min(32, 4 * (os.cpu_count() or 1))
+        # Only a few reads per thread are queued ahead, so a cancel does not wait for the rest
+        ahead = deque()
+        paths = iter(todo)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            try:
+                for path in islice(paths, 4 * workers):
+                    ahead.append((path, pool.submit(_safe_header_values, path)))
+                done = 0
+                while ahead:
+                    path, future = ahead.popleft()
+                    values = future.result()
+                    for next_path in islice(paths, 1):
+                        ahead.append((next_path, pool.submit(_safe_header_values, next_path)))
+                    if values is not None:
+                        rows.append(self._row(path, found[path], values))
+                    else:
+                        gone.append((path,))
+                    done += 1
+                    # Cancel is checked after every read, progress reported every 100
+                    report(progress if done % 100 == 0 or done == len(todo) else None, cancel,
+                           "Scanning headers", done, len(todo))
+            except BaseException:
+                for _, future in ahead:
+                    future.cancel()
+                raise
+
+        with self.db:
+            self.db.executemany("DELETE FROM frames WHERE path = ?", gone)
+            self.db.executemany(f"INSERT OR REPLACE INTO frames VALUES ({', '.join('?' * (5 + len(COLUMNS)))})",
+                                rows)
+        return len(todo)
+
+    @staticmethod
+    def _row(path, stamp, values):
+        kind = frame_kind(values.get("IMAGETYP")) if values.get("ARKIND") is None else None
+        return ((path, os.path.dirname(path)) + stamp + (kind,) + tuple(values.get(key) for key in COLUMNS))
+
+    def frames(self, directory=None, exclude=(), recursive=True, **where):
+        """Rows as dicts, optionally limited to ``directory`` and column values.
+
+        ``directory`` takes in its subfolders if ``recursive``, except those in ``exclude``.
+        """
+        clauses, params = [], []
+        if directory is not None:
+            directory = os.path.abspath(directory)
+            if recursive:
+                clauses.append("(directory = ? OR directory LIKE ? ESCAPE '\\')")
+                params += [directory, _like_prefix(directory)]
+            else:
+                clauses.append("directory = ?")
+                params.append(directory)
+        for path in exclude:
+            path = os.path.abspath(path)
+            clauses.append("NOT (directory = ? OR directory LIKE ? ESCAPE '\\')")
+            params += [path, _like_prefix(path)]
+        for column, value in where.items():
+            if column not in ("path", "kind") and column not in dict(COLUMNS.values()):
+                raise ValueError(f"Unknown catalogue column: {column}")
+            clauses.append(f"{column} IS ?")
+            params.append(value)
+        query = "SELECT * FROM frames"
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        cursor = self.db.execute(query + " ORDER BY path", params)
+        names = [d[0] for d in cursor.description]
+        return [dict(zip(names, row)) for row in cursor]
+
+    def groups(self, directory=None, exclude=(), recursive=True):
+        """Group catalogued frames into calibration sets.
+
+        Frames only share a group if they have the same size. Biases are
+        grouped together, darks by exposure time, flats by filter and
+        lights by filter and target; frames of unknown type and products
+        are left out.
+        """
+        groups = {}
+        for row in self.frames(directory, exclude, recursive):
+            kind = row["kind"]
+            if kind is None:
+                continue
+            key = (kind,
+                   row["filter"] if kind in ("flat", "light") else None,
+                   row["object"] if kind == "light" else None,
+                   row["exptime"] if kind == "dark" else None,
+                   (row["naxis2"], row["naxis1"]))
+            groups.setdefault(key, []).append(row["path"])
+        return [FrameGroup(*key, paths) for key, paths in sorted(groups.items(), key=_group_order)]
+
+
+def group_label(group):
+    """Short description such as 'flat R, 4096x4096, 25 frames'."""
+    parts = [part for part in (group.kind, group.filter, group.target) if part is not None]
+    if group.exptime is not None:
+        parts.append(f"{group.exptime:g}s")
+    return f"{' '.join(str(p) for p in parts)}, {group.shape[1]}x{group.shape[0]}, {len(group.paths)} frames"
+
+
+def _safe_header_values(path):
+    try:
+        return read_header_values(path, COLUMNS)
+    except (OSError, ValueError):
+        return None
+
+
+def _like_prefix(directory):
+    escaped = directory.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return escaped.rstrip(os.sep) + os.sep + "%"
+
+
+def _group_order(item):
+    key, _ = item
+    order = ("bias", "dark", "flat", "light")
+    return (order.index(key[0]),) + tuple(str(part) for part in key[1:])
+
+
+def scan_groups(directory, catalogue_path=None, recursive=True, exclude=(), progress=None, cancel=None):
+    """Scan ``directory``, except the folders in ``exclude``, into the catalogue and return its frame groups."""
+    with FrameCatalogue(catalogue_path) as catalogue:
+        catalogue.scan(directory, recursive=recursive, exclude=exclude, progress=progress, cancel=cancel)
+        return catalogue.groups(directory, exclude, recursive)
@@ -0,0 +1,369 @@
+"""Command-line reduction, sharing the engine used by the GUI.
+
+    python -m astroreduct bias --in BIAS/ --out MasterBias.fits --reject minmax --nhigh 1
+    python -m astroreduct dark --in DARK/ --bias MasterBias.fits --out MasterDark.fits
+    python -m astroreduct flat --in FLAT/ --bias MasterBias.fits --dark MasterDark.fits --out MasterFlat.fits
+    python -m astroreduct lights --in LIGHTS/ --bias MasterBias.fits --flat MasterFlat.fits --out-dir calibrated/
+    python -m astroreduct lights --in LIGHTS/ --library --out-dir calibrated/
+    python -m astroreduct stack --in calibrated/ --out Stacked.fits --combine average --reject sigclip
+    python -m astroreduct groups /data/night1
+    python -m astroreduct masters
+    python -m astroreduct queue add /data/night1 /data/night2 && python -m astroreduct queue run --jobs 2
+    python -m astroreduct --profile trace.json bias --in BIAS/ --out MasterBias.fits
+
+Nothing here imports PyQt5, so it runs on headless machines.
+"""
+import argparse
+import os
+import sys
+import time
+
+from astroreduct.batch import JobQueue, run_queue
+from astroreduct.calibrate import calibrate_lights, make_master_dark, make_master_flat
+from astroreduct.catalogue import group_label, scan_groups
+from astroreduct.combine import DEFAULT_MEMORY_LIMIT, REJECT_METHODS, combine_to_file
+from astroreduct import profiling
+from astroreduct.frames import fits_files_in
+from astroreduct.library import MasterLibrary, frame_settings
+from astroreduct.output import BITPIX_CHOICES, COMPRESSION_TYPES, DEFAULT_BITPIX
+from astroreduct.rejection import DEFAULT_HSIGMA, DEFAULT_LSIGMA, DEFAULT_NKEEP, DEFAULT_PCLIP
+from astroreduct.results import ResultCache
+from astroreduct.stacking import stack_lights
+
+
+def expand_inputs(inputs):
+    """FITS files named directly or found (non-recursively) in the given directories."""
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            paths.extend(fits_files_in(item))
+        else:
+            paths.append(item)
+    return paths
+
+
+def print_progress(stage, done, total):
+    sys.stderr.write(f"\r{stage}: {done}/{total}   ")
+    if done == total:
+        sys.stderr.write("\n")
+    sys.stderr.flush()
+
+
+def add_common_options(parser):
+    parser.add_argument("--in", dest="inputs", nargs="+", required=True, metavar="PATH",
+                        help="Input FITS files and/or directories")
+    parser.add_argument("--blank", type=float, default=0.0, help="Value for empty pixels")
+    parser.add_argument("--memory-limit", type=float, default=DEFAULT_MEMORY_LIMIT / 1024 ** 2,
+                        metavar="MB", help="Memory for one band of the stack or batch of frames")
+    parser.add_argument("--no-clobber", action="store_true", help="Fail if an output exists")
+    parser.add_argument("-q", "--quiet", action="store_true", help="No progress output")
+
+
+def add_library_option(parser):
+    parser.add_argument("--library", nargs="?", const="", default=None, metavar="DIR",
+                        help="Take masters not given from the master library and store new masters in it "
+                             "(default library: in the user data directory)")
+
+
+def add_combine_options(parser, scale="none"):
+    add_common_options(parser)
+    add_library_option(parser)
+    parser.add_argument("--out", required=True, help="Output master frame")
+    parser.add_argument("--combine", default="median", choices=("median", "average"))
+    parser.add_argument("--reject", default="minmax", choices=REJECT_METHODS)
+    parser.add_argument("--nlow", type=int, default=0, help="Minmax low pixels to reject")
+    parser.add_argument("--nhigh", type=int, default=1, help="Minmax high pixels to reject")
+    parser.add_argument("--lsigma", type=float, default=DEFAULT_LSIGMA, help="Sigclip/pclip low threshold")
+    parser.add_argument("--hsigma", type=float, default=DEFAULT_HSIGMA, help="Sigclip/pclip high threshold")
+    parser.add_argument("--pclip", type=float, default=DEFAULT_PCLIP, help="Pclip percentile parameter")
+    parser.add_argument("--nkeep", type=int, default=DEFAULT_NKEEP,
+                        help="Minimum pixels to keep (negative: maximum to reject)")
+    parser.add_argument("--maxiters", type=int, default=None, help="Clipping iterations (default: until stable)")
+    parser.add_argument("--no-mclip", dest="mclip", action="store_false",
+                        help="Clip about the min/max-excluded mean instead of the median")
+    parser.add_argument("--scale", default=scale, choices=("none", "median", "mean", "mode"))
+    parser.add_argument("--statsec", type=int, nargs=4, metavar=("X1", "X2", "Y1", "Y2"),
+                        help="Combine only this section")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Processes combining row bands (default: all cores)")
+    parser.add_argument("--state", metavar="DIR",
+                        help="Keep a combine state here and update the master from it when frames change")
+    parser.add_argument("--verify", action="store_true",
+                        help="With --state, check the updated master against a full combine")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Always combine, even if an identical master is in the result cache")
+    parser.add_argument("--bitpix", default=DEFAULT_BITPIX, choices=BITPIX_CHOICES,
+                        help="Stored pixel type; int16 is scaled with BZERO/BSCALE")
+    parser.add_argument("--compress", choices=tuple(COMPRESSION_TYPES),
+                        help="Tile-compress the master (rice quantises float pixels, gzip is lossless)")
+
+
+def combine_options(args):
+    options = dict(combine_method=args.combine, reject_method=args.reject, nlow=args.nlow,
+                   nhigh=args.nhigh, scale=args.scale, statsec=args.statsec, blank=args.blank,
+                   memory_limit=int(args.memory_limit * 1024 ** 2), lsigma=args.lsigma,
+                   hsigma=args.hsigma, pclip=args.pclip, nkeep=args.nkeep, mclip=args.mclip,
+                   maxiters=args.maxiters, workers=args.workers or os.cpu_count(),
+                   bitpix=args.bitpix, compression=args.compress)
+    if args.state:
+        options.update(state_dir=args.state, verify=args.verify)
+    if not args.no_cache:
+        options["cache"] = ResultCache()
+    return options
+
+
+def library_master(args, kind, paths, required=True):
+    """The master given for ``kind``, else the library's nearest match for ``paths``."""
+    given = getattr(args, kind)
+    if given or args.library is None:
+        if required and not given:
+            raise ValueError(f"--{kind} is required (or --library to use a stored master).")
+        return given
+    with MasterLibrary(args.library or None) as library:
+        found = library.find(kind, frame_settings(paths[0]))
+    if found is None and required:
+        raise ValueError(f"No matching master {kind} in the library; give --{kind}.")
+    if found is not None and not args.quiet:
+        print(f"Using library master {kind} {found}", file=sys.stderr)
+    return found
+
+
+def store_master(args, kind):
+    if args.library is not None:
+        with MasterLibrary(args.library or None) as library:
+            stored = library.add(args.out, kind)
+        if not args.quiet:
+            print(f"Stored {args.out} in the library as {stored}", file=sys.stderr)
+
+
+def run_bias(args):
+    paths = expand_inputs(args.inputs)
+    if not paths:
+        raise ValueError("No bias frames found.")
+    t0 = time.perf_counter()
+    combine_to_file(paths, args.out, overwrite=not args.no_clobber,
+                    progress=None if args.quiet else print_progress, **combine_options(args))
+    if not args.quiet:
+        print(f"Wrote {args.out} from {len(paths)} frames in {time.perf_counter() - t0:.1f} s")
+    store_master(args, "bias")
+
+
+def run_dark(args):
+    paths = expand_inputs(args.inputs)
+    if not paths:
+        raise ValueError("No dark frames found.")
+    bias = library_master(args, "bias", paths)
+    t0 = time.perf_counter()
+    make_master_dark(paths, args.out, bias, overwrite=not args.no_clobber,
+                     progress=None if args.quiet else print_progress, **combine_options(args))
+    if not args.quiet:
+        print(f"Wrote {args.out} from {len(paths)} frames in {time.perf_counter() - t0:.1f} s")
+    store_master(args, "dark")
+
+
+def run_flat(args):
+    paths = expand_inputs(args.inputs)
+    if not paths:
+        raise ValueError("No flat frames found.")
+    bias = library_master(args, "bias", paths)
+    dark = library_master(args, "dark", paths, required=False)
+    t0 = time.perf_counter()
+    make_master_flat(paths, args.out, bias, master_dark=dark, overwrite=not args.no_clobber,
+                     progress=None if args.quiet else print_progress, **combine_options(args))
+    if not args.quiet:
+        print(f"Wrote {args.out} from {len(paths)} frames in {time.perf_counter() - t0:.1f} s")
+    store_master(args, "flat")
+
+
+def run_lights(args):
+    paths = expand_inputs(args.inputs)
+    if not paths:
+        raise ValueError("No light frames found.")
+    bias = library_master(args, "bias", paths)
+    flat = library_master(args, "flat", paths)
+    dark = library_master(args, "dark", paths, required=False)
+    t0 = time.perf_counter()
+    outputs = calibrate_lights(paths, args.out_dir, bias, flat, master_dark=dark, blank=args.blank,
+                               memory_limit=int(args.memory_limit * 1024 ** 2),
+                               workers=args.workers, overwrite=not args.no_clobber,
+                               progress=None if args.quiet else print_progress)
+    if not args.quiet:
+        print(f"Calibrated {len(outputs)} frames into {args.out_dir} in {time.perf_counter() - t0:.1f} s")
+
+
+def run_stack(args):
+    paths = expand_inputs(args.inputs)
+    if len(paths) < 2:
+        raise ValueError("Stacking needs at least two frames.")
+    t0 = time.perf_counter()
+    stack_lights(paths, args.out, reference=args.reference, min_peak=args.min_peak,
+                 overwrite=not args.no_clobber, combine_method=args.combine, reject_method=args.reject,
+                 nlow=args.nlow, nhigh=args.nhigh, lsigma=args.lsigma, hsigma=args.hsigma,
+                 scale=args.scale, blank=args.blank, memory_limit=int(args.memory_limit * 1024 ** 2),
+                 workers=args.workers or os.cpu_count(), progress=None if args.quiet else print_progress)
+    if not args.quiet:
+        print(f"Wrote {args.out} from {len(paths)} frames in {time.perf_counter() - t0:.1f} s")
+
+
+def run_groups(args):
+    t0 = time.perf_counter()
+    groups = scan_groups(args.directory, args.catalogue, recursive=not args.no_recursive,
+                         progress=None if args.quiet else print_progress)
+    for group in groups:
+        print(group_label(group))
+        if args.list:
+            for path in group.paths:
+                print(f"    {path}")
+    if not args.quiet:
+        print(f"{len(groups)} groups in {time.perf_counter() - t0:.1f} s", file=sys.stderr)
+
+
+def run_masters(args):
+    with MasterLibrary(args.library) as library:
+        rows = library.masters(args.kind)
+        directory = library.directory
+    for row in rows:
+        parts = [row["kind"], row["instrument"], f"{row['naxis1']}x{row['naxis2']}"]
+        if row["xbinning"] is not None:
+            parts.append(f"bin {row['xbinning']}x{row['ybinning']}")
+        if row["kind"] == "flat" and row["filter"] is not None:
+            parts.append(row["filter"])
+        if row["kind"] == "dark" and row["exptime"] is not None:
+            parts.append(f"{row['exptime']:g}s")
+        if row["ccd_temp"] is not None:
+            parts.append(f"{row['ccd_temp']:g}C")
+        print(f"{' '.join(str(p) for p in parts if p is not None)}  {row['path']}")
+    print(f"{len(rows)} masters in {directory}", file=sys.stderr)
+
+
+def run_queue_command(args):
+    if args.action == "run":
+        t0 = time.perf_counter()
+        results = run_queue(args.queue, max_jobs=args.jobs, memory_limit=int(args.memory_limit * 1024 ** 2),
+                            workers=args.workers, progress=None if args.quiet else print_progress)
+        counts = ", ".join(f"{n} {state}" for state, n in sorted(results.items())) or "nothing queued"
+        print(f"{counts} in {time.perf_counter() - t0:.1f} s", file=sys.stderr)
+        return
+    with JobQueue(args.queue) as queue:
+        if args.action == "add":
+            for night in args.nights:
+                options = {} if not args.no_stack else {"stack": False}
+                night = os.path.abspath(night)
+                output_dir = os.path.join(args.out, os.path.basename(night)) if args.out else None
+                print(f"{queue.add(night, output_dir, **options)} {night}")
+        elif args.action in ("retry", "remove"):
+            for job_id in args.ids:
+                getattr(queue, args.action)(job_id)
+        else:
+            for job in queue.jobs():
+                print(f"{job['id']:>4} {job['state']:<8} {job['night']}  {job['message'] or ''}")
+
+
+def print_summary():
+    """Slowest spans of a profiled run, on stderr."""
+    print(f"{'span':<24} {'count':>7} {'total s':>9} {'read MB':>9} {'written MB':>11}", file=sys.stderr)
+    for row in profiling.summary()[:15]:
+        print(f"{row['name']:<24} {row['count']:>7} {row['total']:>9.3f} "
+              f"{row['bytes_read'] / 1024 ** 2:>9.1f} {row['bytes_written'] / 1024 ** 2:>11.1f}",
+              file=sys.stderr)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="astroreduct", description="Astronomical image reduction")
+    parser.add_argument("--profile", metavar="TRACE",
+                        help="Record timing spans and save them as a Chrome trace (JSON)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    bias = commands.add_parser("bias", help="Combine bias frames into a master bias")
+    add_combine_options(bias)
+    bias.set_defaults(run=run_bias)
+
+    dark = commands.add_parser("dark", help="Combine bias-subtracted darks into a master dark")
+    add_combine_options(dark)
+    dark.add_argument("--bias", help="Master bias")
+    dark.set_defaults(run=run_dark)
+
+    flat = commands.add_parser("flat", help="Combine bias-subtracted flats into a normalised master flat")
+    add_combine_options(flat, scale="median")
+    flat.add_argument("--bias", help="Master bias")
+    flat.add_argument("--dark", help="Master dark, scaled to the flats' exposure time")
+    flat.set_defaults(run=run_flat)
+
+    lights = commands.add_parser("lights", help="Calibrate light frames: (light - bias - dark) / flat")
+    add_common_options(lights)
+    add_library_option(lights)
+    lights.add_argument("--bias", help="Master bias")
+    lights.add_argument("--dark", help="Master dark, scaled to each light's exposure time")
+    lights.add_argument("--flat", help="Normalised master flat")
+    lights.add_argument("--out-dir", required=True, help="Directory for calibrated frames")
+    lights.add_argument("--workers", type=int, default=None, help="Writer threads (default: all cores)")
+    lights.set_defaults(run=run_lights)
+
+    stack = commands.add_parser("stack", help="Align calibrated lights and combine them into one image")
+    add_common_options(stack)
+    stack.add_argument("--out", required=True, help="Stacked image")
+    stack.add_argument("--reference", type=int, default=0, help="Index of the frame the others are aligned to")
+    stack.add_argument("--min-peak", type=float, default=None,
+                       help="Leave out frames whose correlation peak is lower (0-1)")
+    stack.add_argument("--combine", default="average", choices=("median", "average"))
+    stack.add_argument("--reject", default="sigclip", choices=REJECT_METHODS)
+    stack.add_argument("--nlow", type=int, default=0, help="Minmax low pixels to reject")
+    stack.add_argument("--nhigh", type=int, default=1, help="Minmax high pixels to reject")
+    stack.add_argument("--lsigma", type=float, default=DEFAULT_LSIGMA, help="Sigclip/pclip low threshold")
+    stack.add_argument("--hsigma", type=float, default=DEFAULT_HSIGMA, help="Sigclip/pclip high threshold")
+    stack.add_argument("--scale", default="none", choices=("none", "median", "mean", "mode"))
+    stack.add_argument("--workers", type=int, default=None,
+                       help="Processes registering and combining (default: all cores)")
+    stack.set_defaults(run=run_stack)
+
+    groups = commands.add_parser("groups", help="Catalogue frame headers and group them by type")
+    groups.add_argument("directory", help="Directory to scan")
+    groups.add_argument("--catalogue", default=None, help="Catalogue database (default: in the user cache)")
+    groups.add_argument("--no-recursive", action="store_true", help="Do not scan subdirectories")
+    groups.add_argument("--list", action="store_true", help="Print the files in each group")
+    groups.add_argument("-q", "--quiet", action="store_true", help="No progress output")
+    groups.set_defaults(run=run_groups)
+
+    masters = commands.add_parser("masters", help="List the masters in the master library")
+    masters.add_argument("--library", default=None, metavar="DIR", help="Library directory")
+    masters.add_argument("--kind", choices=("bias", "dark", "flat"), help="Only masters of this kind")
+    masters.set_defaults(run=run_masters)
+
+    queue = commands.add_parser("queue", help="Queue whole nights and reduce them unattended")
+    queue.add_argument("--queue", default=None, metavar="DB", help="Queue database (default: in the user data directory)")
+    actions = queue.add_subparsers(dest="action", required=True)
+    add = actions.add_parser("add", help="Queue nights: bias, darks, flats, then lights of each folder")
+    add.add_argument("nights", nargs="+", help="Night folders, scanned recursively by IMAGETYP")
+    add.add_argument("--out", default=None, help="Output root, with a folder per night (default: 'reduced' next to the nights)")
+    add.add_argument("--no-stack", action="store_true", help="Calibrate lights without stacking them")
+    actions.add_parser("list", help="Show the queued, running, finished and failed jobs")
+    run = actions.add_parser("run", help="Run queued jobs, resuming interrupted ones, until none are left")
+    run.add_argument("--jobs", type=int, default=1, help="Nights reduced at once")
+    run.add_argument("--memory-limit", type=float, default=DEFAULT_MEMORY_LIMIT / 1024 ** 2, metavar="MB",
+                     help="Memory shared by the running nights")
+    run.add_argument("--workers", type=int, default=None, help="Processes shared by the running nights")
+    run.add_argument("-q", "--quiet", action="store_true", help="No progress output")
+    for action in ("retry", "remove"):
+        sub = actions.add_parser(action, help=f"{action.capitalize()} jobs that are not running")
+        sub.add_argument("ids", type=int, nargs="+", metavar="ID")
+    queue.set_defaults(run=run_queue_command)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.profile:
+        profiling.enable()
+    try:
+        with profiling.span(args.command):
+            args.run(args)
+    except KeyboardInterrupt:
+        return 130
+    except (OSError, ValueError) as e:
+        print(f"astroreduct: error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        if args.profile:
+            profiling.write_chrome_trace(args.profile)
+            print_summary()
+    return 0
@@ -0,0 +1,319 @@
+"""Memory-bounded master frame combine.
+
+Frames are never stacked whole: the output is built a band of rows at a
+time, with each band read straight from the input files through
+``ImageHDU.section``. Minmax rejection with a median combine uses
+``np.partition`` to pick only the order statistics it needs.
+"""
+import inspect
+import os
+from contextlib import ExitStack
+
+import numpy as np
+from astropy.io import fits
+
+from astroreduct.frames import data_dtype, image_hdu, read_block, read_plane
+from astroreduct.jobs import CombineCancelled, report  # noqa: F401 (CombineCancelled re-exported)
+from astroreduct.output import DEFAULT_BITPIX, in_background, output_options, wait_for_write, write_image
+from astroreduct.profiling import span
+from astroreduct.rejection import (DEFAULT_HSIGMA, DEFAULT_LSIGMA, DEFAULT_NKEEP, DEFAULT_PCLIP,
+                                   clip_combine)
+from astroreduct.results import provenance_header, result_key
+
+DEFAULT_MEMORY_LIMIT = 512 * 1024 ** 2  # Bytes for one band of the stack
+REJECT_METHODS = ("none", "minmax", "sigclip", "pclip")
+PARALLEL_MIN_VALUES = 1 << 25  # Smaller stacks stay in-process; starting workers would cost more
+
+
+def working_dtype(dtypes, scale="none"):
+    """Smallest float type that holds every input value exactly."""
+    if scale.lower() not in ("none", ""):
+        return np.dtype(np.float64)
+    for dtype in dtypes:
+        if not np.can_cast(dtype, np.float32, casting="safe"):
+            return np.dtype(np.float64)
+    return np.dtype(np.float32)
+
+
+def scale_factor(data, scale):
+    """Per-frame scaling factor for the 'median', 'mean' and 'mode' options."""
+    data = np.asarray(data, dtype=np.float64)
+    if scale == "median":
+        return np.nanmedian(data)
+    if scale == "mean":
+        return np.nanmean(data)
+    if scale == "mode":
+        med = np.nanmedian(data)
+        return med - 1.4826 * np.nanmedian(np.abs(data - med))
+    return 1.0
+
+
+def combine_stack(stack, combine_method="median", reject_method="minmax",
+                  nlow=0, nhigh=1, blank=0.0, **clip_options):
+    """Reject and combine a (N, rows, cols) stack into a float64 image.
+
+    ``clip_options`` (lsigma, hsigma, pclip, nkeep, mclip, maxiters) are
+    used by the 'sigclip' and 'pclip' methods; see rejection.clip_range.
+    """
+    combine_method = combine_method.lower()
+    reject_method = (reject_method or "none").lower()
+    if combine_method not in ("median", "average"):
+        raise ValueError(f"Unknown combine method: {combine_method}")
+    if reject_method in ("sigclip", "pclip"):
+        return clip_combine(stack, combine_method, reject_method, blank, **clip_options)
+    if reject_method not in REJECT_METHODS:
+        raise ValueError(f"Unknown reject method: {reject_method}")
+
+    n = stack.shape[0]
+    rejecting = reject_method == "minmax" and n > nlow + nhigh
+    lo, hi = (nlow, n - nhigh) if rejecting else (0, n)
+
+    if not np.isfinite(stack).all():
+        # NaN/inf are replaced by ``blank`` after rejection, which can
+        # reorder the kept values; take the exact sort-based route here.
+        kept = stack.astype(np.float64)
+        if rejecting:
+            kept = np.sort(kept, axis=0)[lo:hi]
+        kept = np.nan_to_num(kept, nan=blank)
+        if combine_method == "median":
+            return np.median(kept, axis=0)
+        return np.mean(kept, axis=0)
+
+    if combine_method == "average":
+        # Summing in the same order as a full sort keeps results identical
+        kept = np.sort(stack, axis=0)[lo:hi] if rejecting else stack
+        return np.mean(kept.astype(np.float64), axis=0)
+
+    # Median of the kept values is the mean of the two middle order
+    # statistics, which is exactly what np.median computes.
+    m = hi - lo
+    k1 = lo + (m - 1) // 2
+    k2 = lo + m // 2
+    part = np.partition(stack, (k1, k2), axis=0)
+    low = part[k1].astype(np.float64)
+    if k1 == k2:
+        return low
+    return (low + part[k2]) / 2
+
+
+def _region(hdu, statsec):
+    """Row and column ranges of a frame that take part in the combine."""
+    height, width = hdu.shape[-2:]
+    if statsec:
+        x1, x2, y1, y2 = map(int, statsec)
+        return range(height)[y1:y2], range(width)[x1:x2]
+    return range(height), range(width)
+
+
+def rows_per_band(n_frames, width, itemsize, memory_limit, reject_method="minmax"):
+    """Rows of the stack that fit in ``memory_limit``, temporaries included."""
+    if (reject_method or "none").lower() in ("sigclip", "pclip"):
+        # Sorted float64 copy, a float64 deviation array and boolean masks
+        per_row = n_frames * width * (itemsize + 26)
+    else:
+        per_row = n_frames * width * (2 * itemsize + 8)
+    return max(1, int(memory_limit // per_row))
+
+
+class FrameStack:
+    """Frames opened for reading in row bands, bias-subtracted and scaled.
+
+    Frames are 2D (cubes contribute their first plane) and must share a
+    shape; ``statsec`` limits every frame to a section. Scale ``factors``
+    computed by another FrameStack over the same frames can be passed in
+    to skip reading them again. Use as a context manager so the files are
+    closed.
+    """
+
+    def __init__(self, paths, scale="none", statsec=None, bias=None, progress=None, cancel=None,
+                 factors=None):
+        if not paths:
+            raise ValueError("No frames to combine.")
+        self.paths = list(paths)
+        self.scale = scale
+        self.statsec = statsec
+        self.bias = bias
+        self.factors = factors
+        self.files = ExitStack()
+        try:
+            self._open(scale, statsec, progress, cancel)
+        except BaseException:
+            self.files.close()
+            raise
+
+    def _open(self, scale, statsec, progress, cancel):
+        paths = self.paths
+        self.hdus = []
+        for i, path in enumerate(paths):
+            report(progress, cancel, "Loading frames", i, len(paths))
+            wait_for_write(path)
+            with span("Open frame", file=os.path.basename(path)):
+                self.hdus.append(image_hdu(self.files.enter_context(fits.open(path))))
+        report(progress, cancel, "Loading frames", len(paths), len(paths))
+
+        for path, hdu in zip(paths, self.hdus):
+            if hdu.shape is None or len(hdu.shape) < 2:
+                raise ValueError(f"{path} does not contain a 2D image.")
+        self._layout(statsec)
+        if self.bias is not None and self.bias.shape != self.shape:
+            raise ValueError(f"Master bias has shape {self.bias.shape}, frames have {self.shape}.")
+
+        if self.bias is not None:
+            self.dtype = np.dtype(np.float64)
+        else:
+            self.dtype = working_dtype([data_dtype(h) for h in self.hdus], scale)
+        if scale not in ("none", "") and self.factors is None:
+            with span("Scale factors", scale=scale):
+                self.factors = [scale_factor(read_block(h, rows, cols) - (0 if self.bias is None else self.bias), scale)
+                                for h, (rows, cols) in zip(self.hdus, self.regions)]
+
+    def _layout(self, statsec):
+        """Set the rows and columns read from each frame, and the combined shape."""
+        self.regions = [_region(hdu, statsec) for hdu in self.hdus]
+        self.shape = (len(self.regions[0][0]), len(self.regions[0][1]))
+        for path, (rows, cols) in zip(self.paths, self.regions):
+            if (len(rows), len(cols)) != self.shape:
+                raise ValueError(f"{path} has shape {(len(rows), len(cols))}, expected {self.shape}.")
+
+    def worker_options(self):
+        """Extra keyword arguments to open the same stack in a worker process."""
+        return {}
+
+    def __len__(self):
+        return len(self.hdus)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.files.close()
+
+    def band(self, y0, y1):
+        """Rows ``y0:y1`` of every frame as a (N, rows, cols) array."""
+        tile = np.empty((len(self.hdus), y1 - y0, self.shape[1]), dtype=self.dtype)
+        with span("Read band", rows=y1 - y0, frames=len(self.hdus)):
+            for i, (hdu, (rows, cols)) in enumerate(zip(self.hdus, self.regions)):
+                tile[i] = read_block(hdu, rows[y0:y1], cols)
+                if self.bias is not None:
+                    tile[i] -= self.bias[y0:y1]
+                if self.factors is not None and self.factors[i] != 0:
+                    tile[i] /= self.factors[i]
+        return tile
+
+
+def in_parallel(frames, workers):
+    """True if a FrameStack is worth combining in ``workers`` processes."""
+    return bool(workers) and workers > 1 and len(frames) * frames.shape[0] * frames.shape[1] >= PARALLEL_MIN_VALUES
+
+
+def combine_files(paths, combine_method="median", reject_method="minmax",
+                  nlow=0, nhigh=1, scale="none", statsec=None, blank=0.0,
+                  memory_limit=DEFAULT_MEMORY_LIMIT, bias=None, progress=None, cancel=None,
+                  workers=1, **clip_options):
+    """Combine FITS frames into a float64 master without loading the whole stack.
+
+    Frames are read through :class:`FrameStack`: a ``bias`` image of the
+    combined shape is subtracted from every frame first, and with ``scale``
+    other than 'none' each frame is divided by its own statistic before
+    rejection. ``clip_options`` are passed on to :func:`combine_stack` for
+    sigclip/pclip.
+
+    With ``workers`` > 1 the row bands are combined in that many processes
+    (see :mod:`astroreduct.parallel`); ``memory_limit`` is then shared
+    between them. The result is the same either way.
+
+    ``progress(stage, done, total)`` is called as frames are opened and
+    bands combined; setting the ``cancel`` event (a ``threading.Event``)
+    raises CombineCancelled at the next step.
+    """
+    scale = (scale or "none").lower()
+    with FrameStack(paths, scale, statsec, bias, progress, cancel) as frames:
+        return combine_frames(frames, combine_method, reject_method, nlow, nhigh, blank,
+                              memory_limit, progress, cancel, workers, **clip_options)
+
+
+def combine_frames(frames, combine_method="median", reject_method="minmax", nlow=0, nhigh=1,
+                   blank=0.0, memory_limit=DEFAULT_MEMORY_LIMIT, progress=None, cancel=None,
+                   workers=1, **clip_options):
+    """Combine an open :class:`FrameStack` band by band; see :func:`combine_files`."""
+    if in_parallel(frames, workers):
+        from astroreduct.parallel import combine_bands  # It builds on this module
+        return combine_bands(frames, workers, memory_limit, progress, cancel,
+                             combine_method=combine_method, reject_method=reject_method,
+                             nlow=nlow, nhigh=nhigh, blank=blank, **clip_options)
+    height, width = frames.shape
+    master = np.empty(frames.shape, dtype=np.float64)
+    band = rows_per_band(len(frames), width, frames.dtype.itemsize, memory_limit, reject_method)
+    n_bands = -(-height // band)
+    for b, y0 in enumerate(range(0, height, band)):
+        report(progress, cancel, "Combining", b, n_bands)
+        y1 = min(y0 + band, height)
+        tile = frames.band(y0, y1)
+        with span("Combine band", rows=y1 - y0, method=f"{combine_method}/{reject_method}"):
+            master[y0:y1] = combine_stack(tile, combine_method, reject_method,
+                                          nlow, nhigh, blank, **clip_options)
+        del tile  # Freed before the next band is read
+    report(progress, cancel, "Combining", n_bands, n_bands)
+    return master
+
+
+def full_options(kwargs):
+    """``kwargs`` for :func:`combine_files` with every default filled in."""
+    options = {name: p.default for name, p in inspect.signature(combine_files).parameters.items()
+               if p.default is not p.empty and name not in ("bias", "progress", "cancel")}
+    options.update(lsigma=DEFAULT_LSIGMA, hsigma=DEFAULT_HSIGMA, pclip=DEFAULT_PCLIP,
+                   nkeep=DEFAULT_NKEEP, mclip=True, maxiters=None)
+    options.update(kwargs)
+    return options
+
+
+def write_master(output_file, data, header, overwrite=True, bitpix=DEFAULT_BITPIX, compression=None,
+                 background=False, cache=None, key=None):
+    """Write a master frame to ``output_file`` and store it in ``cache`` under ``key``.
+
+    ``bitpix`` and ``compression`` choose the stored format (see
+    :mod:`astroreduct.output`). With ``background=True`` the write runs on
+    the writer thread and this returns at once; ``data`` must then be left
+    unchanged.
+    """
+    def write():
+        write_image(output_file, data, header, overwrite, bitpix, compression)
+        if cache is not None:
+            cache.store(key, output_file)
+
+    if background:
+        in_background(output_file, write)
+    else:
+        write()
+
+
+def combine_to_file(paths, output_file, overwrite=True, state_dir=None, cache=None, bitpix=DEFAULT_BITPIX,
+                    compression=None, background=False, progress=None, cancel=None, **kwargs):
+    """Combine ``paths`` with :func:`combine_files` and write the master to ``output_file``.
+
+    With ``state_dir`` the master is updated from the combine state kept
+    there (see :mod:`astroreduct.incremental`). With a ``cache``
+    (results.ResultCache) an identical earlier result is copied instead.
+    The parameters and inputs are recorded in the output header.
+    ``bitpix``, ``compression`` and ``background`` are passed to
+    :func:`write_master`; the float64 master is returned either way.
+    """
+    options = full_options(kwargs)
+    bias = options.pop("bias", None)
+    key = result_key("combine", paths, dict(options, **output_options(bitpix, compression)), bias)
+    if cache is not None and cache.fetch(key, output_file, overwrite):
+        if progress is not None:
+            progress("Writing", 1, 1)
+        return read_plane(output_file)
+
+    if state_dir is not None:
+        from astroreduct.incremental import update_master  # It builds on this module
+        master = update_master(paths, state_dir, progress=progress, cancel=cancel, **kwargs)
+    else:
+        master = combine_files(paths, progress=progress, cancel=cancel, **kwargs)
+    report(progress, cancel, "Writing", 0, 1)
+    write_master(output_file, master, provenance_header("combine", paths, options, key), overwrite,
+                 bitpix, compression, background, cache, key)
+    if progress is not None:
+        progress("Writing", 1, 1)
+    return master
@@ -0,0 +1,113 @@
+"""Lazy, memory-mapped access to FITS frames.
+
+Pixel data is only read for the plane or block asked for, in its stored
+dtype. Unscaled images come back as copy-on-write memory maps: pages that
+are never touched never reach RAM, and writing to the array changes only
+this process's copy, never the file. Images with BZERO/BSCALE/BLANK are read
+through ``ImageHDU.section``, which scales just the requested block.
+Tile-compressed files are read from their first extension.
+"""
+import os
+from collections import namedtuple
+
+from astropy.io import fits
+
+from astroreduct.output import wait_for_write
+from astroreduct.profiling import add_bytes, span
+
+FITS_EXTENSIONS = (".fits", ".fit", ".fts")
+FrameInfo = namedtuple("FrameInfo", "path shape bitpix header")
+
+BLOCK_SIZE = 2880
+CARD_SIZE = 80
+MAX_HEADER_BLOCKS = 100  # Give up on files without an END card in the first 288 kB
+
+
+def is_scaled(header):
+    """True if the stored pixels need BZERO/BSCALE/BLANK applied."""
+    return (header.get("BSCALE", 1) != 1 or header.get("BZERO", 0) != 0
+            or (header.get("BITPIX", 0) > 0 and "BLANK" in header))
+
+
+def image_hdu(hdul):
+    """The primary HDU, or the first extension when the primary holds no image (tile-compressed files)."""
+    if hdul[0].shape or len(hdul) == 1:
+        return hdul[0]
+    return hdul[1]
+
+
+def frame_info(path):
+    """Shape, BITPIX and header of the image HDU, without reading any pixels."""
+    wait_for_write(path)
+    with fits.open(path) as hdul:
+        header = image_hdu(hdul).header
+    naxis = header.get("NAXIS", 0)
+    shape = tuple(header[f"NAXIS{i}"] for i in range(naxis, 0, -1))
+    return FrameInfo(path, shape, header.get("BITPIX"), header)
+
+
+def read_header_values(path, keys):
+    """Values of ``keys`` in the primary header, reading no pixel data.
+
+    Cards are scanned as raw bytes and only the wanted ones are parsed;
+    raises ValueError if the file does not look like FITS.
+    """
+    wait_for_write(path)
+    values = {}
+    with open(path, "rb") as f:
+        for block_number in range(MAX_HEADER_BLOCKS):
+            block = f.read(BLOCK_SIZE)
+            if len(block) < BLOCK_SIZE:
+                break
+            if block_number == 0 and not block.startswith(b"SIMPLE  ="):
+                break
+            for start in range(0, BLOCK_SIZE, CARD_SIZE):
+                card = block[start:start + CARD_SIZE]
+                keyword = card[:8].rstrip().decode("ascii", "replace")
+                if keyword == "END":
+                    return values
+                if keyword in keys and card[8:10] == b"= ":
+                    value = fits.Card.fromstring(card.decode("ascii", "replace")).value
+                    if isinstance(value, (str, int, float, bool)):
+                        values[keyword] = value.strip() if isinstance(value, str) else value
+    raise ValueError(f"{path} has no readable FITS header.")
+
+
+def first_plane(shape):
+    """Index of the first 2D plane of an image of ``shape``."""
+    return (0,) * (len(shape) - 2)
+
+
+def read_plane(path):
+    """First 2D plane of the image HDU, or None if there is no image."""
+    wait_for_write(path)
+    with span("Read frame", file=os.path.basename(path)), fits.open(path) as hdul:
+        hdu = image_hdu(hdul)
+        if not hdu.shape or len(hdu.shape) < 2:
+            return None
+        index = first_plane(hdu.shape)
+        if is_scaled(hdu.header):
+            plane = hdu.section[index + (slice(None), slice(None))]
+        else:
+            plane = hdu.data[index]
+        add_bytes(read=plane.nbytes)  # Mapped, for unscaled data: read as it is touched
+        return plane
+
+
+def read_block(hdu, rows, cols):
+    """Read ``rows`` x ``cols`` (ranges) of the first plane of an open HDU."""
+    index = first_plane(hdu.shape)
+    block = hdu.section[index + (slice(rows.start, rows.stop), slice(cols.start, cols.stop))]
+    add_bytes(read=block.nbytes)
+    return block
+
+
+def data_dtype(hdu):
+    """dtype of the scaled pixel values, found by reading a single pixel."""
+    return hdu.section[(slice(0, 1),) * len(hdu.shape)].dtype
+
+
+def fits_files_in(directory):
+    """Sorted paths of the FITS files directly inside ``directory``."""
+    return sorted(os.path.join(directory, f) for f in os.listdir(directory)
+                  if f.lower().endswith(FITS_EXTENSIONS))
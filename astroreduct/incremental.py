@@ -0,0 +1,402 @@
+"""Master frames that are updated, not recomputed, when frames come and go.
+
+Alongside a master, a small combine state is kept in a directory:
+
+* median combines (no rejection or minmax) keep, for every pixel, the
+  sorted values within ``margin`` ranks of the median(s), plus the rank
+  of the first kept value. Frames added or removed only shift ranks or
+  insert/delete values inside that window, so the new median is read
+  straight from it while the window still covers it.
+* average combines without rejection keep a float64 running sum.
+
+Updating reads only the added and removed frames (a removed file must be
+unchanged on disk) and the state. Anything else — other parameters,
+sigclip/pclip, NaN/inf pixels, more changes than the window absorbs —
+falls back to a full combine that rebuilds the state. Median results are
+identical to a full combine; sums can differ in the last bits once
+frames are removed.
+"""
+import hashlib
+import json
+import os
+import shutil
+from functools import partial
+
+import numpy as np
+
+from astroreduct.combine import DEFAULT_MEMORY_LIMIT, FrameStack, combine_files, in_parallel
+from astroreduct.jobs import report
+from astroreduct.profiling import span
+
+STATE_VERSION = 1
+DEFAULT_MARGIN = 8  # Order statistics kept either side of the median
+
+
+class StaleState(Exception):
+    """The stored state cannot produce the requested master."""
+
+
+def file_identity(path):
+    st = os.stat(path)
+    return [os.path.abspath(path), st.st_size, st.st_mtime_ns]
+
+
+def state_kind(combine_method, reject_method):
+    """'median' or 'sum' if the combine can be kept up to date, else None."""
+    combine_method = combine_method.lower()
+    reject_method = (reject_method or "none").lower()
+    if combine_method == "median" and reject_method in ("none", "minmax"):
+        return "median"
+    if combine_method == "average" and reject_method == "none":
+        return "sum"
+    return None
+
+
+def state_key(kind, nlow, nhigh, scale, statsec, blank, bias, margin):
+    """Hash of everything besides the frame list that the state depends on."""
+    h = hashlib.sha1(json.dumps([STATE_VERSION, kind, nlow, nhigh, scale, statsec, blank, margin]).encode())
+    if bias is not None:
+        h.update(np.ascontiguousarray(bias).tobytes())
+    return h.hexdigest()
+
+
+def median_ranks(n, reject_method, nlow, nhigh):
+    """Ranks of the two middle kept values of ``n`` sorted values, as combine_stack uses them."""
+    rejecting = (reject_method or "none").lower() == "minmax" and n > nlow + nhigh
+    lo, hi = (nlow, n - nhigh) if rejecting else (0, n)
+    m = hi - lo
+    return lo + (m - 1) // 2, lo + m // 2
+
+
+def window_median(window, start, k1, k2):
+    """Median from the rank window, computed as combine_stack computes it."""
+    low = np.take_along_axis(window, (k1 - start)[None], axis=0)[0].astype(np.float64)
+    if k1 == k2:
+        return low
+    return (low + np.take_along_axis(window, (k2 - start)[None], axis=0)[0]) / 2
+
+
+def trim_window(window, start, count, k1, k2, margin):
+    """Keep ranks k1 - margin .. k2 + margin of the window, NaN-padded to 2 * margin + 2 rows.
+
+    Raises StaleState where a median rank has left the window.
+    """
+    if ((start > k1) | (start + count <= k2)).any():
+        raise StaleState("median moved outside the stored window")
+    first = np.maximum(start, k1 - margin)
+    last = np.minimum(start + count - 1, k2 + margin)
+    capacity = 2 * margin + 2
+    index = (first - start)[None] + np.arange(capacity).reshape(-1, 1, 1)
+    trimmed = np.take_along_axis(window, np.minimum(index, window.shape[0] - 1), axis=0)
+    trimmed[np.arange(capacity).reshape(-1, 1, 1) > (last - first)[None]] = np.nan
+    return trimmed, first, last - first + 1
+
+
+def build_window(tile, k1, k2, margin):
+    """Rank window of a full (N, rows, cols) band."""
+    n = tile.shape[0]
+    first = max(0, k1 - margin)
+    last = min(n - 1, k2 + margin)
+    part = np.partition(tile, (first, last), axis=0)
+    window = np.full((2 * margin + 2,) + tile.shape[1:], np.nan, dtype=tile.dtype)
+    window[:last - first + 1] = np.sort(part[first:last + 1], axis=0)
+    start = np.full(tile.shape[1:], first, dtype=np.int64)
+    count = np.full(tile.shape[1:], last - first + 1, dtype=np.int64)
+    return window, start, count
+
+
+def add_values(window, start, count, values):
+    """Insert the (k, rows, cols) ``values`` into the window."""
+    lowest = window[0]
+    highest = np.take_along_axis(window, (count - 1)[None], axis=0)[0]
+    below = values < lowest
+    inside = ~below & (values <= highest)
+    merged = np.concatenate([window, np.where(inside, values, np.nan)])
+    return np.sort(merged, axis=0), start + below.sum(axis=0), count + inside.sum(axis=0)
+
+
+def remove_values(window, start, count, values):
+    """Delete one occurrence of each of the (k, rows, cols) ``values``."""
+    window = window.copy()
+    for v in values:
+        lowest = window[0]
+        highest = np.take_along_axis(window, (count - 1)[None], axis=0)[0]
+        below = v < lowest
+        inside = ~below & (v <= highest)
+        match = window == v
+        if not match.any(axis=0)[inside].all():
+            raise StaleState("a removed value is not in the stored window")
+        first_match = np.argmax(match, axis=0)[None]
+        kept = np.take_along_axis(window, first_match, axis=0)
+        np.put_along_axis(window, first_match, np.where(inside[None], np.nan, kept), axis=0)
+        window = np.sort(window, axis=0)
+        start = start - below
+        count = count - inside
+    return window, start, count
+
+
+class CombineState:
+    """Files of a stored combine state in ``directory``."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def load_meta(self):
+        try:
+            with open(self.path("state.json")) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def arrays(self, kind):
+        names = ("window", "start", "count") if kind == "median" else ("sum",)
+        return {name: np.load(self.path(f"{name}.npy"), mmap_mode="r") for name in names}
+
+    def create(self, kind, shape, dtype, margin):
+        """New arrays to fill band by band, written beside the current ones."""
+        os.makedirs(self.directory, exist_ok=True)
+        self.clear_meta()
+        specs = {"sum": ((shape), np.float64)} if kind == "sum" else {
+            "window": ((2 * margin + 2,) + shape, dtype),
+            "start": (shape, np.int64),
+            "count": (shape, np.int64),
+        }
+        return {name: np.lib.format.open_memmap(self.path(f"{name}.npy.tmp"), "w+", dtype, shape)
+                for name, (shape, dtype) in specs.items()}
+
+    def commit(self, arrays, meta):
+        for name, array in arrays.items():
+            array.flush()
+            os.replace(self.path(f"{name}.npy.tmp"), self.path(f"{name}.npy"))
+        tmp = self.path("state.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp, self.path("state.json"))
+
+    def clear_meta(self):
+        """Invalidate the state before its arrays are replaced."""
+        try:
+            os.remove(self.path("state.json"))
+        except FileNotFoundError:
+            pass
+
+    def remove(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def _rows_per_band(n_values, width, itemsize, memory_limit):
+    # Window or new frames, their sorted copy and comparison masks
+    return max(1, int(memory_limit // (n_values * width * (2 * itemsize + 3) + width * 48)))
+
+
+class NonFinite(Exception):
+    """A band holds NaN or inf, which the state cannot represent."""
+
+
+def _state_task(band, kind, k1, k2, margin):
+    """Master rows and state arrays of one (N, rows, cols) band."""
+    if not np.isfinite(band).all():
+        raise NonFinite()
+    if kind == "sum":
+        total = np.zeros(band.shape[1:], dtype=np.float64)
+        for frame in band:
+            total += frame
+        return {"sum": total, "master": total / len(band)}
+    window, start, count = build_window(band, k1, k2, margin)
+    return {"window": window, "start": start, "count": count,
+            "master": window_median(window, start, k1, k2)}
+
+
+def _rebuild_serial(frames, arrays, kind, k1, k2, margin, memory_limit, progress, cancel):
+    """The band loop of :func:`_rebuild` in this process; returns the master."""
+    height, width = frames.shape
+    master = np.empty(frames.shape, dtype=np.float64)
+    band = _rows_per_band(len(frames), width, frames.dtype.itemsize, memory_limit)
+    n_bands = -(-height // band)
+    for b, y0 in enumerate(range(0, height, band)):
+        report(progress, cancel, "Combining", b, n_bands)
+        y1 = min(y0 + band, height)
+        tile = frames.band(y0, y1)
+        with span("Build state band", rows=y1 - y0, kind=kind):
+            for name, value in _state_task(tile, kind, k1, k2, margin).items():
+                target = master if name == "master" else arrays[name]
+                target[..., y0:y1, :] = value
+        del tile
+    report(progress, cancel, "Combining", n_bands, n_bands)
+    return master
+
+
+def _rebuild_parallel(frames, state, arrays, kind, k1, k2, margin, memory_limit, workers,
+                      progress, cancel):
+    """The band loop of :func:`_rebuild` in ``workers`` processes; returns the master."""
+    from astroreduct.parallel import map_bands
+
+    outputs = {name: state.path(f"{name}.npy.tmp") for name in arrays}
+    outputs["master"] = state.path("master.npy.tmp")
+    for array in arrays.values():
+        array.flush()
+    np.lib.format.open_memmap(outputs["master"], "w+", np.float64, frames.shape).flush()
+    try:
+        rows = _rows_per_band(len(frames), frames.shape[1], frames.dtype.itemsize, memory_limit // workers)
+        map_bands(frames, partial(_state_task, kind=kind, k1=k1, k2=k2, margin=margin), outputs,
+                  workers, rows, progress, cancel)
+        return np.load(outputs["master"])
+    finally:
+        os.remove(outputs["master"])
+
+
+def _rebuild(paths, state, kind, key, margin, combine_method, reject_method, nlow, nhigh,
+             scale, statsec, blank, memory_limit, bias, progress, cancel, workers=1, **clip_options):
+    """Full combine that also writes a fresh state; returns the master."""
+    state.clear_meta()
+    if kind is None:
+        return combine_files(paths, combine_method, reject_method, nlow, nhigh, scale, statsec,
+                             blank, memory_limit, bias, progress, cancel, workers, **clip_options)
+
+    with FrameStack(paths, scale, statsec, bias, progress, cancel) as frames:
+        arrays = state.create(kind, frames.shape, frames.dtype, margin)
+        k1, k2 = median_ranks(len(frames), reject_method, nlow, nhigh)
+        try:
+            if in_parallel(frames, workers):
+                master = _rebuild_parallel(frames, state, arrays, kind, k1, k2, margin, memory_limit,
+                                           workers, progress, cancel)
+            else:
+                master = _rebuild_serial(frames, arrays, kind, k1, k2, margin, memory_limit,
+                                         progress, cancel)
+        except NonFinite:
+            # NaN/inf take the exact path in combine_stack; keep no state
+            state.remove()
+            return combine_files(paths, combine_method, reject_method, nlow, nhigh, scale,
+                                 statsec, blank, memory_limit, bias, progress, cancel, workers)
+        meta = {"version": STATE_VERSION, "key": key, "kind": kind, "margin": margin,
+                "shape": list(frames.shape), "dtype": frames.dtype.str,
+                "frames": [file_identity(p) for p in paths]}
+    state.commit(arrays, meta)
+    return master
+
+
+def _update(state, meta, added, removed, n, combine_method, reject_method, nlow, nhigh, scale,
+            statsec, memory_limit, bias, progress, cancel):
+    """Apply added and removed frames to the stored state; returns the master."""
+    kind, margin = meta["kind"], meta["margin"]
+    shape, dtype = tuple(meta["shape"]), np.dtype(meta["dtype"])
+    old = state.arrays(kind)
+    with FrameStack(added, scale, statsec, bias, progress, cancel) if added else _no_frames() as new, \
+            FrameStack(removed, scale, statsec, bias, progress, cancel) if removed else _no_frames() as gone:
+        for frames in (new, gone):
+            if frames is not None and (frames.shape != shape or frames.dtype != dtype):
+                raise StaleState("frames differ in shape or type from the stored state")
+
+        master = np.empty(shape, dtype=np.float64)
+        arrays = state.create(kind, shape, dtype, margin)
+        k1, k2 = median_ranks(n, reject_method, nlow, nhigh)
+        changes = len(added) + len(removed)
+        band = _rows_per_band(2 * margin + 2 + changes, shape[1], dtype.itemsize, memory_limit)
+        n_bands = -(-shape[0] // band)
+        for b, y0 in enumerate(range(0, shape[0], band)):
+            report(progress, cancel, "Combining", b, n_bands)
+            y1 = min(y0 + band, shape[0])
+            plus = new.band(y0, y1) if new is not None else None
+            minus = gone.band(y0, y1) if gone is not None else None
+            for values in (plus, minus):
+                if values is not None and not np.isfinite(values).all():
+                    raise StaleState("frames contain NaN or inf")
+
+            with span("Update state band", rows=y1 - y0, kind=kind):
+                if kind == "sum":
+                    total = np.array(old["sum"][y0:y1])
+                    for frame in (plus if plus is not None else ()):
+                        total += frame
+                    for frame in (minus if minus is not None else ()):
+                        total -= frame
+                    arrays["sum"][y0:y1] = total
+                    master[y0:y1] = total / n
+                else:
+                    window = np.array(old["window"][:, y0:y1])
+                    start = np.array(old["start"][y0:y1])
+                    count = np.array(old["count"][y0:y1])
+                    if minus is not None:
+                        window, start, count = remove_values(window, start, count, minus)
+                    if plus is not None:
+                        window, start, count = add_values(window, start, count, plus)
+                    window, start, count = trim_window(window, start, count, k1, k2, margin)
+                    arrays["window"][:, y0:y1] = window
+                    arrays["start"][y0:y1] = start
+                    arrays["count"][y0:y1] = count
+                    master[y0:y1] = window_median(window, start, k1, k2)
+        report(progress, cancel, "Combining", n_bands, n_bands)
+    del old
+    return master, arrays
+
+
+def _unchanged(path, stamp):
+    try:
+        return tuple(file_identity(path)[1:]) == tuple(stamp)
+    except OSError:
+        return False
+
+
+class _no_frames:
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc):
+        pass
+
+
+def update_master(paths, state_dir, combine_method="median", reject_method="minmax",
+                  nlow=0, nhigh=1, scale="none", statsec=None, blank=0.0,
+                  memory_limit=DEFAULT_MEMORY_LIMIT, bias=None, margin=DEFAULT_MARGIN,
+                  verify=False, progress=None, cancel=None, workers=1, **clip_options):
+    """Combine ``paths`` like :func:`combine_files`, reusing the state in ``state_dir``.
+
+    If the state was built with the same parameters from frames that
+    differ from ``paths`` by a few additions and removals, only those
+    frames are read; otherwise everything is combined and the state is
+    rebuilt, in ``workers`` processes as in :func:`combine_files`. With
+    ``verify`` the result is also compared against a full combine,
+    raising ValueError on a mismatch.
+    """
+    scale = (scale or "none").lower()
+    statsec = list(map(int, statsec)) if statsec else None
+    kind = state_kind(combine_method, reject_method)
+    key = state_key(kind, nlow, nhigh, scale, statsec, blank, bias, margin)
+    state = CombineState(state_dir)
+    meta = state.load_meta()
+    options = dict(combine_method=combine_method, reject_method=reject_method, nlow=nlow,
+                   nhigh=nhigh, scale=scale, statsec=statsec, memory_limit=memory_limit,
+                   bias=bias, progress=progress, cancel=cancel)
+
+    master = None
+    if kind is not None and meta is not None and meta.get("key") == key:
+        stored = {path: (size, mtime) for path, size, mtime in meta["frames"]}
+        current = {path: (size, mtime) for path, size, mtime in map(file_identity, paths)}
+        added = [p for p in current if stored.get(p) != current[p]]
+        removed = [p for p in stored if current.get(p) != stored[p]]
+        # Removed frames are read back to take them out; a changed or deleted file can't be
+        unreadable = [p for p in removed if p in current or not _unchanged(p, stored[p])]
+        if not unreadable and len(added) + len(removed) <= min(margin, len(paths) - 1):
+            try:
+                master, arrays = _update(state, meta, added, removed, len(paths), **options)
+            except StaleState:
+                master = None
+            else:
+                meta["frames"] = [file_identity(p) for p in paths]
+                state.commit(arrays, meta)
+
+    if master is None:
+        master = _rebuild(paths, state, kind, key, margin, blank=blank, workers=workers, **options,
+                          **clip_options)
+
+    if verify:
+        full = combine_files(paths, blank=blank, workers=workers, **dict(options, progress=None),
+                             **clip_options)
+        same = (np.array_equal(master, full) if kind != "sum"
+                else np.allclose(master, full, rtol=1e-12, atol=0))
+        if not same:
+            state.remove()
+            raise ValueError("Incremental master differs from a full combine; the state was discarded.")
+    return master
@@ -0,0 +1,18 @@
+"""Progress reporting and cancellation shared by every long-running step.
+
+A step takes ``progress(stage, done, total)`` and a ``cancel`` event (a
+``threading.Event``) and calls :func:`report` as it goes, which raises
+:class:`CombineCancelled` once the event is set.
+"""
+
+
+class CombineCancelled(Exception):
+    """Raised when a step is stopped through its ``cancel`` event."""
+
+
+def report(progress, cancel, stage, done, total):
+    """Pass progress on to the caller and stop if cancellation was requested."""
+    if cancel is not None and cancel.is_set():
+        raise CombineCancelled(stage)
+    if progress is not None:
+        progress(stage, done, total)
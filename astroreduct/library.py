@@ -0,0 +1,163 @@
+"""Library of finished master frames, reused across nights.
+
+Masters are copied into one directory and indexed in SQLite by the
+instrument settings in their headers (instrument, frame size, binning,
+gain, offset, readout mode, filter, exposure time and sensor temperature).
+A new night whose calibration frames are missing can then ask for the
+nearest master: settings that change the pixel values must match exactly,
+darks must also be within a temperature tolerance and are ranked by how
+close their temperature and exposure are, and newer masters win ties.
+"""
+import os
+import shutil
+import sqlite3
+import time
+
+from astroreduct.frames import frame_info, read_header_values
+from astroreduct.jobs import report
+
+MASTER_KINDS = ("bias", "dark", "flat")
+DEFAULT_TEMP_TOLERANCE = 2.0  # Degrees C a dark's CCD-TEMP may differ from the frames'
+
+# Database column and type for each header keyword that is kept
+COLUMNS = {
+    "INSTRUME": ("instrument", "TEXT"),
+    "TELESCOP": ("telescope", "TEXT"),
+    "NAXIS1": ("naxis1", "INTEGER"),
+    "NAXIS2": ("naxis2", "INTEGER"),
+    "XBINNING": ("xbinning", "INTEGER"),
+    "YBINNING": ("ybinning", "INTEGER"),
+    "GAIN": ("gain", "REAL"),
+    "OFFSET": ("offset", "REAL"),
+    "READOUTM": ("readout", "TEXT"),
+    "FILTER": ("filter", "TEXT"),
+    "EXPTIME": ("exptime", "REAL"),
+    "CCD-TEMP": ("ccd_temp", "REAL"),
+    "DATE-OBS": ("date_obs", "TEXT"),
+    "ARKEY": ("result_key", "TEXT"),
+}
+
+# Columns that must be equal for a master to apply; flats also need the same filter
+MATCH_COLUMNS = ("instrument", "naxis1", "naxis2", "xbinning", "ybinning", "gain", "offset", "readout")
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS masters (
+    path TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    added REAL NOT NULL,
+    {", ".join(f"{column} {kind}" for column, kind in COLUMNS.values())}
+);
+CREATE INDEX IF NOT EXISTS masters_match ON masters (kind, instrument, naxis1, naxis2);
+"""
+
+
+def default_library_dir():
+    base = os.environ.get("XDG_DATA_HOME") or os.path.join(os.path.expanduser("~"), ".local", "share")
+    return os.path.join(base, "astroreduct", "masters")
+
+
+def frame_settings(path):
+    """Library columns for one frame or master, read from its header only."""
+    values = read_header_values(path, tuple(COLUMNS))
+    if "NAXIS1" not in values:  # Tile-compressed: the size is in the image extension
+        shape = frame_info(path).shape
+        if len(shape) >= 2:
+            values["NAXIS2"], values["NAXIS1"] = shape[-2:]
+    return {column: values.get(key) for key, (column, _) in COLUMNS.items()}
+
+
+class MasterLibrary:
+    """Directory of master frames with an SQLite index of their settings."""
+
+    def __init__(self, directory=None):
+        self.directory = directory or default_library_dir()
+        os.makedirs(self.directory, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(self.directory, "library.sqlite"), check_same_thread=False)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, path, kind, progress=None, cancel=None):
+        """Copy the master at ``path`` into the library; returns the stored path.
+
+        A master with the same result key replaces the one already stored.
+        """
+        if kind not in MASTER_KINDS:
+            raise ValueError(f"Unknown master kind: {kind}")
+        report(progress, cancel, "Adding to library", 0, 1)
+        settings = frame_settings(path)
+        if settings["naxis1"] is None or settings["naxis2"] is None:
+            raise ValueError(f"{path} does not contain an image.")
+        if settings["result_key"]:
+            name = f"{kind}-{settings['result_key'][:16]}.fits"
+        else:
+            name = f"{kind}-{time.strftime('%Y%m%d-%H%M%S')}-{os.path.basename(path)}"
+        stored = os.path.join(self.directory, name)
+        # A copy, not a link: the original may later be overwritten in place
+        tmp = f"{stored}.{os.getpid()}.tmp"
+        shutil.copyfile(path, tmp)
+        os.replace(tmp, stored)
+        row = (stored, kind, time.time()) + tuple(settings.values())
+        with self.db:
+            self.db.execute(f"INSERT OR REPLACE INTO masters VALUES ({', '.join('?' * len(row))})", row)
+        report(progress, cancel, "Adding to library", 1, 1)
+        return stored
+
+    def masters(self, kind=None):
+        """Rows as dicts, newest first; entries whose file has gone are dropped."""
+        query, params = "SELECT * FROM masters", ()
+        if kind is not None:
+            query, params = query + " WHERE kind = ?", (kind,)
+        cursor = self.db.execute(query + " ORDER BY added DESC", params)
+        names = [d[0] for d in cursor.description]
+        rows = [dict(zip(names, row)) for row in cursor]
+        gone = [(row["path"],) for row in rows if not os.path.exists(row["path"])]
+        if gone:
+            with self.db:
+                self.db.executemany("DELETE FROM masters WHERE path = ?", gone)
+        return [row for row in rows if os.path.exists(row["path"])]
+
+    def find(self, kind, settings, temp_tolerance=DEFAULT_TEMP_TOLERANCE):
+        """Path of the master of ``kind`` nearest to ``settings``, or None.
+
+        ``settings`` is a dict of library columns, as from
+        :func:`frame_settings` on one of the frames to calibrate.
+        """
+        match = MATCH_COLUMNS + (("filter",) if kind == "flat" else ())
+        clauses = ["kind = ?"] + [f"{column} IS ?" for column in match]
+        params = [kind] + [settings.get(column) for column in match]
+        cursor = self.db.execute(f"SELECT * FROM masters WHERE {' AND '.join(clauses)}", params)
+        names = [d[0] for d in cursor.description]
+        candidates = [dict(zip(names, row)) for row in cursor]
+        candidates = [row for row in candidates if os.path.exists(row["path"])]
+
+        temp, exptime = settings.get("ccd_temp"), settings.get("exptime")
+        if kind == "dark" and temp is not None:
+            candidates = [row for row in candidates
+                          if row["ccd_temp"] is None or abs(row["ccd_temp"] - temp) <= temp_tolerance]
+
+        def distance(row):
+            dt = abs(row["ccd_temp"] - temp) if temp is not None and row["ccd_temp"] is not None else 0.0
+            de = abs(row["exptime"] - exptime) if exptime is not None and row["exptime"] is not None else 0.0
+            return (dt, de, -row["added"]) if kind == "dark" else (-row["added"],)
+
+        return min(candidates, key=distance)["path"] if candidates else None
+
+
+def find_master(kind, frame_path, directory=None, temp_tolerance=DEFAULT_TEMP_TOLERANCE):
+    """Nearest library master of ``kind`` for the frame at ``frame_path``, or None."""
+    with MasterLibrary(directory) as library:
+        return library.find(kind, frame_settings(frame_path), temp_tolerance)
+
+
+def add_master(path, kind, directory=None, progress=None, cancel=None):
+    """Store one master in the library; usable as a background job."""
+    with MasterLibrary(directory) as library:
+        return library.add(path, kind, progress=progress, cancel=cancel)
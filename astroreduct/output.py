@@ -0,0 +1,142 @@
+"""Writing products: output BITPIX, tile compression and background writes.
+
+Masters are computed in float64 and can be stored as float64, float32
+(half the size, ample for 16-bit data) or int16 with BZERO/BSCALE. Either
+can be tile-compressed into a CompImageHDU in the first extension, with
+the primary header keeping every keyword so header-only readers still find
+them. Files are renamed into place once complete. A write can be handed to
+a single background thread; the readers in this package wait for a pending
+write of the file they are about to open.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import numpy as np
+from astropy.io import fits
+
+from astroreduct.profiling import add_bytes, span
+
+BITPIX_CHOICES = ("float64", "float32", "int16")
+DEFAULT_BITPIX = "float64"
+# Tile compression by name; Rice quantises floating-point pixels (to 1/16 of the noise), GZIP does not
+COMPRESSION_TYPES = {"rice": "RICE_1", "gzip": "GZIP_2"}
+RICE_QUANTIZE_LEVEL = 16
+
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="astroreduct-writer")
+_pending = {}  # Absolute path -> Future of its write
+_lock = threading.Lock()
+
+
+def output_options(bitpix=DEFAULT_BITPIX, compression=None):
+    """Non-default output settings, for result keys; empty for the defaults."""
+    if bitpix not in BITPIX_CHOICES:
+        raise ValueError(f"Unknown output BITPIX: {bitpix}")
+    if compression is not None and compression not in COMPRESSION_TYPES:
+        raise ValueError(f"Unknown compression: {compression}")
+    options = {}
+    if bitpix != DEFAULT_BITPIX:
+        options["bitpix"] = bitpix
+    if compression is not None:
+        options["compression"] = compression
+    return options
+
+
+def to_int16(data):
+    """(int16 pixels, BZERO, BSCALE) for ``data``.
+
+    Whole numbers within 0..65535 are stored exactly with BZERO = 32768;
+    anything else is scaled so its range fills the int16 range.
+    """
+    data = np.asarray(data)
+    low, high = float(np.min(data)), float(np.max(data))
+    if low >= 0 and high <= 65535 and np.array_equal(data, np.rint(data)):
+        bzero, bscale = 32768.0, 1.0
+    else:
+        bzero, bscale = (high + low) / 2, (high - low) / 65534 or 1.0
+    stored = np.rint((data - bzero) / bscale).astype(np.int16)
+    return stored, bzero, bscale
+
+
+def image_hdus(data, header=None, bitpix=DEFAULT_BITPIX, compression=None):
+    """HDUList holding ``data`` as ``bitpix``, tile-compressed if ``compression`` is given."""
+    output_options(bitpix, compression)
+    header = fits.Header() if header is None else header.copy()
+    scaling = None
+    if bitpix == "float32":
+        data = np.asarray(data, dtype=np.float32)
+    elif bitpix == "int16":
+        data, bzero, bscale = to_int16(data)
+        scaling = {"BZERO": bzero, "BSCALE": bscale}
+
+    if compression is None:
+        hdus = [fits.PrimaryHDU(data, header)]
+    else:
+        quantize = RICE_QUANTIZE_LEVEL if compression == "rice" else 0
+        hdus = [fits.PrimaryHDU(header=header),
+                fits.CompImageHDU(data, header, compression_type=COMPRESSION_TYPES[compression],
+                                  quantize_level=quantize)]
+    if scaling is not None:
+        # Set after the data, so astropy keeps the int16 pixels as they are
+        hdus[-1].header.update(scaling)
+    return fits.HDUList(hdus)
+
+
+def write_image(path, data, header=None, overwrite=True, bitpix=DEFAULT_BITPIX, compression=None):
+    """Write ``data`` to ``path`` in the given format, timed as a "Write master" span.
+
+    The file is written under a temporary name in the same folder and then
+    renamed into place, so no other process (or a later run, after a
+    crash) ever sees it half written.
+    """
+    if not overwrite and os.path.exists(path):
+        raise OSError(f"File {path} already exists.")
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with span("Write master", file=os.path.basename(path), bitpix=bitpix, compression=compression):
+        try:
+            image_hdus(data, header, bitpix, compression).writeto(tmp, overwrite=True)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        add_bytes(written=os.path.getsize(path))
+
+
+def in_background(path, fn, *args, **kwargs):
+    """Run ``fn(*args, **kwargs)``, which writes ``path``, on the writer thread; returns its Future.
+
+    Writes run one at a time, in the order they were queued. The caller
+    must not change any array handed over until the write is done.
+    """
+    path = os.path.abspath(path)
+    with _lock:
+        future = _writer.submit(fn, *args, **kwargs)
+        _pending[path] = future
+    future.add_done_callback(partial(_forget, path))
+    return future
+
+
+def _forget(path, future):
+    # Failed writes stay registered, so the next reader of the file sees the error
+    if future.exception() is None:
+        with _lock:
+            if _pending.get(path) is future:
+                del _pending[path]
+
+
+def wait_for_write(path):
+    """Block until a background write of ``path`` is done, re-raising its error."""
+    path = os.path.abspath(path)
+    with _lock:
+        future = _pending.get(path)
+    if future is None:
+        return
+    try:
+        future.result()
+    except Exception:
+        with _lock:
+            if _pending.get(path) is future:
+                del _pending[path]  # Reported once
+        raise
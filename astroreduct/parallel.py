@@ -0,0 +1,114 @@
+"""Row bands of a combine spread over worker processes.
+
+NumPy's sort, partition and median run on one core, so large stacks are
+split into row bands that separate processes combine at the same time.
+No pixels are pickled: each worker opens the input frames itself (read
+through memory maps and ``ImageHDU.section`` like any FrameStack), maps a
+master bias saved once as .npy, and writes its rows straight into
+memory-mapped .npy outputs that the parent reads back. Scale factors are
+computed once in the parent and handed to the workers.
+
+Workers are started with "spawn", so this is safe from the GUI, whose
+process runs Qt threads. Profiling spans inside the workers are not
+recorded; the parent records one "Parallel bands" span.
+"""
+import multiprocessing
+import os
+import shutil
+import tempfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from functools import partial
+
+import numpy as np
+
+from astroreduct.combine import combine_stack, rows_per_band
+from astroreduct.jobs import report
+from astroreduct.profiling import span
+
+BANDS_PER_WORKER = 4  # At least this many bands per process, so none sits idle at the end
+
+# Per-process state set up by _init_worker
+_frames = None
+_outputs = None
+_task = None
+
+
+def _init_worker(spec):
+    global _frames, _outputs, _task
+    bias = np.load(spec["bias"], mmap_mode="r") if spec["bias"] else None
+    _frames = spec["stack"](spec["paths"], spec["scale"], spec["statsec"], bias, factors=spec["factors"],
+                            **spec["stack_options"])
+    _outputs = {name: np.load(path, mmap_mode="r+") for name, path in spec["outputs"].items()}
+    _task = spec["task"]
+
+
+def _run_band(y0, y1):
+    """Apply the task to rows ``y0:y1`` and store its results; runs in a worker."""
+    for name, value in _task(_frames.band(y0, y1)).items():
+        _outputs[name][..., y0:y1, :] = value
+    return y0, y1
+
+
+def band_rows(height, rows, workers):
+    """(y0, y1) ranges of at most ``rows`` rows, enough of them to keep ``workers`` busy."""
+    rows = max(1, min(rows, -(-height // (workers * BANDS_PER_WORKER))))
+    return [(y0, min(y0 + rows, height)) for y0 in range(0, height, rows)]
+
+
+def map_bands(frames, task, outputs, workers, rows, progress=None, cancel=None, stage="Combining"):
+    """Run ``task(band)`` over every row band of ``frames`` in ``workers`` processes.
+
+    ``task`` is a picklable function of a (N, rows, cols) band that returns
+    {name: rows of that output}; ``outputs`` maps each name to an .npy file
+    (rows on the second-last axis) that the workers write into. ``frames``
+    is an open FrameStack (or subclass) in this process, used only for its
+    parameters. Cancelling stops queued bands; bands already running finish
+    first.
+    """
+    tmp = tempfile.mkdtemp(prefix="astroreduct-")
+    try:
+        bias_file = None
+        if frames.bias is not None:
+            bias_file = os.path.join(tmp, "bias.npy")
+            np.save(bias_file, np.asarray(frames.bias))
+        spec = {"stack": type(frames), "stack_options": frames.worker_options(), "paths": frames.paths,
+                "scale": frames.scale, "statsec": frames.statsec, "bias": bias_file,
+                "factors": frames.factors, "outputs": outputs, "task": task}
+        bands = band_rows(frames.shape[0], rows, workers)
+        report(progress, cancel, stage, 0, len(bands))
+        with span("Parallel bands", workers=workers, bands=len(bands)), \
+                ProcessPoolExecutor(max_workers=min(workers, len(bands)),
+                                    mp_context=multiprocessing.get_context("spawn"),
+                                    initializer=_init_worker, initargs=(spec,)) as pool:
+            pending = {pool.submit(_run_band, y0, y1) for y0, y1 in bands}
+            try:
+                while pending:
+                    finished, pending = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        future.result()  # Re-raises a worker's exception here
+                    report(progress, cancel, stage, len(bands) - len(pending), len(bands))
+            except BaseException:
+                for future in pending:
+                    future.cancel()
+                raise
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def _combine_task(band, **options):
+    return {"master": combine_stack(band, **options)}
+
+
+def combine_bands(frames, workers, memory_limit, progress=None, cancel=None, **options):
+    """:func:`combine_files` for an open FrameStack, in parallel; returns the float64 master."""
+    tmp = tempfile.mkdtemp(prefix="astroreduct-")
+    try:
+        master_file = os.path.join(tmp, "master.npy")
+        np.lib.format.open_memmap(master_file, "w+", np.float64, frames.shape).flush()
+        rows = rows_per_band(len(frames), frames.shape[1], frames.dtype.itemsize,
+                             memory_limit // workers, options.get("reject_method"))
+        map_bands(frames, partial(_combine_task, **options), {"master": master_file}, workers, rows,
+                  progress, cancel)
+        return np.load(master_file)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
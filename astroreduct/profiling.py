@@ -0,0 +1,186 @@
+"""Named timing spans for finding where a reduction spends its time.
+
+    with span("Combine band", rows=y1 - y0):
+        ...
+        add_bytes(read=block.nbytes)
+
+Nothing is recorded until enable() is called (or ASTROREDUCT_PROFILE=1 is
+set); while disabled, span() hands back one shared no-op context, so
+instrumented code costs a flag check. A recorded span has its wall time and
+thread, the bytes read and written inside it (as reported through
+add_bytes, nested spans included) and the process's peak resident memory
+when it ended. Records can be summarised per name or saved as a Chrome
+trace (chrome://tracing or https://ui.perfetto.dev).
+
+Only the calling process is recorded: work sent to a process pool, such
+as thumbnail rendering, shows up as the span that waits for it.
+"""
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+MAX_RECORDS = 200000  # Oldest records are dropped beyond this
+
+_enabled = False
+_lock = threading.Lock()
+_records = []
+_local = threading.local()
+_origin = time.perf_counter()
+
+
+def peak_rss():
+    """Peak resident memory of this process in bytes, or None where unknown."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # kB elsewhere
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def clear():
+    with _lock:
+        _records.clear()
+
+
+def records():
+    """Copy of the recorded spans, oldest first."""
+    with _lock:
+        return list(_records)
+
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+class Span:
+    """One timed region; use through :func:`span`."""
+
+    __slots__ = ("name", "args", "start", "bytes_read", "bytes_written")
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def __enter__(self):
+        stack = getattr(_local, "stack", None)
+        if stack is None:
+            stack = _local.stack = []
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        _local.stack.remove(self)
+        record = {
+            "name": self.name,
+            "start": self.start - _origin,
+            "duration": end - self.start,
+            "thread": threading.current_thread().name,
+            "tid": threading.get_ident(),
+            "bytes_read": self.bytes_read,
+            "bytes_written": self.bytes_written,
+            "peak_rss": peak_rss(),
+            "args": self.args,
+        }
+        if exc_type is not None:
+            record["error"] = exc_type.__name__
+        with _lock:
+            _records.append(record)
+            if len(_records) > MAX_RECORDS:
+                del _records[:len(_records) - MAX_RECORDS]
+        return False
+
+
+def span(name, **args):
+    """Context manager timing ``name``; ``args`` are kept with the record."""
+    if not _enabled:
+        return _NO_SPAN
+    return Span(name, args)
+
+
+def add_bytes(read=0, written=0):
+    """Count I/O against every span open in this thread."""
+    if not _enabled:
+        return
+    for s in getattr(_local, "stack", ()):
+        s.bytes_read += read
+        s.bytes_written += written
+
+
+def summary(recorded=None):
+    """Per-name totals, slowest first: count, total/mean/max seconds, bytes and peak memory."""
+    rows = {}
+    for r in records() if recorded is None else recorded:
+        row = rows.get(r["name"])
+        if row is None:
+            row = rows[r["name"]] = {"name": r["name"], "count": 0, "total": 0.0, "max": 0.0,
+                                     "bytes_read": 0, "bytes_written": 0, "peak_rss": None}
+        row["count"] += 1
+        row["total"] += r["duration"]
+        row["max"] = max(row["max"], r["duration"])
+        row["bytes_read"] += r["bytes_read"]
+        row["bytes_written"] += r["bytes_written"]
+        if r["peak_rss"] is not None:
+            row["peak_rss"] = max(row["peak_rss"] or 0, r["peak_rss"])
+    for row in rows.values():
+        row["mean"] = row["total"] / row["count"]
+    return sorted(rows.values(), key=lambda row: row["total"], reverse=True)
+
+
+def chrome_trace(recorded=None):
+    """Recorded spans in the Chrome trace event format."""
+    recorded = records() if recorded is None else recorded
+    pid = os.getpid()
+    events = []
+    threads = {}
+    for r in recorded:
+        threads.setdefault(r["tid"], r["thread"])
+        args = {k: v if isinstance(v, (int, float, str, bool)) or v is None else str(v)
+                for k, v in r["args"].items()}
+        args.update(bytes_read=r["bytes_read"], bytes_written=r["bytes_written"], peak_rss=r["peak_rss"])
+        if "error" in r:
+            args["error"] = r["error"]
+        events.append({"name": r["name"], "ph": "X", "pid": pid, "tid": r["tid"],
+                       "ts": r["start"] * 1e6, "dur": r["duration"] * 1e6, "args": args})
+    for tid, name in threads.items():
+        events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}})
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def write_chrome_trace(path, recorded=None):
+    with open(path, "w") as f:
+        json.dump(chrome_trace(recorded), f)
+
+
+if os.environ.get("ASTROREDUCT_PROFILE", "") not in ("", "0"):
+    enable()
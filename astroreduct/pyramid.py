@@ -0,0 +1,65 @@
+"""Multi-resolution tile pyramid for displaying large frames."""
+import numpy as np
+
+from astroreduct.normalize import to_uint8
+from astroreduct.profiling import span
+from astroreduct.thumbnails import block_mean
+
+TILE_SIZE = 256
+
+
+class ImagePyramid:
+    """8-bit levels of a stretched image, each cut into square tiles.
+
+    Level 0 is the frame itself, stretched one tile at a time on request.
+    Level k halves level k-1 and is built once by build(), down to the
+    first level that fits in a single tile.
+    """
+
+    def __init__(self, data, vmin, vmax, tile_size=TILE_SIZE):
+        self.data = data
+        self.vmin = vmin
+        self.vmax = vmax
+        self.tile_size = tile_size
+        self.n_levels = 1
+        while max(data.shape) > tile_size * 2 ** (self.n_levels - 1):
+            self.n_levels += 1
+        self.levels = [None] * self.n_levels
+        self.ready = self.n_levels == 1
+
+    def build(self, cancel=None):
+        """Compute levels 1 and up; safe to run off the GUI thread."""
+        for level in range(1, self.n_levels):
+            if cancel is not None and cancel.is_set():
+                return
+            with span("Pyramid level", level=level):
+                if level == 1:
+                    self.levels[1] = to_uint8(block_mean(self.data, 2, self.vmin, self.vmax),
+                                              self.vmin, self.vmax)
+                else:
+                    self.levels[level] = np.rint(block_mean(self.levels[level - 1], 2)).astype(np.uint8)
+        self.ready = True
+
+    def scale(self, level):
+        """Frame pixels per pixel of ``level``."""
+        return 2 ** level
+
+    def level_for_zoom(self, zoom):
+        """Coarsest level that still has at least one level pixel per screen pixel."""
+        level = 0
+        while level + 1 < self.n_levels and zoom * self.scale(level + 1) <= 1:
+            level += 1
+        return level
+
+    def grid(self, level):
+        """Number of tile columns and rows at ``level``."""
+        h, w = self.data.shape if level == 0 else self.levels[level].shape
+        return -(-w // self.tile_size), -(-h // self.tile_size)
+
+    def tile(self, level, tx, ty):
+        """Contiguous uint8 tile at column ``tx``, row ``ty`` of ``level``."""
+        t = self.tile_size
+        with span("Render tile", level=level):
+            if level == 0:
+                return to_uint8(self.data[ty * t:(ty + 1) * t, tx * t:(tx + 1) * t], self.vmin, self.vmax)
+            return np.ascontiguousarray(self.levels[level][ty * t:(ty + 1) * t, tx * t:(tx + 1) * t])
@@ -0,0 +1,114 @@
+"""IRAF imcombine-style sigma and percentile clipping, vectorized over pixels.
+
+The stack is sorted once along the frame axis (NaNs sort last and are
+never kept). Clipping only ever removes the lowest or highest remaining
+values of a pixel, so what survives is always a contiguous run
+``sorted[lo:hi]`` and each iteration just moves the per-pixel ``lo``
+and ``hi`` bounds inwards.
+"""
+import numpy as np
+
+DEFAULT_LSIGMA = 3.0
+DEFAULT_HSIGMA = 3.0
+DEFAULT_PCLIP = -0.5
+DEFAULT_NKEEP = 1
+
+
+def _take(sorted_stack, index):
+    return np.take_along_axis(sorted_stack, index[None], axis=0)[0]
+
+
+def range_median(sorted_stack, lo, hi):
+    """Median of ``sorted_stack[lo:hi]`` per pixel (NaN where the range is empty)."""
+    m = hi - lo
+    last = sorted_stack.shape[0] - 1
+    a = _take(sorted_stack, np.clip(lo + (m - 1) // 2, 0, last))
+    b = _take(sorted_stack, np.clip(lo + m // 2, 0, last))
+    return np.where(m > 0, (a + b) / 2, np.nan)
+
+
+def range_mask(n, lo, hi):
+    index = np.arange(n).reshape((n,) + (1,) * lo.ndim)
+    return (index >= lo) & (index < hi)
+
+
+def range_mean(sorted_stack, lo, hi):
+    """Mean of ``sorted_stack[lo:hi]`` per pixel (NaN where the range is empty)."""
+    inside = range_mask(sorted_stack.shape[0], lo, hi)
+    total = np.where(inside, sorted_stack, 0.0).sum(axis=0)
+    m = hi - lo
+    return np.divide(total, m, out=np.full(total.shape, np.nan), where=m > 0)
+
+
+def _center(sorted_stack, lo, hi, mclip):
+    if mclip:
+        return range_median(sorted_stack, lo, hi)
+    # Mean without the lowest and highest value, as imcombine does when mclip=no
+    trim = (hi - lo) > 2
+    return np.where(trim, range_mean(sorted_stack, lo + trim, hi - trim), range_mean(sorted_stack, lo, hi))
+
+
+def clip_range(stack, reject_method, lsigma=DEFAULT_LSIGMA, hsigma=DEFAULT_HSIGMA,
+               pclip=DEFAULT_PCLIP, nkeep=DEFAULT_NKEEP, mclip=True, maxiters=None):
+    """Sort ``stack`` along axis 0 and clip it; returns (sorted, lo, hi).
+
+    ``sigclip``: sigma is the standard deviation of the kept values about
+    the centre (median, or the min/max-excluded mean with ``mclip=False``).
+    ``pclip``: sigma is the distance from the median to the value
+    ``pclip`` of the way (a fraction, or a pixel count if |pclip| >= 1)
+    from the median towards the lowest (negative) or highest value.
+
+    Values below centre - lsigma*sigma or above centre + hsigma*sigma are
+    rejected, iterating until nothing changes or ``maxiters`` passes.
+    At least ``nkeep`` values are kept (a negative ``nkeep`` is the most
+    that may be rejected); pixels with fewer than 3 values are not clipped.
+    """
+    sorted_stack = np.sort(stack.astype(np.float64, copy=False), axis=0)
+    n = sorted_stack.shape[0]
+    valid = n - np.isnan(sorted_stack).sum(axis=0)
+    lo = np.zeros(valid.shape, dtype=np.int64)
+    hi = valid.astype(np.int64)
+    min_keep = np.maximum(nkeep if nkeep >= 0 else valid + nkeep, 1)
+
+    for _ in range(maxiters or n):
+        m = hi - lo
+        active = m >= 3
+        if not active.any():
+            break
+        if reject_method == "sigclip":
+            center = _center(sorted_stack, lo, hi, mclip)
+            inside = range_mask(n, lo, hi)
+            dev = np.where(inside, sorted_stack - center, 0.0)
+            sigma = np.sqrt((dev * dev).sum(axis=0) / np.maximum(m - 1, 1))
+        elif reject_method == "pclip":
+            center = range_median(sorted_stack, lo, hi)
+            offset = pclip if abs(pclip) >= 1 else pclip * m / 2
+            rank = np.clip(lo + (m - 1) // 2 + np.rint(offset).astype(np.int64), lo, hi - 1)
+            sigma = np.abs(center - _take(sorted_stack, np.clip(rank, 0, n - 1)))
+        else:
+            raise ValueError(f"Unknown clipping method: {reject_method}")
+
+        inside = range_mask(n, lo, hi)
+        below = ((sorted_stack < center - lsigma * sigma) & inside).sum(axis=0)
+        above = ((sorted_stack > center + hsigma * sigma) & inside).sum(axis=0)
+        new_lo = lo + below
+        new_hi = hi - above
+        # Leave a pixel alone once clipping would take it under nkeep
+        accept = active & (new_hi - new_lo >= min_keep) & ((below > 0) | (above > 0))
+        if not accept.any():
+            break
+        lo = np.where(accept, new_lo, lo)
+        hi = np.where(accept, new_hi, hi)
+
+    return sorted_stack, lo, hi
+
+
+def clip_combine(stack, combine_method="median", reject_method="sigclip", blank=0.0, **clip_options):
+    """Clip a (N, rows, cols) stack and combine what is left into a float64 image."""
+    sorted_stack, lo, hi = clip_range(stack, reject_method, **clip_options)
+    if combine_method == "median":
+        result = range_median(sorted_stack, lo, hi)
+    else:
+        result = range_mean(sorted_stack, lo, hi)
+    result[hi - lo == 0] = blank
+    return result
@@ -0,0 +1,205 @@
+"""Content-addressed cache of reduction products.
+
+A product is keyed by a hash of what it was made from: the identity
+(path, size, mtime) of every input frame, the master bias it used and
+every parameter that changes the result. Running the same reduction again
+copies the stored master instead of combining. The key and parameters are
+also written into the product's header, so a master made from a cached
+master (a flat from a bias) is keyed by the bias's content rather than by
+its file's mtime.
+"""
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+from astropy.io import fits
+
+from astroreduct.frames import read_header_values
+
+RESULT_CACHE_VERSION = 1
+DEFAULT_RESULT_CACHE_BYTES = 2 * 1024 ** 3
+
+# Keyword arguments that change how a product is computed, not what it contains
+NON_RESULT_OPTIONS = ("memory_limit", "state_dir", "verify", "progress", "cancel", "overwrite", "workers")
+
+# Header keywords for the parameters, as (keyword, option, comment)
+PROVENANCE_KEYWORDS = (
+    ("COMBINE", "combine_method", "Combine method"),
+    ("REJECT", "reject_method", "Rejection method"),
+    ("NLOW", "nlow", "Minmax low pixels rejected"),
+    ("NHIGH", "nhigh", "Minmax high pixels rejected"),
+    ("LSIGMA", "lsigma", "Clipping low threshold"),
+    ("HSIGMA", "hsigma", "Clipping high threshold"),
+    ("SCALE", "scale", "Per-frame scaling"),
+    ("STATSEC", "statsec", "Section combined"),
+    ("BLANKVAL", "blank", "Value of empty pixels"),
+)
+
+# Instrument settings copied from the input frames, so a master can be matched to other nights
+SETTINGS_KEYWORDS = ("INSTRUME", "TELESCOP", "XBINNING", "YBINNING", "GAIN", "OFFSET", "READOUTM",
+                     "FILTER", "EXPTIME", "CCD-TEMP", "DATE-OBS")
+MEDIAN_KEYWORDS = ("EXPTIME", "CCD-TEMP")  # Numeric settings taken as the median over the inputs
+
+
+def default_result_dir():
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "astroreduct", "results")
+
+
+def _product_key(path):
+    try:
+        return read_header_values(path, ("ARKEY",)).get("ARKEY")
+    except (OSError, ValueError):
+        return None
+
+
+def input_identity(path):
+    """What a product depends on for one input: the key of a cached product, else path, size and mtime."""
+    key = _product_key(path)
+    if key:
+        return ["product", key]
+    st = os.stat(path)
+    return ["file", os.path.abspath(path), st.st_size, st.st_mtime_ns]
+
+
+def _master_identity(master):
+    if isinstance(master, str):
+        return input_identity(master)
+    if master is not None:
+        return ["array", hashlib.sha1(np.ascontiguousarray(master).tobytes()).hexdigest()]
+    return None
+
+
+def result_key(kind, paths, options, master_bias=None, master_dark=None):
+    """Hash of a reduction's inputs and result-affecting options."""
+    description = {
+        "version": RESULT_CACHE_VERSION,
+        "kind": kind,
+        "inputs": [input_identity(p) for p in paths],
+        "bias": _master_identity(master_bias),
+        "options": {k: v for k, v in options.items() if k not in NON_RESULT_OPTIONS},
+    }
+    if master_dark is not None:
+        description["dark"] = _master_identity(master_dark)
+    return hashlib.sha256(json.dumps(description, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def input_settings(paths):
+    """Instrument settings shared by the input frames, read from their headers.
+
+    EXPTIME and CCD-TEMP are medians over the frames; other keywords come
+    from the first frame that has them. Unreadable headers are skipped.
+    """
+    settings, numbers = {}, {key: [] for key in MEDIAN_KEYWORDS}
+    for path in paths:
+        try:
+            values = read_header_values(path, SETTINGS_KEYWORDS)
+        except (OSError, ValueError):
+            continue
+        for key, value in values.items():
+            if key in numbers:
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    numbers[key].append(float(value))
+            else:
+                settings.setdefault(key, value)
+    for key, values in numbers.items():
+        if values:
+            settings[key] = float(np.median(values))
+    return settings
+
+
+def provenance_header(kind, paths, options, key=None, header=None):
+    """Header recording how a product was made: parameters as keywords, inputs as HISTORY.
+
+    Instrument settings of the inputs (see :func:`input_settings`) are
+    added where the header does not have them yet.
+    """
+    header = fits.Header() if header is None else header
+    for keyword, value in input_settings(paths).items():
+        if keyword not in header:
+            header[keyword] = value
+    header["ARKIND"] = (kind, "AstroReduct product")
+    header["NCOMBINE"] = (len(paths), "Number of frames combined")
+    for keyword, option, comment in PROVENANCE_KEYWORDS:
+        value = options.get(option)
+        if value is None:
+            continue
+        if isinstance(value, (list, tuple)):
+            value = " ".join(str(v) for v in value)
+        header[keyword] = (value, comment)
+    if key is not None:
+        header["ARKEY"] = key  # Result cache key; no room left for a comment
+    for path in paths:
+        header["HISTORY"] = f"Input: {os.path.basename(path)}"
+    return header
+
+
+class ResultCache:
+    """Finished products stored as FITS files named by their key.
+
+    Least recently used products are evicted once the directory exceeds
+    ``max_bytes``; a hit refreshes the entry's mtime.
+    """
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_RESULT_CACHE_BYTES):
+        self.directory = directory or default_result_dir()
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    def entry_path(self, key):
+        return os.path.join(self.directory, f"{key}.fits")
+
+    def fetch(self, key, output_file, overwrite=True):
+        """Copy the product for ``key`` to ``output_file``; False if it is not cached.
+
+        Nothing is copied when ``output_file`` already is that product.
+        """
+        entry = self.entry_path(key)
+        if not os.path.exists(entry):
+            return False
+        if _product_key(output_file) == key:
+            os.utime(entry)
+            return True
+        if not overwrite and os.path.exists(output_file):
+            raise OSError(f"File {output_file} already exists.")
+        tmp = f"{output_file}.{os.getpid()}.tmp"
+        try:
+            shutil.copyfile(entry, tmp)
+            os.replace(tmp, output_file)
+            os.utime(entry)
+        except FileNotFoundError:
+            return False  # Evicted meanwhile
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        return True
+
+    def store(self, key, product_file):
+        entry = self.entry_path(key)
+        tmp = f"{entry}.{os.getpid()}.tmp"
+        shutil.copyfile(product_file, tmp)
+        os.replace(tmp, entry)
+        self.evict()
+
+    def evict(self):
+        """Delete least recently used products until the cache fits ``max_bytes``."""
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".fits"):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            total -= size
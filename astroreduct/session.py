@@ -0,0 +1,106 @@
+"""Session manifests: which frames belong to a stage, read in place.
+
+A manifest is a small JSON file in the stage folder listing each input
+frame's path, size, mtime and a few header values. Frames stay where the
+user selected them unless copying is asked for; before processing, the
+recorded size and mtime are compared so edited or missing files are caught.
+"""
+import json
+import os
+import shutil
+
+from astroreduct.frames import read_header_values
+from astroreduct.jobs import report
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+HEADER_KEYS = ("IMAGETYP", "OBJECT", "FILTER", "EXPTIME", "NAXIS", "NAXIS1", "NAXIS2",
+               "BITPIX", "CCD-TEMP", "GAIN", "DATE-OBS")
+
+
+def frame_entry(path):
+    """Manifest entry for one file; only its header is read."""
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    return {
+        "path": path,
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+        "header": read_header_values(path, HEADER_KEYS),
+    }
+
+
+def manifest_path(stage_dir):
+    return os.path.join(stage_dir, MANIFEST_NAME)
+
+
+def write_manifest(stage_dir, files, copy=False, progress=None, cancel=None):
+    """Record ``files`` as the inputs of ``stage_dir`` and return the manifest.
+
+    With ``copy=True`` the files are first copied into ``stage_dir`` (the
+    old behaviour) and the copies are recorded, with the originals kept as
+    ``source``. The manifest is replaced atomically. Reports the "Reading
+    headers" stage.
+    """
+    os.makedirs(stage_dir, exist_ok=True)
+    frames = []
+    for i, source in enumerate(files):
+        report(progress, cancel, "Reading headers", i, len(files))
+        path = source
+        if copy:
+            path = os.path.join(stage_dir, os.path.basename(source))
+            shutil.copy(source, path)
+        entry = frame_entry(path)
+        if copy:
+            entry["source"] = os.path.abspath(source)
+        frames.append(entry)
+    report(progress, cancel, "Reading headers", len(files), len(files))
+
+    manifest = {"version": MANIFEST_VERSION, "copied": copy, "frames": frames}
+    target = manifest_path(stage_dir)
+    tmp = f"{target}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp, target)
+    return manifest
+
+
+def read_manifest(stage_dir):
+    """The manifest of ``stage_dir``, or None if it has none."""
+    try:
+        with open(manifest_path(stage_dir)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def changed_frames(manifest):
+    """Paths in ``manifest`` that are missing or whose size or mtime changed."""
+    changed = []
+    for entry in manifest["frames"]:
+        try:
+            st = os.stat(entry["path"])
+        except OSError:
+            changed.append(entry["path"])
+            continue
+        if st.st_size != entry["size"] or st.st_mtime_ns != entry["mtime_ns"]:
+            changed.append(entry["path"])
+    return changed
+
+
+def manifest_frames(stage_dir, check=True):
+    """Input paths recorded for ``stage_dir``, or None if it has no manifest.
+
+    Raises ValueError when ``check`` is set and any frame changed since it
+    was added.
+    """
+    manifest = read_manifest(stage_dir)
+    if manifest is None:
+        return None
+    if check:
+        changed = changed_frames(manifest)
+        if changed:
+            names = ", ".join(os.path.basename(p) for p in changed[:5])
+            more = f" and {len(changed) - 5} more" if len(changed) > 5 else ""
+            raise ValueError(f"{len(changed)} frames changed or went missing since upload: {names}{more}")
+    return [entry["path"] for entry in manifest["frames"]]
@@ -0,0 +1,301 @@
+"""Alignment and stacking of calibrated light frames.
+
+Frames are registered to a reference frame by phase correlation, first on
+block-averaged copies no larger than ``COARSE_SIZE``, which finds the
+shift wherever it is, then on a ``REFINE_SIZE`` patch at full resolution
+around the most star-rich part of the reference, which gives the shift to
+a fraction of a pixel. Only translation is measured.
+
+Spectra come from batched real FFTs, ``BATCH_SIZE`` frames per transform.
+The reference's spectra and the apodisation windows are computed once and
+reused for every frame, and batches are spread over worker processes when
+``workers`` > 1.
+
+Stacking resamples each frame onto the reference grid (bilinear) as its
+rows are read, then combines the frames with the same combine and
+rejection options as master frames. Pixels outside the area covered by
+every frame are set to ``blank``.
+"""
+import functools
+import math
+import multiprocessing
+import os
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+from astropy.io import fits
+
+from astroreduct.combine import DEFAULT_MEMORY_LIMIT, FrameStack, combine_frames, full_options, write_master
+from astroreduct.frames import read_block, read_plane
+from astroreduct.jobs import report
+from astroreduct.profiling import span
+from astroreduct.results import provenance_header
+from astroreduct.thumbnails import block_mean
+
+COARSE_SIZE = 1024  # Longest side of the block-averaged frames correlated first
+REFINE_SIZE = 256  # Side of the full-resolution patch that refines the shift
+BATCH_SIZE = 16  # Frames transformed together
+
+Shift = namedtuple("Shift", "dy dx peak")  # frame[y + dy, x + dx] matches reference[y, x]
+
+
+@functools.lru_cache(maxsize=8)
+def hann_window(shape):
+    """2D Hann window, computed once per shape."""
+    window = np.outer(np.hanning(shape[0]), np.hanning(shape[1])).astype(np.float32)
+    window.flags.writeable = False
+    return window
+
+
+def prepare(image):
+    """Sky-subtracted, windowed float32 copy of ``image`` for correlation."""
+    image = np.nan_to_num(np.asarray(image, dtype=np.float32))
+    image = image - np.median(image)
+    np.clip(image, 0, None, out=image)  # Keep the stars, drop the noise below the sky
+    return image * hann_window(image.shape)
+
+
+def spectra(images):
+    """Real 2D FFT of every image in a (B, h, w) stack, in one call."""
+    return np.fft.rfft2(images, axes=(-2, -1))
+
+
+def _subpixel(left, centre, right):
+    """Offset of a parabola's vertex through three samples, in [-0.5, 0.5]."""
+    denominator = left - 2 * centre + right
+    if denominator >= 0:
+        return 0.0
+    return float(np.clip(0.5 * (left - right) / denominator, -0.5, 0.5))
+
+
+def correlate(batch_spectra, reference_conj, shape):
+    """(dy, dx, peak) of each spectrum in a batch against a conjugated reference spectrum."""
+    cross = batch_spectra * reference_conj
+    cross /= np.maximum(np.abs(cross), 1e-20)  # Phase only: a sharp peak whatever the content
+    surfaces = np.fft.irfft2(cross, s=shape, axes=(-2, -1))
+    h, w = shape
+    shifts = []
+    for surface in surfaces:
+        py, px = np.unravel_index(np.argmax(surface), shape)
+        peak = surface[py, px]
+        dy = py + _subpixel(surface[(py - 1) % h, px], peak, surface[(py + 1) % h, px])
+        dx = px + _subpixel(surface[py, (px - 1) % w], peak, surface[py, (px + 1) % w])
+        shifts.append((dy - h if dy > h / 2 else dy, dx - w if dx > w / 2 else dx, float(peak)))
+    return shifts
+
+
+def star_patch(data, factor, size):
+    """Top-left corner of the ``size`` patch with the most light above the sky, away from the edges."""
+    coarse = block_mean(data, factor)
+    coarse = np.clip(coarse - np.median(coarse), 0, None)
+    step = max(1, size[0] // factor), max(1, size[1] // factor)
+    grid = coarse[:coarse.shape[0] // step[0] * step[0], :coarse.shape[1] // step[1] * step[1]]
+    sums = grid.reshape(grid.shape[0] // step[0], step[0], grid.shape[1] // step[1], step[1]).sum(axis=(1, 3))
+    if sums.shape[0] > 2 and sums.shape[1] > 2:
+        inner = sums[1:-1, 1:-1]  # Leave room for the frames' shifts
+        by, bx = np.unravel_index(np.argmax(inner), inner.shape)
+        by, bx = by + 1, bx + 1
+    else:
+        by, bx = np.unravel_index(np.argmax(sums), sums.shape)
+    h, w = data.shape
+    return min(by * step[0] * factor, h - size[0]), min(bx * step[1] * factor, w - size[1])
+
+
+class Reference:
+    """Spectra of the reference frame, computed once and used for every frame."""
+
+    def __init__(self, data):
+        self.shape = data.shape
+        self.factor = max(1, -(-max(self.shape) // COARSE_SIZE))
+        coarse = prepare(block_mean(data, self.factor))
+        self.coarse_shape = coarse.shape
+        self.coarse_conj = np.conj(spectra(coarse[None])[0])
+        self.patch_size = (min(REFINE_SIZE, self.shape[0]), min(REFINE_SIZE, self.shape[1]))
+        self.patch_origin = star_patch(data, self.factor, self.patch_size)
+        y, x = self.patch_origin
+        patch = prepare(data[y:y + self.patch_size[0], x:x + self.patch_size[1]])
+        self.patch_conj = np.conj(spectra(patch[None])[0])
+
+    def measure(self, paths):
+        """Shift of each frame in ``paths`` against this reference, batch-transformed."""
+        with span("Register batch", frames=len(paths)):
+            frames = []
+            for path in paths:
+                data = read_plane(path)
+                if data is None or data.shape != self.shape:
+                    raise ValueError(f"{path} has shape {None if data is None else data.shape}, "
+                                     f"the reference has {self.shape}.")
+                frames.append(data)
+            coarse = np.stack([prepare(block_mean(data, self.factor)) for data in frames])
+            rough = correlate(spectra(coarse), self.coarse_conj, self.coarse_shape)
+            del coarse
+
+            h, w = self.shape
+            ph, pw = self.patch_size
+            y, x = self.patch_origin
+            origins = [(min(max(0, y + round(dy * self.factor)), h - ph),
+                        min(max(0, x + round(dx * self.factor)), w - pw)) for dy, dx, _ in rough]
+            patches = np.stack([prepare(data[oy:oy + ph, ox:ox + pw]) for data, (oy, ox) in zip(frames, origins)])
+            fine = correlate(spectra(patches), self.patch_conj, self.patch_size)
+        return [Shift(oy - y + dy, ox - x + dx, peak) for (oy, ox), (dy, dx, peak) in zip(origins, fine)]
+
+
+# Per-process reference set up by _init_worker
+_reference = None
+
+
+def _init_worker(reference):
+    global _reference
+    _reference = reference
+
+
+def _measure_batch(paths):
+    return _reference.measure(paths)
+
+
+def register_frames(paths, reference=0, workers=1, progress=None, cancel=None):
+    """Shift of every frame in ``paths`` relative to ``paths[reference]``, as a list of Shift.
+
+    ``peak`` is the height of the correlation peak, 1 for a perfect match;
+    frames near 0 did not register. Batches are measured in ``workers``
+    processes.
+    """
+    if not paths:
+        raise ValueError("No frames to register.")
+    data = read_plane(paths[reference])
+    if data is None:
+        raise ValueError(f"{paths[reference]} does not contain an image.")
+    with span("Reference spectra"):
+        ref = Reference(data)
+    del data
+
+    batches = [list(range(i, min(i + BATCH_SIZE, len(paths)))) for i in range(0, len(paths), BATCH_SIZE)]
+    shifts = [None] * len(paths)
+    done = 0
+    report(progress, cancel, "Registering", 0, len(paths))
+    if workers and workers > 1 and len(batches) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(batches)),
+                                 mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_worker, initargs=(ref,)) as pool:
+            pending = {pool.submit(_measure_batch, [paths[i] for i in batch]): batch for batch in batches}
+            try:
+                while pending:
+                    finished, _ = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        batch = pending.pop(future)
+                        for i, shift in zip(batch, future.result()):
+                            shifts[i] = shift
+                        done += len(batch)
+                    report(progress, cancel, "Registering", done, len(paths))
+            except BaseException:
+                for future in pending:
+                    future.cancel()
+                raise
+    else:
+        for batch in batches:
+            for i, shift in zip(batch, ref.measure([paths[i] for i in batch])):
+                shifts[i] = shift
+            done += len(batch)
+            report(progress, cancel, "Registering", done, len(paths))
+    shifts[reference] = Shift(0.0, 0.0, shifts[reference].peak)
+    return shifts
+
+
+def shift_bilinear(block, fy, fx):
+    """``block`` sampled at (y + fy, x + fx), one row and column smaller."""
+    rows = block[:-1] if fy == 0 else block[:-1] * (1 - fy) + block[1:] * fy
+    return rows[:, :-1] if fx == 0 else rows[:, :-1] * (1 - fx) + rows[:, 1:] * fx
+
+
+class AlignedStack(FrameStack):
+    """Frames resampled onto the reference grid as their rows are read.
+
+    ``shifts`` holds each frame's (dy, dx). The stack covers the part of
+    the reference grid that every frame overlaps; ``origin`` is its
+    top-left corner and ``full_shape`` the reference frame's shape.
+    """
+
+    def __init__(self, paths, scale="none", statsec=None, bias=None, progress=None, cancel=None,
+                 factors=None, shifts=None):
+        if statsec is not None or bias is not None:
+            raise ValueError("Aligned stacks take calibrated frames, without statsec or bias.")
+        if shifts is None or len(shifts) != len(paths):
+            raise ValueError("Every frame needs a shift.")
+        self.shifts = [(float(s[0]), float(s[1])) for s in shifts]
+        super().__init__(paths, scale, None, None, progress, cancel, factors)
+
+    def _layout(self, statsec):
+        self.full_shape = tuple(self.hdus[0].shape[-2:])
+        for path, hdu in zip(self.paths, self.hdus):
+            if tuple(hdu.shape[-2:]) != self.full_shape:
+                raise ValueError(f"{path} has shape {hdu.shape[-2:]}, expected {self.full_shape}.")
+        h, w = self.full_shape
+        whole = [(math.floor(dy), math.floor(dx)) for dy, dx in self.shifts]
+        # Interpolation reads one row and column past each output pixel
+        y0 = max(0, max(-iy for iy, _ in whole))
+        y1 = min(h - 1 - iy for iy, _ in whole)
+        x0 = max(0, max(-ix for _, ix in whole))
+        x1 = min(w - 1 - ix for _, ix in whole)
+        if y1 <= y0 or x1 <= x0:
+            raise ValueError("The aligned frames do not overlap.")
+        self.origin = (y0, x0)
+        self.shape = (y1 - y0, x1 - x0)
+        self.regions = [(range(y0 + iy, y1 + iy + 1), range(x0 + ix, x1 + ix + 1)) for iy, ix in whole]
+        self.fractions = [(dy - iy, dx - ix) for (dy, dx), (iy, ix) in zip(self.shifts, whole)]
+
+    def worker_options(self):
+        return {"shifts": self.shifts}
+
+    def band(self, y0, y1):
+        """Rows ``y0:y1`` of every resampled frame as a (N, rows, cols) array."""
+        tile = np.empty((len(self.hdus), y1 - y0, self.shape[1]), dtype=self.dtype)
+        with span("Read aligned band", rows=y1 - y0, frames=len(self.hdus)):
+            for i, (hdu, (rows, cols), (fy, fx)) in enumerate(zip(self.hdus, self.regions, self.fractions)):
+                block = np.asarray(read_block(hdu, rows[y0:y1 + 1], cols), dtype=self.dtype)
+                tile[i] = shift_bilinear(block, fy, fx)
+                if self.factors is not None and self.factors[i] != 0:
+                    tile[i] /= self.factors[i]
+        return tile
+
+
+def stack_lights(paths, output_file, reference=0, shifts=None, min_peak=None, scale="none",
+                 overwrite=True, memory_limit=DEFAULT_MEMORY_LIMIT, workers=1, progress=None,
+                 cancel=None, **kwargs):
+    """Register ``paths`` to ``paths[reference]``, combine them and write the stacked image.
+
+    ``shifts`` from an earlier :func:`register_frames` skip registration.
+    Frames whose correlation peak is below ``min_peak`` are left out.
+    Remaining keyword arguments are the combine options of
+    :func:`combine_files` (combine_method, reject_method, nlow, nhigh,
+    blank, sigclip/pclip options). The reference frame's header is kept.
+    Returns the stacked float32 image.
+    """
+    if shifts is None:
+        shifts = register_frames(paths, reference, workers, progress, cancel)
+    reference_path = paths[reference]
+    if min_peak is not None:
+        kept = [(p, s) for p, s in zip(paths, shifts) if s.peak >= min_peak or p == reference_path]
+        paths, shifts = [p for p, _ in kept], [s for _, s in kept]
+
+    options = full_options(dict(kwargs, scale=scale))
+    with AlignedStack(paths, scale, progress=progress, cancel=cancel, shifts=shifts) as frames:
+        core = combine_frames(frames, memory_limit=memory_limit, progress=progress, cancel=cancel,
+                              workers=workers, **kwargs)
+        (y0, x0), (h, w) = frames.origin, frames.shape
+        image = np.full(frames.full_shape, options["blank"], dtype=np.float32)
+    image[y0:y0 + h, x0:x0 + w] = core
+    del core
+
+    report(progress, cancel, "Writing", 0, 1)
+    header = fits.getheader(reference_path)
+    for key in ("BZERO", "BSCALE", "BLANK"):  # Output is unscaled float32
+        header.remove(key, ignore_missing=True)
+    header["STACKREF"] = (os.path.basename(reference_path), "Reference frame of the alignment")
+    provenance_header("stack", paths, options, header=header)
+    for path, shift in zip(paths, shifts):
+        header["HISTORY"] = f"Shift {os.path.basename(path)}: dy={shift[0]:.2f} dx={shift[1]:.2f}"
+    write_master(output_file, image, header, overwrite)
+    if progress is not None:
+        progress("Writing", 1, 1)
+    return image
@@ -0,0 +1,166 @@
+"""Thumbnail rendering and a persistent on-disk thumbnail cache."""
+import hashlib
+import os
+
+import numpy as np
+
+from astroreduct.frames import read_plane
+from astroreduct.normalize import CHUNK_PIXELS, DEFAULT_STRETCH, stretch_limits, to_uint8
+from astroreduct.profiling import span
+
+THUMBNAIL_SIZE = 200
+DEFAULT_CACHE_BYTES = 256 * 1024 ** 2
+
+
+def default_cache_dir():
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "astroreduct", "thumbnails")
+
+
+def block_mean(data, factor, vmin=None, vmax=None):
+    """Average ``factor`` x ``factor`` blocks of ``data``, dropping partial edge blocks.
+
+    Works through the image in row bands, so a memory-mapped frame is read
+    once without a full-size temporary; values are clipped to [vmin, vmax]
+    first when given.
+    """
+    h = data.shape[0] // factor * factor
+    w = data.shape[1] // factor * factor
+    if factor <= 1 or h == 0 or w == 0:
+        small = np.nan_to_num(np.asarray(data[::factor, ::factor], dtype=np.float64))
+        return small if vmin is None else np.clip(small, vmin, vmax)
+
+    band = max(1, CHUNK_PIXELS // (data.shape[1] * factor)) * factor
+    out = np.empty((h // factor, w // factor), dtype=np.float64)
+    for y in range(0, h, band):
+        block = np.nan_to_num(np.asarray(data[y:min(y + band, h), :w], dtype=np.float64))
+        if vmin is not None:
+            np.clip(block, vmin, vmax, out=block)
+        out[y // factor:(y + len(block)) // factor] = (
+            block.reshape(len(block) // factor, factor, w // factor, factor).mean(axis=(1, 3)))
+    return out
+
+
+def downsample(data, size, vmin=None, vmax=None):
+    """Block-average ``data`` so that neither side exceeds ``size`` pixels."""
+    return block_mean(data, -(-max(data.shape) // size), vmin, vmax)
+
+
+def thumbnail_from_array(data, vmin, vmax, size=THUMBNAIL_SIZE):
+    """8-bit thumbnail of ``data`` stretched to [vmin, vmax]."""
+    with span("Thumbnail", shape=str(data.shape)):
+        return to_uint8(downsample(data, size, vmin, vmax), vmin, vmax)
+
+
+def render_thumbnail(path, size=THUMBNAIL_SIZE, method=DEFAULT_STRETCH):
+    """Thumbnail and stretch limits of a FITS file, or (None, None) without an image."""
+    data = read_plane(path)
+    if data is None:
+        return None, None
+    limits = stretch_limits(data, method)
+    return thumbnail_from_array(data, *limits, size=size), limits
+
+
+class ThumbnailCache:
+    """Thumbnails stored as .npy files, keyed by path, mtime and size.
+
+    Least recently used entries are evicted once the directory exceeds
+    ``max_bytes``; a hit refreshes the entry's mtime, which is what the
+    eviction order uses.
+    """
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_CACHE_BYTES):
+        self.directory = directory or default_cache_dir()
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    def entry_path(self, path, variant):
+        """Cache file for ``variant`` of ``path``, or None if ``path`` can't be stat'ed (moved or deleted)."""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        key = f"{os.path.abspath(path)}|{st.st_mtime_ns}|{st.st_size}|{variant}"
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + ".npy")
+
+    def _load(self, entry):
+        if entry is None:
+            return None
+        try:
+            value = np.load(entry)
+        except (OSError, ValueError):
+            return None
+        try:
+            os.utime(entry)
+        except OSError:
+            pass
+        return value
+
+    def _store(self, entry, value):
+        if entry is None:
+            return
+        tmp = f"{entry}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.save(f, value)
+        os.replace(tmp, entry)
+
+    def get(self, path, size=THUMBNAIL_SIZE):
+        return self._load(self.entry_path(path, f"thumb{size}"))
+
+    def put(self, path, thumb, size=THUMBNAIL_SIZE):
+        self._store(self.entry_path(path, f"thumb{size}"), thumb)
+
+    def get_limits(self, path, method=DEFAULT_STRETCH):
+        """Stretch limits stored when the thumbnail was rendered, or None."""
+        limits = self._load(self.entry_path(path, f"limits-{method}"))
+        return None if limits is None else tuple(float(v) for v in limits)
+
+    def put_limits(self, path, limits, method=DEFAULT_STRETCH):
+        self._store(self.entry_path(path, f"limits-{method}"), np.asarray(limits, dtype=np.float64))
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits ``max_bytes``."""
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".npy"):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            total -= size
+
+
+def cached_thumbnail(path, size=THUMBNAIL_SIZE, cache_dir=None, max_bytes=DEFAULT_CACHE_BYTES,
+                     method=DEFAULT_STRETCH):
+    """Thumbnail from the cache, rendering and storing it (with its limits) on a miss.
+
+    Module-level so it can be sent to a process pool.
+    """
+    cache = ThumbnailCache(cache_dir, max_bytes)
+    thumb = cache.get(path, size)
+    if thumb is None:
+        thumb, limits = render_thumbnail(path, size, method)
+        if thumb is not None:
+            cache.put(path, thumb, size)
+            cache.put_limits(path, limits, method)
+    return thumb
+
+
+def file_stretch_limits(path, data, method=DEFAULT_STRETCH, cache=None):
+    """Stretch limits of the image in ``path``, computed at most once per file version."""
+    cache = cache or ThumbnailCache()
+    limits = cache.get_limits(path, method)
+    if limits is None:
+        limits = stretch_limits(data, method)
+        cache.put_limits(path, limits, method)
+    return limits
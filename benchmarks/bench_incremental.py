@@ -0,0 +1,85 @@
+"""Adding frames to a master: incremental update against a full combine.
+
+    python benchmarks/bench_incremental.py --frames 200 --added 5 --shape 1024 1024 --json incremental.json
+
+Writes a synthetic uint16 bias set to a temporary directory, builds the
+combine state from the first ``--frames`` frames, then times adding
+``--added`` more both ways and checks the masters are identical.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from astropy.io import fits
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from astroreduct.combine import combine_files  # noqa: E402
+from astroreduct.incremental import update_master  # noqa: E402
+
+
+def write_bias_set(directory, count, shape, seed=0):
+    rng = np.random.default_rng(seed)
+    paths = []
+    for i in range(count):
+        data = rng.normal(1000.0, 8.0, shape)
+        data[rng.random(shape) < 0.001] += 3000  # Cosmic rays
+        path = os.path.join(directory, f"bias{i:04d}.fits")
+        fits.writeto(path, data.astype(np.uint16))
+        paths.append(path)
+    return paths
+
+
+def timed(fn):
+    t0 = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - t0, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--added", type=int, default=5)
+    parser.add_argument("--shape", type=int, nargs=2, default=(1024, 1024), metavar=("H", "W"))
+    parser.add_argument("--combine", default="median", choices=("median", "average"))
+    parser.add_argument("--reject", default="minmax", choices=("none", "minmax"))
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args(argv)
+
+    options = dict(combine_method=args.combine, reject_method=args.reject, nlow=0,
+                   nhigh=1 if args.reject == "minmax" else 0)
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = write_bias_set(tmp, args.frames + args.added, tuple(args.shape))
+        state_dir = os.path.join(tmp, "state")
+        build_time, _ = timed(lambda: update_master(paths[:args.frames], state_dir, **options))
+        full_time, full = timed(lambda: combine_files(paths, **options))
+        update_time, updated = timed(lambda: update_master(paths, state_dir, **options))
+        state_bytes = sum(e.stat().st_size for e in os.scandir(state_dir))
+        input_bytes = sum(os.path.getsize(p) for p in paths)
+
+    results = {
+        "build_state_seconds": build_time,
+        "full_combine_seconds": full_time,
+        "incremental_seconds": update_time,
+        "speedup": full_time / update_time,
+        "identical": bool(np.array_equal(full, updated)),
+        "max_abs_diff": float(np.abs(full - updated).max()),
+        "state_bytes": state_bytes,
+        "input_bytes": input_bytes,
+    }
+    print(f"build state {build_time:.2f} s, full combine {full_time:.2f} s, "
+          f"incremental {update_time:.2f} s ({results['speedup']:.1f}x)")
+    print(f"identical: {results['identical']}, state {state_bytes / 1e6:.0f} MB "
+          f"for {input_bytes / 1e6:.0f} MB of inputs")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"frames": args.frames, "added": args.added, "shape": list(args.shape),
+                       "options": options, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
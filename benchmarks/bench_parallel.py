@@ -0,0 +1,77 @@
+"""Scaling of a multi-process combine with the number of workers.
+
+    python benchmarks/bench_parallel.py --preset 4k --frames 20 --workers 1 2 4 8 16 --json scaling.json
+
+Writes a synthetic bias set (see synthetic.py) to a temporary directory
+and combines it once per worker count, checking every master against the
+single-process one. Speedup and parallel efficiency are relative to one
+worker; each time includes starting the worker processes. Expect the
+curve to flatten once memory bandwidth or the disk is saturated.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np  # noqa: E402
+
+from astroreduct.combine import DEFAULT_MEMORY_LIMIT, REJECT_METHODS, combine_files  # noqa: E402
+from synthetic import DTYPES, parse_shape, write_set  # noqa: E402
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--preset", default="4k", help="small, 4k, 9k6k or HxW")
+    parser.add_argument("--dtype", default="uint16", choices=DTYPES)
+    parser.add_argument("--frames", type=int, default=20)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8],
+                        help="Worker counts to time")
+    parser.add_argument("--combine", default="median", choices=("median", "average"))
+    parser.add_argument("--reject", default="minmax", choices=REJECT_METHODS)
+    parser.add_argument("--memory-limit", type=float, default=DEFAULT_MEMORY_LIMIT / 1024 ** 2, metavar="MB")
+    parser.add_argument("--repeat", type=int, default=1, help="Best of this many runs per worker count")
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args(argv)
+
+    shape = parse_shape(args.preset)
+    options = dict(combine_method=args.combine, reject_method=args.reject,
+                   memory_limit=int(args.memory_limit * 1024 ** 2))
+    counts = sorted(set([1] + args.workers))
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = write_set(tmp, "bias", args.frames, shape, args.dtype)
+        reference = None
+        for workers in counts:
+            times = []
+            for _ in range(args.repeat):
+                t0 = time.perf_counter()
+                master = combine_files(paths, workers=workers, **options)
+                times.append(time.perf_counter() - t0)
+            if reference is None:
+                reference = master
+            seconds = min(times)
+            base = results[0]["seconds"] if results else seconds
+            results.append({
+                "workers": workers,
+                "seconds": seconds,
+                "speedup": base / seconds,
+                "efficiency": base / seconds / workers,
+                "identical": bool(np.array_equal(master, reference)),
+            })
+            r = results[-1]
+            print(f"{workers:>3} workers {seconds:>8.2f} s {r['speedup']:>6.2f}x "
+                  f"{r['efficiency'] * 100:>5.0f}% {'' if r['identical'] else 'MISMATCH'}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"shape": list(shape), "dtype": args.dtype, "frames": args.frames,
+                       "options": options, "cpu_count": os.cpu_count(), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
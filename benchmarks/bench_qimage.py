@@ -0,0 +1,79 @@
+"""Allocations and time per thumbnail: old copy-heavy QImage path vs GUI.QtImage.
+
+    QT_QPA_PLATFORM=offscreen python benchmarks/bench_qimage.py --json qimage.json
+
+The old path is the one process_images used for the master preview:
+``data.copy()`` -> QImage -> ``image.copy()`` -> QPixmap.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyQt5.QtGui import QImage, QPixmap  # noqa: E402
+from PyQt5.QtWidgets import QApplication  # noqa: E402
+
+from GUI.QtImage import array_to_pixmap  # noqa: E402
+
+
+def old_path(data):
+    data_copy = data.copy()
+    h, w = data_copy.shape
+    image = QImage(data_copy.data, w, h, w, QImage.Format_Grayscale8)
+    image = image.copy()
+    return QPixmap.fromImage(image)
+
+
+def seconds_per_call(fn, thumbs):
+    t0 = time.perf_counter()
+    for thumb in thumbs:
+        fn(thumb)
+    return (time.perf_counter() - t0) / len(thumbs)
+
+
+def traced_peak_per_call(fn, thumb):
+    """Peak bytes allocated by one call, as seen by tracemalloc (numpy buffers included)."""
+    tracemalloc.start()
+    fn(thumb)  # Warm up lazily created state
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    fn(thumb)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak - current
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=200, help="Thumbnail side in pixels")
+    parser.add_argument("--count", type=int, default=2000)
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args(argv)
+
+    app = QApplication.instance() or QApplication([])  # noqa: F841 (QPixmap needs it)
+    rng = np.random.default_rng(0)
+    # Width not a multiple of 4, so rows are not 32-bit aligned
+    thumbs = [rng.integers(0, 256, (args.size, args.size - 3), dtype=np.uint8) for _ in range(args.count)]
+
+    results = {}
+    for name, fn in (("old", old_path), ("new", array_to_pixmap)):
+        results[name] = {
+            "us_per_thumbnail": seconds_per_call(fn, thumbs) * 1e6,
+            "traced_peak_bytes_per_call": traced_peak_per_call(fn, thumbs[0]),
+        }
+    for name, r in results.items():
+        print(f"{name:>4}: {r['us_per_thumbnail']:8.1f} us/thumbnail, "
+              f"{r['traced_peak_bytes_per_call']:>8} B traced peak per call")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"size": args.size, "count": args.count, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
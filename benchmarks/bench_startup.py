@@ -0,0 +1,95 @@
+"""Time from launching the GUI to its first painted frame.
+
+    python benchmarks/bench_startup.py --repeat 10 --json startup.json
+
+Each run starts a fresh interpreter that imports the GUI, creates the
+main window and shows it, and reports when the first paint event is
+delivered. Also recorded: the time until the window is shown, whether
+numpy and astropy were already imported by then, and the time to open the
+processing screen after the first frame. Uses Qt's offscreen platform
+unless --platform is given; file caches are warm after the first run.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def child():
+    """One start-up, timed from interpreter start; prints a JSON line."""
+    t0 = time.perf_counter()
+    sys.path.insert(0, ROOT)
+    from PyQt5.QtCore import QEvent, QObject, QTimer
+    from PyQt5.QtWidgets import QApplication
+    from GUI.MainWindow import MainWindow
+    t_import = time.perf_counter() - t0
+
+    app = QApplication(sys.argv[:1])
+    app.setStyle("Fusion")
+    window = MainWindow()
+    window.show()
+    t_show = time.perf_counter() - t0
+    result = {"import": t_import, "show": t_show,
+              "numpy_at_show": "numpy" in sys.modules, "astropy_at_show": "astropy" in sys.modules}
+
+    def open_processing():
+        t1 = time.perf_counter()
+        window.show_processing_screen()
+        app.processEvents()
+        result["open_processing"] = time.perf_counter() - t1
+        print(json.dumps(result))
+        app.quit()
+
+    class FirstPaint(QObject):
+        def eventFilter(self, obj, event):
+            if event.type() == QEvent.Paint and "first_frame" not in result:
+                result["first_frame"] = time.perf_counter() - t0
+                QTimer.singleShot(500, open_processing)  # Give the background preload a moment
+            return False
+
+    watcher = FirstPaint()
+    app.installEventFilter(watcher)
+    app.exec_()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="Number of start-ups")
+    parser.add_argument("--platform", default="offscreen", help="QT_QPA_PLATFORM for the runs")
+    parser.add_argument("--json", help="Write results to this file")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.child:
+        child()
+        return
+
+    env = dict(os.environ, QT_QPA_PLATFORM=args.platform)
+    runs = []
+    for i in range(args.repeat):
+        wall = time.perf_counter()
+        out = subprocess.run([sys.executable, os.path.abspath(__file__), "--child"], env=env,
+                             capture_output=True, text=True, check=True).stdout
+        run = json.loads(out.strip().splitlines()[-1])
+        run["process"] = time.perf_counter() - wall
+        runs.append(run)
+        print(f"run {i + 1}: first frame {run['first_frame'] * 1000:.0f} ms, "
+              f"imports {run['import'] * 1000:.0f} ms, "
+              f"open processing {run['open_processing'] * 1000:.0f} ms, "
+              f"numpy at show: {run['numpy_at_show']}")
+
+    summary = {key: statistics.median(run[key] for run in runs)
+               for key in ("import", "show", "first_frame", "open_processing", "process")}
+    print("median: " + ", ".join(f"{key} {value * 1000:.0f} ms" for key, value in summary.items()))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"platform": args.platform, "python": sys.version, "median": summary, "runs": runs},
+                      f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
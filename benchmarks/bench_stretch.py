@@ -0,0 +1,79 @@
+"""Speed and visual error of the stretch methods against the exact percentile.
+
+    python benchmarks/bench_stretch.py --shape 6000 9000 --json stretch.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from astroreduct.normalize import STRETCH_METHODS, stretch_limits, to_uint8  # noqa: E402
+
+
+def synthetic_sky(shape, seed=0):
+    """Float32 sky background with read noise, a gradient and a few thousand stars."""
+    rng = np.random.default_rng(seed)
+    h, w = shape
+    sky = rng.normal(1000.0, 12.0, shape).astype(np.float32)
+    sky += np.linspace(0, 40, w, dtype=np.float32)[None, :]
+    n_stars = max(10, h * w // 20000)
+    ys = rng.integers(0, h, n_stars)
+    xs = rng.integers(0, w, n_stars)
+    sky[ys, xs] += rng.pareto(1.5, n_stars).astype(np.float32) * 2000
+    return sky
+
+
+def best_time(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - t0)
+    return min(times), result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--shape", type=int, nargs=2, default=(4096, 4096), metavar=("H", "W"))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args(argv)
+
+    data = synthetic_sky(tuple(args.shape))
+    exact_time, exact = best_time(lambda: stretch_limits(data, "exact"), args.repeat)
+    exact_img = to_uint8(data, *exact)
+
+    results = []
+    for method in STRETCH_METHODS:
+        seconds, (vmin, vmax) = best_time(lambda: stretch_limits(data, method), args.repeat)
+        img = to_uint8(data, vmin, vmax)
+        diff = np.abs(img.astype(np.int16) - exact_img)
+        span = exact[1] - exact[0]
+        results.append({
+            "method": method,
+            "seconds": seconds,
+            "speedup": exact_time / seconds,
+            "vmin": vmin,
+            "vmax": vmax,
+            "limit_error": max(abs(vmin - exact[0]), abs(vmax - exact[1])) / span,
+            "mean_abs_diff_8bit": float(diff.mean()),
+            "max_abs_diff_8bit": int(diff.max()),
+        })
+
+    print(f"{'method':<10} {'seconds':>9} {'speedup':>8} {'limit err':>10} {'mean |d|':>9} {'max |d|':>8}")
+    for r in results:
+        print(f"{r['method']:<10} {r['seconds']:>9.4f} {r['speedup']:>7.1f}x "
+              f"{r['limit_error']:>10.4%} {r['mean_abs_diff_8bit']:>9.3f} {r['max_abs_diff_8bit']:>8}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"shape": list(args.shape), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""Time and memory of the reduction hot paths on synthetic data, as JSON.
+
+    python benchmarks/suite.py --preset small --preset 4k --dtype uint16 --json results.json
+    python benchmarks/suite.py --preset 4k --json new.json --compare results.json
+
+For every preset and dtype a night (bias, flat, lights) is generated in a
+temporary directory. Each benchmark runs ``--repeat`` times for the best
+time, then once more under tracemalloc for the peak Python/NumPy allocation.
+With ``--compare`` the run is checked against an earlier JSON file, and
+the exit status is 1 if anything got slower by more than ``--tolerance``.
+Thumbnail workers run in other processes, so their memory is not counted.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import astropy  # noqa: E402
+import numpy as np  # noqa: E402
+
+from astroreduct.calibrate import calibrate_lights, make_master_flat  # noqa: E402
+from astroreduct.combine import combine_files, combine_to_file  # noqa: E402
+from astroreduct.thumbnails import render_thumbnail  # noqa: E402
+from synthetic import DTYPES, parse_shape, write_night  # noqa: E402
+
+BENCHMARKS = ("bias_combine", "flat_combine", "calibrate_lights", "thumbnail", "viewer", "upload")
+
+
+def measure(fn, repeat, setup=None):
+    """Best wall time over ``repeat`` runs, and the tracemalloc peak of one more run.
+
+    Tracing slows Python-heavy code down a lot, so the timed runs are not traced.
+    """
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    try:
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {"seconds": min(times), "all_seconds": times, "peak_bytes": peak}
+
+
+_app = None
+
+
+def qt_app():
+    """The QApplication, kept alive for the whole run."""
+    global _app
+    if _app is None:
+        from PyQt5.QtWidgets import QApplication
+        _app = QApplication.instance() or QApplication([])
+    return _app
+
+
+def wait_for(app, done, timeout=600):
+    start = time.perf_counter()
+    while not done():
+        if time.perf_counter() - start > timeout:
+            raise TimeoutError("benchmark did not finish")
+        app.processEvents()
+        time.sleep(0.001)
+
+
+def run_night(night, work, repeat, selected):
+    """Run the selected benchmarks on one generated night; returns {name: result}."""
+    results = {}
+    bias_out = os.path.join(work, "MasterBias.fits")
+    flat_out = os.path.join(work, "MasterFlat.fits")
+    combine_to_file(night["bias"], bias_out)  # Inputs for the later stages
+
+    if "bias_combine" in selected:
+        results["bias_combine"] = measure(
+            lambda: combine_files(night["bias"], "median", "minmax", nlow=0, nhigh=1), repeat)
+    if "flat_combine" in selected or "calibrate_lights" in selected:
+        flat = measure(lambda: make_master_flat(night["flat"], flat_out, bias_out), repeat)
+        if "flat_combine" in selected:
+            results["flat_combine"] = flat
+    if "calibrate_lights" in selected:
+        out_dir = os.path.join(work, "calibrated")
+        results["calibrate_lights"] = measure(
+            lambda: calibrate_lights(night["light"], out_dir, bias_out, flat_out), repeat)
+    if "thumbnail" in selected:
+        results["thumbnail"] = measure(lambda: render_thumbnail(night["light"][0]), repeat)
+
+    if "viewer" in selected or "upload" in selected:
+        app = qt_app()
+    if "viewer" in selected:
+        from GUI.FITSViewer import FITSViewer
+
+        def open_viewer():
+            viewer = FITSViewer(night["light"][0])
+            viewer.resize(800, 600)
+            viewer.show()
+            wait_for(app, lambda: viewer.pyramid.ready)
+            app.processEvents()
+            viewer.stop()
+            viewer.close()
+        # Stretch limits are cached per file; clear them so each run computes them
+        results["viewer"] = measure(open_viewer, repeat, setup=clear_thumbnail_cache)
+    if "upload" in selected:
+        from GUI.ThumbnailGrid import ThumbnailGrid
+        from astroreduct.session import write_manifest
+
+        def upload():
+            # What use_files does: record the frames, then fill the grid until the visible thumbnails are in
+            write_manifest(os.path.join(work, "LIGHTS"), night["light"])
+            grid = ThumbnailGrid()
+            grid.resize(1000, 800)
+            grid.show()
+            grid.set_files(night["light"])
+            model = grid.frame_model
+            wait_for(app, lambda: grid.visible_rows() and all(model.has_thumbnail(r) for r in grid.visible_rows()))
+            grid.close()
+        results["upload"] = measure(upload, repeat, setup=clear_thumbnail_cache)
+    return results
+
+
+def clear_thumbnail_cache():
+    from astroreduct.thumbnails import default_cache_dir
+    shutil.rmtree(default_cache_dir(), ignore_errors=True)
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "astropy": astropy.__version__,
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def compare(results, baseline_file, tolerance):
+    """Print time ratios against a baseline run; returns True if nothing regressed."""
+    with open(baseline_file) as f:
+        baseline = {(r["name"], r["preset"], r["dtype"]): r for r in json.load(f)["results"]}
+    ok = True
+    print(f"\n{'benchmark':<18} {'preset':<8} {'dtype':<8} {'before':>9} {'after':>9} {'ratio':>7}")
+    for r in results:
+        old = baseline.get((r["name"], r["preset"], r["dtype"]))
+        if old is None:
+            continue
+        ratio = r["seconds"] / old["seconds"]
+        regressed = ratio > 1 + tolerance
+        ok &= not regressed
+        print(f"{r['name']:<18} {r['preset']:<8} {r['dtype']:<8} {old['seconds']:>9.3f} "
+              f"{r['seconds']:>9.3f} {ratio:>6.2f}x{'  REGRESSION' if regressed else ''}")
+    return ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--preset", action="append", help="small, 4k, 9k6k or HxW (repeatable; default small)")
+    parser.add_argument("--dtype", action="append", choices=DTYPES, help="Pixel type (repeatable; default uint16)")
+    parser.add_argument("--frames", type=int, default=10, help="Frames in each bias/flat/light set")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--only", action="append", choices=BENCHMARKS, help="Run only these benchmarks")
+    parser.add_argument("--json", help="Write results to this file")
+    parser.add_argument("--compare", metavar="JSON", help="Earlier results to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown for --compare")
+    args = parser.parse_args(argv)
+
+    presets = args.preset or ["small"]
+    dtypes = args.dtype or ["uint16"]
+    selected = set(args.only or BENCHMARKS)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        # Keep thumbnail and result caches out of the user's cache
+        os.environ["XDG_CACHE_HOME"] = os.path.join(tmp, "cache")
+        for preset in presets:
+            for dtype in dtypes:
+                shape = parse_shape(preset)
+                night_dir = os.path.join(tmp, f"{preset}-{dtype}")
+                night = write_night(night_dir, shape, dtype, args.frames, args.frames, args.frames)
+                for name, r in run_night(night, night_dir, args.repeat, selected).items():
+                    r.update(name=name, preset=preset, dtype=dtype, shape=list(shape), frames=args.frames)
+                    results.append(r)
+                    print(f"{name:<18} {preset:<8} {dtype:<8} {r['seconds']:>9.3f} s "
+                          f"{r['peak_bytes'] / 1024 ** 2:>9.1f} MB peak")
+                shutil.rmtree(night_dir)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"environment": environment(), "repeat": args.repeat, "results": results}, f, indent=2)
+    if args.compare and not compare(results, args.compare, args.tolerance):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
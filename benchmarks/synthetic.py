@@ -0,0 +1,114 @@
+"""Synthetic bias, flat and light FITS sets for benchmarks.
+
+    python benchmarks/synthetic.py --preset 4k --dtype uint16 --bias 20 --flat 10 --lights 10 --out /tmp/night
+
+Frames carry IMAGETYP, EXPTIME, FILTER and OBJECT headers, so they can
+also be grouped by the frame catalogue. The same seed gives the same files.
+"""
+import argparse
+import os
+
+import numpy as np
+from astropy.io import fits
+
+# (height, width) of each preset
+PRESETS = {
+    "small": (512, 512),
+    "4k": (4096, 4096),
+    "9k6k": (6000, 9000),
+}
+DTYPES = ("uint16", "float32")
+
+BIAS_LEVEL = 1000.0
+READ_NOISE = 8.0
+
+
+def parse_shape(preset):
+    """Shape of a preset name or of 'HxW'."""
+    if preset in PRESETS:
+        return PRESETS[preset]
+    h, w = preset.lower().split("x")
+    return int(h), int(w)
+
+
+def bias_pattern(shape, rng):
+    """Fixed column structure shared by every frame, like a real bias."""
+    return rng.normal(0.0, 3.0, shape[1])[None, :].astype(np.float32)
+
+
+def vignetting(shape):
+    """Smooth 0.8..1 illumination falloff used for flats and lights."""
+    h, w = shape
+    y = np.linspace(-1, 1, h, dtype=np.float32)[:, None]
+    x = np.linspace(-1, 1, w, dtype=np.float32)[None, :]
+    return 1.0 - 0.1 * (x * x + y * y)
+
+
+def frame(kind, shape, rng, pattern, falloff):
+    """One synthetic frame of ``kind`` ('bias', 'flat' or 'light') as float32."""
+    data = rng.normal(BIAS_LEVEL, READ_NOISE, shape).astype(np.float32)
+    data += pattern
+    if kind == "flat":
+        data += falloff * 20000
+    elif kind == "light":
+        sky = falloff * 300
+        n_stars = max(10, shape[0] * shape[1] // 20000)
+        ys = rng.integers(0, shape[0], n_stars)
+        xs = rng.integers(0, shape[1], n_stars)
+        sky[ys, xs] += rng.pareto(1.5, n_stars).astype(np.float32) * 2000
+        data += sky
+    hits = rng.random(shape, dtype=np.float32) < 0.0005  # Cosmic rays
+    data[hits] += 5000
+    return data
+
+
+def write_set(directory, kind, count, shape, dtype="uint16", seed=0, filter_name="R", target="M31"):
+    """Write ``count`` frames of ``kind`` into ``directory`` and return their paths."""
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng([seed, DTYPES.index(dtype), ("bias", "flat", "light").index(kind)])
+    pattern = bias_pattern(shape, np.random.default_rng(seed))
+    falloff = vignetting(shape)
+    paths = []
+    for i in range(count):
+        data = frame(kind, shape, rng, pattern, falloff)
+        if dtype == "uint16":
+            data = np.clip(np.rint(data), 0, 65535).astype(np.uint16)
+        header = fits.Header()
+        header["IMAGETYP"] = {"bias": "Bias Frame", "flat": "Flat Field", "light": "Light Frame"}[kind]
+        header["EXPTIME"] = {"bias": 0.0, "flat": 2.0, "light": 120.0}[kind]
+        if kind != "bias":
+            header["FILTER"] = filter_name
+        if kind == "light":
+            header["OBJECT"] = target
+        path = os.path.join(directory, f"{kind}{i:04d}.fits")
+        fits.writeto(path, data, header, overwrite=True)
+        paths.append(path)
+    return paths
+
+
+def write_night(directory, shape, dtype="uint16", n_bias=10, n_flat=10, n_lights=10, seed=0):
+    """Bias, flat and light sets in subfolders of ``directory``; returns {kind: paths}."""
+    counts = {"bias": n_bias, "flat": n_flat, "light": n_lights}
+    return {kind: write_set(os.path.join(directory, kind), kind, count, shape, dtype, seed)
+            for kind, count in counts.items()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--preset", default="small", help=f"{', '.join(PRESETS)} or HxW")
+    parser.add_argument("--dtype", default="uint16", choices=DTYPES)
+    parser.add_argument("--bias", type=int, default=10, help="Number of bias frames")
+    parser.add_argument("--flat", type=int, default=10, help="Number of flat frames")
+    parser.add_argument("--lights", type=int, default=10, help="Number of light frames")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", required=True, help="Directory to write into")
+    args = parser.parse_args(argv)
+
+    sets = write_night(args.out, parse_shape(args.preset), args.dtype, args.bias, args.flat,
+                       args.lights, args.seed)
+    for kind, paths in sets.items():
+        print(f"{len(paths)} {kind} frames in {os.path.join(args.out, kind)}")
+
+
+if __name__ == "__main__":
+    main()
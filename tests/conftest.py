@@ -0,0 +1,20 @@
+import os
+
+import numpy as np
+import pytest
+from astropy.io import fits
+
+
+@pytest.fixture
+def write_frames(tmp_path):
+    """Write each image of a stack to its own FITS file; returns the paths."""
+    def write(stack, name="frame", directory=None):
+        directory = directory or tmp_path
+        os.makedirs(directory, exist_ok=True)
+        paths = []
+        for i, data in enumerate(stack):
+            path = os.path.join(directory, f"{name}{i:04d}.fits")
+            fits.writeto(path, np.asarray(data), overwrite=True)
+            paths.append(path)
+        return paths
+    return write
@@ -0,0 +1,66 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+from synthetic import write_night  # noqa: E402
+
+from astroreduct.batch import JobQueue, default_output_dir, plan_night, run_queue  # noqa: E402
+
+N_LIGHTS = 4
+
+
+@pytest.fixture
+def night(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    monkeypatch.setenv("XDG_DATA_HOME", str(tmp_path / "data"))
+    path = tmp_path / "nights" / "2026-10-17"
+    write_night(str(path), (48, 64), n_bias=3, n_flat=3, n_lights=N_LIGHTS)
+    return str(path)
+
+
+def reduce(queue_path, night, output_dir=None):
+    with JobQueue(queue_path) as queue:
+        job_id = queue.add(night, output_dir)
+    assert run_queue(queue_path, workers=1) == {"done": 1}
+    with JobQueue(queue_path) as queue:
+        return queue.job(job_id)
+
+
+def light_steps(job):
+    return [step for step in job["steps"] if step["kind"] == "lights"]
+
+
+def test_default_output_is_outside_the_night(night):
+    output_dir = default_output_dir(night)
+    assert not output_dir.startswith(night + os.sep)
+    assert os.path.basename(output_dir) == os.path.basename(night)
+
+
+@pytest.mark.parametrize("inside", [False, True])
+def test_readding_a_reduced_night_does_not_reduce_its_products(tmp_path, night, inside):
+    queue_path = str(tmp_path / "queue.sqlite")
+    output_dir = os.path.join(night, "reduced") if inside else None
+    first = reduce(queue_path, night, output_dir)
+    second = reduce(queue_path, night, output_dir)
+
+    for job in (first, second):
+        (lights,) = light_steps(job)
+        assert len(lights["inputs"]) == N_LIGHTS
+        assert all(os.path.dirname(path) == os.path.join(night, "light") for path in lights["inputs"])
+    calibrated = os.path.join(second["output_dir"], "calibrated")
+    names = [name for _, _, files in os.walk(calibrated) for name in files]
+    assert len(names) == N_LIGHTS
+    assert not any("_cal_cal" in name for name in names)
+
+
+def test_products_copied_into_a_night_are_not_planned(tmp_path, night):
+    first = reduce(str(tmp_path / "queue.sqlite"), night)
+    # Products moved into the night by hand are recognised by their ARKIND keyword
+    stray = os.path.join(night, "old")
+    os.rename(first["output_dir"], stray)
+    steps = plan_night(night, str(tmp_path / "out"), first["options"])
+    (lights,) = light_steps({"steps": steps})
+    assert len(lights["inputs"]) == N_LIGHTS
+    assert not any(path.startswith(stray + os.sep) for step in steps for path in step["inputs"])
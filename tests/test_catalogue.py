@@ -0,0 +1,26 @@
+import os
+
+import numpy as np
+from astropy.io import fits
+
+from astroreduct.catalogue import FrameCatalogue, scan_groups
+
+
+def write_bias(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fits.writeto(path, np.zeros((8, 6), dtype=np.uint16), fits.Header({"IMAGETYP": "Bias Frame"}))
+
+
+def test_non_recursive_scan_groups_only_the_folder(tmp_path):
+    night = tmp_path / "night"
+    write_bias(str(night / "bias0.fits"))
+    write_bias(str(night / "old" / "bias1.fits"))
+    catalogue_path = str(tmp_path / "catalogue.sqlite")
+
+    (recursive,) = scan_groups(str(night), catalogue_path)
+    assert len(recursive.paths) == 2
+    # The subfolder is still catalogued from the first scan, but not part of this one
+    (flat,) = scan_groups(str(night), catalogue_path, recursive=False)
+    assert flat.paths == [str(night / "bias0.fits")]
+    with FrameCatalogue(catalogue_path) as catalogue:
+        assert len(catalogue.frames(str(night))) == 2
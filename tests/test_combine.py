@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from astroreduct.combine import combine_files
+
+
+def sorted_combine(stack, combine_method, reject_method, nlow, nhigh, blank=0.0):
+    """The original in-memory master bias: sort the whole stack, slice, then median or mean."""
+    stack = stack.astype(np.float64)
+    if reject_method == "minmax" and len(stack) > nlow + nhigh:
+        stack = np.sort(stack, axis=0)[nlow:len(stack) - nhigh]
+    stack = np.nan_to_num(stack, nan=blank)
+    if combine_method == "median":
+        return np.median(stack, axis=0)
+    return np.mean(stack, axis=0)
+
+
+@pytest.mark.parametrize("dtype", [np.uint16, np.int16, np.float32])
+@pytest.mark.parametrize("n", [1, 2, 5, 6])
+@pytest.mark.parametrize("combine_method", ["median", "average"])
+@pytest.mark.parametrize("reject_method,nlow,nhigh", [("minmax", 0, 1), ("minmax", 1, 2), ("none", 0, 0)])
+def test_banded_combine_matches_full_sort(write_frames, dtype, n, combine_method, reject_method, nlow, nhigh):
+    stack = np.random.default_rng(n).normal(1000, 50, (n, 37, 29)).astype(dtype)
+    paths = write_frames(stack)
+    expected = sorted_combine(stack, combine_method, reject_method, nlow, nhigh)
+    for memory_limit in (1, 10 ** 9):  # One row per band, and everything in one band
+        master = combine_files(paths, combine_method, reject_method, nlow, nhigh, memory_limit=memory_limit)
+        assert master.dtype == np.float64
+        assert np.array_equal(master.view(np.uint64), expected.view(np.uint64))
+
+
+def test_non_finite_pixels_match_full_sort(write_frames):
+    stack = np.random.default_rng(0).normal(1000, 50, (5, 16, 12)).astype(np.float32)
+    stack[1, 3, 4] = np.nan
+    stack[2, 5, 5] = np.inf
+    paths = write_frames(stack)
+    expected = sorted_combine(stack, "median", "minmax", 0, 1)
+    assert np.array_equal(combine_files(paths, memory_limit=1), expected)
+
+
+def test_statsec_combines_the_section(write_frames):
+    stack = np.random.default_rng(1).normal(1000, 50, (4, 30, 40))
+    paths = write_frames(stack)
+    master = combine_files(paths, statsec=(5, 25, 2, 12))
+    assert np.array_equal(master, sorted_combine(stack[:, 2:12, 5:25], "median", "minmax", 0, 1))
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from astroreduct.combine import combine_files
+from astroreduct.incremental import update_master
+
+
+def bias_stack(n, shape=(20, 14), seed=0):
+    rng = np.random.default_rng(seed)
+    stack = rng.normal(1000.0, 8.0, (n,) + shape)
+    stack[rng.random(stack.shape) < 0.01] += 3000  # Cosmic rays
+    return stack.astype(np.uint16)
+
+
+def frames_opened(calls):
+    """Number of frames read, from the "Loading frames" totals reported."""
+    return sum(total for stage, done, total in calls if stage == "Loading frames" and done == total)
+
+
+@pytest.mark.parametrize("options", [
+    dict(combine_method="median", reject_method="minmax", nlow=0, nhigh=1),
+    dict(combine_method="median", reject_method="minmax", nlow=1, nhigh=2),
+    dict(combine_method="median", reject_method="none", nlow=0, nhigh=0),
+])
+def test_median_update_matches_full_combine(tmp_path, write_frames, options):
+    paths = write_frames(bias_stack(16))
+    state_dir = str(tmp_path / "state")
+    update_master(paths[:12], state_dir, **options)
+
+    # Add four frames and drop two
+    current = paths[2:]
+    calls = []
+    master = update_master(current, state_dir, progress=lambda *call: calls.append(call), **options)
+    assert np.array_equal(master, combine_files(current, **options))
+    assert frames_opened(calls) == 6  # Only the changed frames were read
+
+
+def test_average_update_matches_full_combine(tmp_path, write_frames):
+    options = dict(combine_method="average", reject_method="none", nlow=0, nhigh=0)
+    paths = write_frames(bias_stack(10))
+    state_dir = str(tmp_path / "state")
+    update_master(paths[:8], state_dir, **options)
+    current = paths[1:]
+    # Removing from a running sum can change the last bits
+    assert np.allclose(update_master(current, state_dir, **options), combine_files(current, **options),
+                       rtol=1e-12, atol=0)
+
+
+def test_too_many_changes_fall_back_to_full_combine(tmp_path, write_frames):
+    paths = write_frames(bias_stack(30))
+    state_dir = str(tmp_path / "state")
+    update_master(paths[:5], state_dir, margin=2)
+    assert np.array_equal(update_master(paths, state_dir, margin=2), combine_files(paths))
+    # The rebuilt state then takes further small changes
+    assert np.array_equal(update_master(paths[1:], state_dir, margin=2), combine_files(paths[1:]))
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+import astroreduct.combine
+import astroreduct.parallel
+from astroreduct.combine import combine_files
+from astroreduct.incremental import update_master
+
+
+@pytest.fixture(autouse=True)
+def band_runs(monkeypatch):
+    """Parallel runs made, with workers started even for these small stacks."""
+    monkeypatch.setattr(astroreduct.combine, "PARALLEL_MIN_VALUES", 0)
+    runs = []
+    map_bands = astroreduct.parallel.map_bands
+
+    def counted(*args, **kwargs):
+        runs.append(args[3])
+        return map_bands(*args, **kwargs)
+    monkeypatch.setattr(astroreduct.parallel, "map_bands", counted)
+    return runs
+
+
+@pytest.fixture(scope="module")
+def stack():
+    rng = np.random.default_rng(0)
+    data = rng.normal(1000.0, 8.0, (9, 40, 24))
+    data[rng.random(data.shape) < 0.01] += 3000
+    return data.astype(np.uint16)
+
+
+@pytest.mark.parametrize("options", [
+    dict(combine_method="median", reject_method="minmax", nlow=0, nhigh=1, bias=np.full((40, 24), 990.0)),
+    dict(combine_method="average", reject_method="none"),
+    dict(combine_method="median", reject_method="sigclip"),
+    dict(combine_method="median", reject_method="minmax", scale="median", statsec=(2, 20, 5, 35)),
+])
+def test_parallel_bands_match_serial(write_frames, stack, band_runs, options):
+    paths = write_frames(stack)
+    serial = combine_files(paths, workers=1, **options)
+    parallel = combine_files(paths, workers=2, memory_limit=4096, **options)
+    assert band_runs == [2]
+    assert np.array_equal(serial, parallel)
+
+
+def test_parallel_state_rebuild_matches_serial(tmp_path, write_frames, stack, band_runs):
+    paths = write_frames(stack)
+    serial = update_master(paths, str(tmp_path / "serial"), workers=1)
+    parallel = update_master(paths, str(tmp_path / "parallel"), workers=2, memory_limit=4096)
+    assert band_runs == [2]
+    assert np.array_equal(serial, parallel)
+    # Both states then update to the same master
+    assert np.array_equal(update_master(paths[1:], str(tmp_path / "serial")),
+                          update_master(paths[1:], str(tmp_path / "parallel")))
@@ -0,0 +1,12 @@
+import numpy as np
+
+from astroreduct.thumbnails import ThumbnailCache
+
+
+def test_cache_lookup_of_a_missing_file_is_a_miss(tmp_path):
+    cache = ThumbnailCache(str(tmp_path / "cache"))
+    missing = str(tmp_path / "moved.fits")
+    assert cache.get(missing) is None
+    assert cache.get_limits(missing) is None
+    cache.put(missing, np.zeros((4, 4), dtype=np.uint8))  # Nothing to key it by; not stored
+    assert list((tmp_path / "cache").iterdir()) == []